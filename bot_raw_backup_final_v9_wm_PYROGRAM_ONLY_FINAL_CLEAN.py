@@ -30,10 +30,15 @@ def _parse_link_or_pending(m):
 """
 Final RAW backup bot v2 (patched)
 - /tgprobackup -> normal backup
+- /tgpromirror <source> [dest] -> live mirror (new posts + edits, gap-fill after restarts)
 - Robust peer-load fixes for fresh/new session strings:
   * larger dialog preload
   * RAW force-load via channels.GetFullChannel with access_hash=0
-  * ensure_peer called before processing each message
+  * ensure_peer backed by a persistent peer cache (peers.json)
+- Adaptive FloodWait-aware rate limiter (per chat + send/edit/forward/get) instead of fixed sleeps
+- Media dedup index: repeated files are sent by file_id instead of downloaded/uploaded again
+- Segmented watermarking: large videos are split at keyframes and encoded on all cores in parallel
+- Overlay watermark: text/logo rendered once per resolution into a cached PNG, composited with `overlay`
 """
 # ================= FLOODWAIT SAFE EDIT HELPER =================
 from pyrogram.errors import FloodWait
@@ -41,24 +46,17 @@ import random
 
 async def safe_edit_message(app, chat_id: int, msg_id: int, text: str) -> bool:
     """
-    Safely edit caption or text with FloodWait handling.
+    Safely edit caption or text; pacing and FloodWait back-off come from rate_limiter.
     """
-    while True:
+    try:
+        await rate_limiter.call(chat_id, "edit", app.edit_message_caption, chat_id, msg_id, text)
+        return True
+    except Exception:
         try:
-            await app.edit_message_caption(chat_id, msg_id, text)
-            await asyncio.sleep(random.uniform(1.5, 2.5))
+            await rate_limiter.call(chat_id, "edit", app.edit_message_text, chat_id, msg_id, text)
             return True
-        except FloodWait as fw:
-            await asyncio.sleep(fw.value or fw.seconds or 10)
         except Exception:
-            try:
-                await app.edit_message_text(chat_id, msg_id, text)
-                await asyncio.sleep(random.uniform(1.5, 2.5))
-                return True
-            except FloodWait as fw:
-                await asyncio.sleep(fw.value or fw.seconds or 10)
-            except Exception:
-                return False
+            return False
 
 
 import asyncio
@@ -66,19 +64,31 @@ import logging
 import os
 import random
 import re
+import shutil
 import sys
 import json
+import sqlite3
+import time
+import hashlib
+import mimetypes
 from typing import Optional, List, Dict, Any
 
 from flask import Flask
-from pyrogram import Client, filters
-from pyrogram.types import Message
-from pyrogram.errors import FloodWait, RPCError
+from pyrogram import Client, filters, utils as pyro_utils
+from pyrogram.types import Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+from pyrogram.errors import FloodWait, RPCError, MessageNotModified
 
 # raw
 from pyrogram.raw import functions as raw_functions
 from pyrogram.raw import types as raw_types
 
+from ffmpeg_sched import (
+    PRIO_THUMB, PRIO_ENCODE, FFmpegCancelled, ffmpeg_scheduler,
+    probe_video, encode_work, x264_preset_for, x264_args, X264_SPEED,
+)
+from tg_upload import UPLOAD_PART, BIG_FILE_THRESHOLD, save_file_part, uploaded_input_file, ParallelUploader
+from wm_cache import WatermarkCache
+
 def extract_src_caption(msg):
     """Hybrid SRC extractor (simpler): try HTML then Markdown then fallback to raw caption/text."""
     try:
@@ -154,68 +164,351 @@ def save_watermark_state(enabled: bool):
     except Exception:
         pass
 
-async def apply_video_watermark(input_path: str) -> str | None:
+# 🎯 480p cap + white text + soft shadow (top-right)
+WATERMARK_MAX_HEIGHT = 480
+WATERMARK_SCALE = "scale='if(gt(ih,480),-2,iw)':'if(gt(ih,480),480,ih)'"
+WATERMARK_FONT_SCALE = 0.035  # font size as a fraction of the output height
+
+def watermark_drawtext(fontsize: str) -> str:
+    return (
+        "drawtext="
+        "fontfile=/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf:"
+        "text='EduVision':"
+        "fontcolor=white@0.35:"
+        "shadowcolor=black@0.45:"
+        "shadowx=2:"
+        "shadowy=2:"
+        f"fontsize={fontsize}:"
+        "x=w-tw-20:"
+        "y=20"
+    )
+
+WATERMARK_DRAWTEXT = watermark_drawtext(f"h*{WATERMARK_FONT_SCALE}")
+WATERMARK_VF = f"{WATERMARK_SCALE},{WATERMARK_DRAWTEXT}"
+WATERMARK_PRESET = os.environ.get("WATERMARK_PRESET", "veryfast")
+WATERMARK_CRF = int(os.environ.get("WATERMARK_CRF", "25"))
+WATERMARK_VIDEO_ENCODE = ["-c:v", "libx264", "-preset", WATERMARK_PRESET, "-crf", str(WATERMARK_CRF)]
+WATERMARK_ENCODE = [*WATERMARK_VIDEO_ENCODE, "-c:a", "copy"]
+THUMB_SECOND = 10
+WATERMARK_TIMEOUT = int(os.environ.get("WATERMARK_TIMEOUT", "1800"))  # per ffmpeg process
+# segmented mode: split at keyframes, encode segments in parallel, join with the concat demuxer
+WATERMARK_SEGMENTED = os.environ.get("WATERMARK_SEGMENTED", "1") == "1"
+WATERMARK_SEGMENT_SECONDS = int(os.environ.get("WATERMARK_SEGMENT_SECONDS", "60"))
+WATERMARK_SEGMENT_MIN_MB = int(os.environ.get("WATERMARK_SEGMENT_MIN_MB", "64"))
+WATERMARK_JOBS = max(1, int(os.environ.get("WATERMARK_JOBS", "0")) or (os.cpu_count() or 1))
+# overlay mode: render the text (or the WATERMARK_PATH logo when that file exists) once per output size
+# into an RGBA PNG and composite it with `overlay` instead of rasterising drawtext on every frame
+WATERMARK_MODE = os.environ.get("WATERMARK_MODE", "overlay")  # overlay | drawtext
+WATERMARK_ASSET_DIR = os.environ.get("WATERMARK_ASSET_DIR", os.path.join("downloads", ".wmassets"))
+WATERMARK_LOGO_SCALE = 0.08  # logo height as a fraction of the output height
+WATERMARK_LOGO_OPACITY = 0.35
+
+def watermark_asset_signature() -> str:
+    """What the overlay asset is rendered from: the logo file (size + mtime) or the drawtext style."""
     try:
-        base, ext = os.path.splitext(input_path)
-        if not ext:
-            ext = ".mp4"
+        if os.path.exists(WATERMARK_PATH):
+            st = os.stat(WATERMARK_PATH)
+            return f"logo:{st.st_size}:{int(st.st_mtime)}:{WATERMARK_LOGO_SCALE}:{WATERMARK_LOGO_OPACITY}"
+    except Exception:
+        pass
+    return f"text:{WATERMARK_DRAWTEXT}"
+
+def watermark_settings_hash() -> str:
+    """Fingerprint of everything that shapes a watermarked upload (filter, encoder, thumbnail)."""
+    parts = [WATERMARK_VF, WATERMARK_ENCODE, THUMB_SECOND]
+    if WATERMARK_MODE == "overlay":
+        parts += [WATERMARK_MODE, watermark_asset_signature()]
+    blob = json.dumps(parts)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:12]
+
+# ---------- encode planner ----------
+# encode budget: the planner moves to faster presets until the estimate fits
+WATERMARK_BUDGET = int(os.environ.get("WATERMARK_BUDGET", str(WATERMARK_TIMEOUT // 2)))
+# scheduler, ffprobe and the x264 preset stepping are shared with the wm*.py bots (ffmpeg_sched.py)
+
+def watermark_output_size(info: Dict[str, Any]) -> tuple[int, int]:
+    """Output width x height after the 480p cap (854x480 guess without probe info)."""
+    width, height = info.get("width") or 0, info.get("height") or 0
+    if height > WATERMARK_MAX_HEIGHT:
+        return round(width * WATERMARK_MAX_HEIGHT / height / 2) * 2, WATERMARK_MAX_HEIGHT
+    if height:
+        return width, height
+    return 854, 480
+
+def plan_watermark(info: Dict[str, Any], jobs: int = 1, asset: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Cheapest encode for the watermark given the probe: no scale filter when the source is already within
+    WATERMARK_MAX_HEIGHT, the source pixel format when libx264 can keep it, and the configured preset/CRF
+    unless the estimated encode time exceeds WATERMARK_BUDGET, in which case step to faster presets
+    (+1 CRF per step to keep the size in check). Without probe info this is exactly the static command.
+    With `asset` (see watermark_asset) the watermark is an `overlay` of that PNG instead of drawtext.
+    """
+    height = info.get("height") or 0
+    scale = not height or height > WATERMARK_MAX_HEIGHT
+    out_w, out_h = watermark_output_size(info)
+    work = encode_work(info, out_w, out_h, jobs)
+    preset, crf = x264_preset_for(work, WATERMARK_PRESET, WATERMARK_CRF, WATERMARK_BUDGET)
+    encode, pix_fmt = x264_args(preset, crf, info.get("pix_fmt"))
+    if asset:
+        # text strips are rendered full-width (right-aligned), logos are placed 20px from the top-right
+        position = "W-w-20:20" if asset_is_logo(asset) else "W-w:0"
+        base = f"[0:v]{WATERMARK_SCALE}[base];[base]" if scale else "[0:v]"
+        graph = f"{base}[1:v]overlay={position}:format=auto"
+        inputs = ["-i", asset]
+    else:
+        graph = f"[0:v]{WATERMARK_SCALE},{WATERMARK_DRAWTEXT}" if scale else f"[0:v]{WATERMARK_DRAWTEXT}"
+        inputs = []
+    return {
+        "graph": graph,
+        "inputs": inputs,
+        "mode": "overlay" if asset else "drawtext",
+        "video_encode": encode,
+        "scale": scale,
+        "preset": preset,
+        "crf": crf,
+        "pix_fmt": pix_fmt,
+        "size": (out_w, out_h),
+        "jobs": max(1, jobs),
+        "est_seconds": work / X264_SPEED[preset],
+    }
+
+def describe_plan(name: str, info: Dict[str, Any], plan: Dict[str, Any]) -> str:
+    src = f"{info.get('width', '?')}x{info.get('height', '?')} {info.get('codec') or '?'}/{info.get('pix_fmt') or '?'} {info.get('duration') or 0:.0f}s"
+    return (
+        f"{name}: {src} → {'scale+' if plan['scale'] else ''}{plan['mode']} {plan['size'][0]}x{plan['size'][1]}, "
+        f"preset={plan['preset']} crf={plan['crf']} pix_fmt={plan['pix_fmt'] or 'auto'} x{plan['jobs']}, "
+        f"est ~{plan['est_seconds']:.0f}s (budget {WATERMARK_BUDGET}s)"
+    )
+
+async def run_ffmpeg(cmd: List[str], timeout: int = WATERMARK_TIMEOUT, priority: int = PRIO_ENCODE) -> bool:
+    """Run one ffmpeg command through ffmpeg_scheduler; False on non-zero exit, timeout or cancel."""
+    try:
+        returncode, _, stderr = await ffmpeg_scheduler.run(cmd, priority, timeout=timeout)
+    except asyncio.TimeoutError:
+        dlog("❌ [WATERMARK] ffmpeg TIMEOUT:", " ".join(cmd[:8]))
+        return False
+    except FFmpegCancelled:
+        dlog("❌ [WATERMARK] ffmpeg cancelled:", " ".join(cmd[:8]))
+        return False
+    if stderr:
+        dlog("🎨 [WATERMARK] ffmpeg stderr:", stderr.decode(errors="ignore")[:200])
+    return returncode == 0
 
-        out = f"{base}_wm{ext}"
+# ---------- watermark overlay asset ----------
+_asset_locks: Dict[str, asyncio.Lock] = {}
 
-        # 🎯 480p cap + white text + soft shadow (top-right)
-        vf = (
-            "scale='if(gt(ih,480),-2,iw)':'if(gt(ih,480),480,ih)',"
-            "drawtext="
-            "fontfile=/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf:"
-            "text='EduVision':"
-            "fontcolor=white@0.35:"
-            "shadowcolor=black@0.45:"
-            "shadowx=2:"
-            "shadowy=2:"
-            "fontsize=h*0.035:"
-            "x=w-tw-20:"
-            "y=20"
-        )
+def asset_is_logo(path: str) -> bool:
+    return os.path.basename(path).startswith("logo_")
 
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-loglevel", "error",
+async def watermark_asset(width: int, height: int) -> str | None:
+    """
+    RGBA PNG of the watermark for a width x height output, rendered once per size and reused from
+    WATERMARK_ASSET_DIR: the WATERMARK_PATH logo scaled to WATERMARK_LOGO_SCALE of the height, or the
+    drawtext style drawn on a transparent full-width strip (same glyphs and position as drawtext mode).
+    """
+    sig = watermark_asset_signature()
+    kind = "logo" if sig.startswith("logo:") else "text"
+    name = f"{kind}_{hashlib.sha1(sig.encode('utf-8')).hexdigest()[:12]}_{width}x{height}.png"
+    path = os.path.join(WATERMARK_ASSET_DIR, name)
+    async with _asset_locks.setdefault(path, asyncio.Lock()):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            return path
+        os.makedirs(WATERMARK_ASSET_DIR, exist_ok=True)
+        tmp = f"{os.path.splitext(path)[0]}.tmp.png"
+        if kind == "logo":
+            logo_h = max(2, round(height * WATERMARK_LOGO_SCALE / 2) * 2)
+            cmd = [
+                "ffmpeg", "-y", "-loglevel", "error",
+                "-i", WATERMARK_PATH,
+                "-vf", f"scale=-2:{logo_h},format=rgba,colorchannelmixer=aa={WATERMARK_LOGO_OPACITY}",
+                "-frames:v", "1", "-pix_fmt", "rgba",
+                tmp
+            ]
+        else:
+            fontsize = max(1, round(height * WATERMARK_FONT_SCALE))
+            strip = min(height, 20 + fontsize * 2 + 2)  # y=20 + line height + shadow
+            cmd = [
+                "ffmpeg", "-y", "-loglevel", "error",
+                "-f", "lavfi", "-i", f"color=c=black@0.0:s={width}x{strip}:d=1,format=rgba",
+                "-vf", watermark_drawtext(str(fontsize)),
+                "-frames:v", "1", "-pix_fmt", "rgba",
+                tmp
+            ]
+        if await run_ffmpeg(cmd, timeout=60, priority=PRIO_THUMB) and os.path.exists(tmp) and os.path.getsize(tmp) > 0:
+            os.replace(tmp, path)
+            dlog("🎨 [WATERMARK] rendered overlay asset:", path)
+            return path
+        try:
+            os.remove(tmp)
+        except Exception:
+            pass
+    dlog("❌ [WATERMARK] overlay asset render failed → drawtext")
+    return None
+
+def _encode_outputs(plan: Dict[str, Any], out: str, audio: List[str], thumb: Optional[str] = None, thumb_at: float = 0) -> List[str]:
+    """Output args of one watermark encode; with `thumb` the same decode also writes the thumbnail JPEG."""
+    audio_map = [] if "-an" in audio else ["-map", "0:a:0?"]
+    if not thumb:
+        return [
+            "-filter_complex", f"{plan['graph']}[wm]",
+            "-map", "[wm]", *audio_map, *plan["video_encode"], *audio, out,
+        ]
+    graph = f"{plan['graph']},split=2[wm][th];[th]trim=start={thumb_at:.3f},setpts=PTS-STARTPTS[thumb]"
+    return [
+        "-filter_complex", graph,
+        "-map", "[wm]", *audio_map, *plan["video_encode"], *audio, out,
+        "-map", "[thumb]", "-frames:v", "1", "-q:v", "3", thumb,
+    ]
+
+async def _watermark_single(input_path: str, out: str, plan: Dict[str, Any], thumb: Optional[str] = None,
+                            thumb_at: float = 0) -> str | None:
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-loglevel", "error",
+        "-i", input_path,
+        *plan["inputs"],
+        *_encode_outputs(plan, out, ["-c:a", "copy"], thumb, thumb_at)
+    ]
+    dlog("🎨 [WATERMARK] ffmpeg cmd:", " ".join(cmd))
+    if await run_ffmpeg(cmd) and os.path.exists(out) and os.path.getsize(out) > 0:
+        return out
+    return None
+
+async def _watermark_segmented(input_path: str, out: str, plan: Dict[str, Any], thumb: Optional[str] = None,
+                               thumb_at: float = 0) -> str | None:
+    """
+    Split the video stream at keyframes (stream copy), watermark the segments in up to WATERMARK_JOBS
+    parallel ffmpeg processes, then join them with the concat demuxer and copy the audio from the original.
+    The first segment's encode also writes the thumbnail when it reaches `thumb_at`.
+    """
+    work = f"{os.path.splitext(out)[0]}_segments"
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(work, exist_ok=True)
+    try:
+        split = [
+            "ffmpeg", "-y", "-loglevel", "error",
             "-i", input_path,
-            "-vf", vf,
-            "-c:v", "libx264",
-            "-preset", "veryfast",
-            "-crf", "25",
-            "-c:a", "copy",
-            out
+            "-map", "0:v:0", "-c", "copy",
+            "-f", "segment",
+            "-segment_time", str(WATERMARK_SEGMENT_SECONDS),
+            "-reset_timestamps", "1",
+            os.path.join(work, "src_%05d.mkv")
         ]
+        if not await run_ffmpeg(split):
+            return None
+        segments = sorted(n for n in os.listdir(work) if n.startswith("src_"))
+        if not segments:
+            return None
+        dlog(f"🎨 [WATERMARK] {len(segments)} segments, {min(WATERMARK_JOBS, len(segments))} parallel encoders")
 
-        dlog("🎨 [WATERMARK] ffmpeg cmd:", " ".join(cmd))
+        sem = asyncio.Semaphore(WATERMARK_JOBS)
 
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        async def encode(name: str) -> bool:
+            async with sem:
+                return await run_ffmpeg([
+                    "ffmpeg", "-y", "-loglevel", "error",
+                    "-i", os.path.join(work, name),
+                    *plan["inputs"],
+                    *_encode_outputs(plan, os.path.join(work, "wm_" + name[4:]), ["-an"],
+                                     thumb if name == segments[0] else None, thumb_at)
+                ])
 
+        tasks = [asyncio.create_task(encode(n)) for n in segments]
         try:
-            _, stderr = await asyncio.wait_for(proc.communicate(), timeout=1800)
-        except asyncio.TimeoutError:
-            dlog("❌ [WATERMARK] ffmpeg TIMEOUT → skipping watermark")
-            proc.kill()
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        if not all(results):
             return None
 
-        if stderr:
-            dlog("🎨 [WATERMARK] ffmpeg stderr:", stderr.decode(errors="ignore")[:200])
-
-        if os.path.exists(out) and os.path.getsize(out) > 0:
+        concat_list = os.path.join(work, "concat.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for n in segments:
+                f.write(f"file '{os.path.abspath(os.path.join(work, 'wm_' + n[4:]))}'\n")
+        join = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", concat_list,
+            "-i", input_path,
+            "-map", "0:v:0", "-map", "1:a?",
+            "-c", "copy",
+            "-movflags", "+faststart",
+            out
+        ]
+        if await run_ffmpeg(join) and os.path.exists(out) and os.path.getsize(out) > 0:
             return out
+        return None
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+async def watermark_media_job(input_path: str) -> Dict[str, Any] | None:
+    """
+    Watermark + thumbnail + metadata from a single decode of the source: returns the watermarked video,
+    the thumbnail JPEG (THUMB_SECOND in, or mid-way for shorter clips) and the output duration/width/height
+    for send_video. The probe feeding the plan is a header-only ffprobe.
+    """
+    try:
+        base, ext = os.path.splitext(input_path)
+        if not ext:
+            ext = ".mp4"
+
+        out = f"{base}_wm{ext}"
+        thumb = f"{base}_wm_thumb.jpg"
+
+        info = await probe_video(input_path)
+        duration = info.get("duration") or 0
+        thumb_at = min(THUMB_SECOND, duration / 2) if duration else THUMB_SECOND
+        segmented = (
+            WATERMARK_SEGMENTED
+            and WATERMARK_JOBS > 1
+            and os.path.getsize(input_path) >= WATERMARK_SEGMENT_MIN_MB * 1024 * 1024
+        )
+        asset = None
+        if WATERMARK_MODE == "overlay" and info.get("height"):
+            asset = await watermark_asset(*watermark_output_size(info))
+        t0 = time.monotonic()
+        video = None
+        if segmented:
+            plan = plan_watermark(info, WATERMARK_JOBS, asset)
+            logger.info("🎨 [WATERMARK] plan %s", describe_plan(os.path.basename(input_path), info, plan))
+            video = await _watermark_segmented(input_path, out, plan, thumb, thumb_at)
+            if video:
+                logger.info("🎨 [WATERMARK] segmented encode done in %.1fs", time.monotonic() - t0)
+            else:
+                dlog("❌ [WATERMARK] segmented encode failed → single pass")
+
+        if not video:
+            plan = plan_watermark(info, asset=asset)
+            logger.info("🎨 [WATERMARK] plan %s", describe_plan(os.path.basename(input_path), info, plan))
+            video = await _watermark_single(input_path, out, plan, thumb, thumb_at)
+            if not video:
+                return None
+            logger.info("🎨 [WATERMARK] encode done in %.1fs", time.monotonic() - t0)
+
+        if not (os.path.exists(thumb) and os.path.getsize(thumb) > 0):
+            thumb = await generate_video_thumbnail(video, second=int(thumb_at))
+        width, height = plan["size"] if info.get("height") else (0, 0)
+        return {"video": video, "thumb": thumb, "duration": int(duration), "width": width, "height": height}
 
     except Exception as e:
         dlog("❌ [WATERMARK] exception:", repr(e))
 
     return None
 
+async def apply_video_watermark(input_path: str) -> str | None:
+    job = await watermark_media_job(input_path)
+    if not job:
+        return None
+    if job["thumb"]:
+        try:
+            os.remove(job["thumb"])
+        except Exception:
+            pass
+    return job["video"]
+
 async def generate_video_thumbnail(video_path: str, second: int = 10) -> str | None:
     try:
         thumb = video_path.rsplit(".", 1)[0] + "_thumb.jpg"
@@ -227,12 +520,7 @@ async def generate_video_thumbnail(video_path: str, second: int = 10) -> str | N
             "-q:v", "3",
             thumb
         ]
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        await proc.communicate()
+        await ffmpeg_scheduler.run(cmd, PRIO_THUMB)
         if os.path.exists(thumb):
             return thumb
     except Exception:
@@ -635,6 +923,237 @@ def apply_filters(text: str, filters: dict) -> str:
                 dlog("apply_filters replace error for", bad)
     return out
 
+class FilterEngine:
+    """
+    filters.json compiled once into a single case-insensitive regex (a trie of the keys, longer matches
+    preferred) so a caption or filename is rewritten in one pass instead of one `sub` per key. Rule sets
+    where that could differ from apply_filters' sequential longest-first passes (keys overlapping each
+    other, a replacement containing a key, regex escapes in a replacement) keep the sequential passes,
+    precompiled; so does any text where a replacement would join its neighbours into a key.
+    """
+
+    def __init__(self, filters: dict):
+        self.rules = sorted(filters.items(), key=lambda kv: -len(kv[0]))
+        self.passes = []  # sequential fallback: [(pattern, key, replacement)], longest key first
+        for bad, rep in self.rules:
+            try:
+                self.passes.append((re.compile(re.escape(bad), re.IGNORECASE), bad, rep))
+            except Exception:
+                dlog("FilterEngine compile error for", bad)
+        self.replacements: Dict[str, str] = {}
+        for bad, rep in self.rules:
+            if bad:
+                self.replacements.setdefault(bad.lower(), rep)  # first (longest) key wins, like the passes
+        self.max_len = max((len(k) for k in self.replacements), default=0)
+        self.pattern = None
+        if self.replacements:
+            self.pattern = re.compile(self._trie_regex(list(self.replacements)), re.IGNORECASE)
+        self.single_pass = self.pattern is not None and not self._interacting(self.replacements)
+        dlog(f"FilterEngine: {len(self.replacements)} rules, {'single pass' if self.single_pass else 'sequential'}")
+
+    @staticmethod
+    def _trie_regex(keys: List[str]) -> str:
+        trie: Dict[str, Any] = {}
+        for key in keys:
+            node = trie
+            for ch in key:
+                node = node.setdefault(ch, {})
+            node[""] = True
+
+        def build(node: Dict[str, Any]) -> str:
+            branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+            if not branches:
+                return ""
+            body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+            if "" in node:  # a key ends here: try the longer keys first, then stop
+                return f"(?:{body})?"
+            return body
+
+        return build(trie)
+
+    @staticmethod
+    def _interacting(replacements: Dict[str, str]) -> bool:
+        keys = list(replacements)
+        for rep in replacements.values():
+            if "\\" in rep:
+                return True  # re.sub template semantics; keep the sequential passes
+            rep = rep.lower()
+            if any(k in rep for k in keys):
+                return True
+        for i, a in enumerate(keys):
+            for b in keys[i + 1:]:
+                # a match of one key starting inside a match of another
+                for x, y in ((a, b), (b, a)):
+                    if any(y.startswith(x[j:]) for j in range(1, len(x))):
+                        return True
+        return False
+
+    def _sequential(self, out: str) -> str:
+        for pattern, bad, rep in self.passes:
+            try:
+                out = pattern.sub(rep, out)
+            except Exception:
+                try:
+                    out = out.replace(bad, rep)
+                except Exception:
+                    dlog("apply_filters replace error for", bad)
+        return out
+
+    def _joins(self, text: str, start: int, end: int, rep: str) -> bool:
+        """Would replacing text[start:end] with rep make a key across its edges (a later pass would see it)?"""
+        left = text[max(0, start - self.max_len + 1):start]
+        window = left + rep + text[end:end + self.max_len - 1]
+        a, b = len(left), len(left) + len(rep)
+        for i in range(b if rep else a):
+            m = self.pattern.match(window, i)
+            if m and m.end() > a and (rep or i < a):
+                return True
+        return False
+
+    def apply(self, text: str) -> str:
+        if text is None:
+            return ""
+        out = str(text)
+        if not self.pattern:
+            return out
+        if not self.single_pass:
+            return self._sequential(out)
+        parts, pos = [], 0
+        for m in self.pattern.finditer(out):
+            rep = self.replacements.get(m.group(0).lower())
+            if rep is None or self._joins(out, m.start(), m.end(), rep):
+                return self._sequential(out)  # casing the table can't map, or a cascade
+            parts += [out[pos:m.start()], rep]
+            pos = m.end()
+        if not parts:
+            return out
+        parts.append(out[pos:])
+        result = "".join(parts)
+        if self.pattern.search(result):
+            return self._sequential(out)  # adjacent replacements joined into another key
+        return result
+
+# ---------- scoped filter rules ----------
+# filter_rules.json: [{"kind": "text|word|regex|links|mentions", "pattern": "...", "replace": "...",
+#                      "scope": "*" | "src:<chat_id>" | "dest:<chat_id>"}]; applied after filters.json
+FILTER_RULES_FILE = "filter_rules.json"
+RULE_KINDS = ("text", "word", "regex", "links", "mentions")
+LINK_PATTERN = r"(?:https?://|www\.|(?<![\w.])t\.me/|telegram\.(?:me|dog)/)\S+"
+MENTION_PATTERN = r"(?<![\w@])@[A-Za-z]\w{3,31}"
+
+def load_filter_rules() -> List[Dict[str, Any]]:
+    try:
+        if not os.path.exists(FILTER_RULES_FILE):
+            return []
+        with open(FILTER_RULES_FILE, "r", encoding="utf-8") as _f:
+            data = json.load(_f)
+            if isinstance(data, list):
+                return [r for r in data if isinstance(r, dict) and r.get("kind") in RULE_KINDS]
+    except Exception as e:
+        dlog("load_filter_rules failed:", e)
+    return []
+
+def save_filter_rules(rules: List[Dict[str, Any]]):
+    try:
+        with open(FILTER_RULES_FILE, "w", encoding="utf-8") as _f:
+            json.dump(rules, _f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        dlog("save_filter_rules failed:", e)
+
+def parse_rule_scope(text: str) -> Optional[str]:
+    """'src:<chat_id>' / 'dest:<chat_id>' → normalised scope (None when text is not a scope)."""
+    side, _, chat = str(text).partition(":")
+    if side in ("src", "dest") and re.fullmatch(r"-?\d+", chat):
+        return f"{side}:{int(chat)}"
+    return None
+
+def compile_rule(rule: Dict[str, Any]):
+    """Compiled pattern for one filter_rules.json entry (None if it has nothing to match; re.error if invalid)."""
+    kind, pattern = rule.get("kind"), rule.get("pattern") or ""
+    if kind == "links":
+        return re.compile(LINK_PATTERN, re.IGNORECASE)
+    if kind == "mentions":
+        return re.compile(MENTION_PATTERN)
+    if not pattern:
+        return None
+    if kind == "regex":
+        return re.compile(pattern, re.IGNORECASE)
+    if kind == "word":
+        return re.compile(rf"(?<!\w){re.escape(pattern)}(?!\w)", re.IGNORECASE)
+    return re.compile(re.escape(pattern), re.IGNORECASE)
+
+class ScopedFilters:
+    """
+    filters.json (global) plus filter_rules.json, compiled per (source chat, destination) on first use and
+    cached: the scope's plain-text rules merge into one FilterEngine with filters.json, the word/regex/
+    link/mention rules run precompiled in file order. Chats without scoped rules share the global set.
+    When two text rules share a pattern the more specific one wins (filters.json < "*" < src: < dest:,
+    then the later rule in the file). Rebuilt whenever the rules change.
+    """
+
+    def __init__(self, filters: dict, rules: List[Dict[str, Any]]):
+        self.compiled = []  # (scope, kind, pattern text, compiled, replacement)
+        for rule in rules:
+            try:
+                compiled = compile_rule(rule)
+            except re.error as e:
+                dlog("filter rule skipped:", rule, e)
+                continue
+            if compiled is not None:
+                self.compiled.append((rule.get("scope") or "*", rule["kind"], rule.get("pattern") or "",
+                                      compiled, rule.get("replace") or ""))
+        self.filters = dict(filters)
+        self.fingerprint = hashlib.sha1(
+            json.dumps([sorted(self.filters.items()), rules], sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:12]
+        self.scopes = {scope for scope, *_ in self.compiled}
+        self._sets: Dict[frozenset, tuple] = {}  # matching scopes -> (FilterEngine, [(pattern, replacement)])
+        self._by_chat: Dict[tuple, tuple] = {}  # (src, dest) -> entry of _sets
+
+    @staticmethod
+    def _specificity(scope: str) -> int:
+        return 2 if scope.startswith("dest:") else 1 if scope.startswith("src:") else 0
+
+    def _build(self, scopes: frozenset) -> tuple:
+        text_rules = dict(self.filters)
+        ordered = []
+        for scope, kind, raw, compiled, rep in self.compiled:
+            if scope in scopes and kind != "text":
+                ordered.append((compiled, rep))
+        # text rules overwrite the broader ones: filters.json, then "*", src:, dest: (file order within each);
+        # keys match case-insensitively, so an override also drops the broader key in another case
+        keys = {k.lower(): k for k in text_rules}
+        scoped = [r for r in self.compiled if r[0] in scopes and r[1] == "text"]
+        for _, _, raw, _, rep in sorted(scoped, key=lambda r: self._specificity(r[0])):
+            text_rules.pop(keys.get(raw.lower()), None)
+            text_rules[raw] = rep
+            keys[raw.lower()] = raw
+        return FilterEngine(text_rules), ordered
+
+    def for_chat(self, src: Optional[int] = None, dest: Optional[int] = None) -> tuple:
+        entry = self._by_chat.get((src, dest))
+        if entry is None:
+            wanted = {"*", f"src:{src}", f"dest:{dest}"}
+            scopes = frozenset(s for s in wanted if s in self.scopes)
+            entry = self._sets.get(scopes)
+            if entry is None:
+                entry = self._sets[scopes] = self._build(scopes)
+            self._by_chat[(src, dest)] = entry
+        return entry
+
+    def apply(self, text: str, src: Optional[int] = None, dest: Optional[int] = None) -> str:
+        engine, ordered = self.for_chat(src, dest)
+        out = engine.apply(text)
+        for compiled, rep in ordered:
+            try:
+                out = compiled.sub(rep, out)
+            except Exception as e:
+                dlog("filter rule failed:", compiled.pattern, e)
+        return out
+
+def caption_hash(text: Optional[str]) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()[:16]
+
 # Ensure filters.json exists (created on startup if not present)
 try:
     if not os.path.exists(FILTERS_FILE):
@@ -643,6 +1162,737 @@ try:
 except Exception:
     pass
 
+# ---------- adaptive rate limiter ----------
+# kind -> (initial, floor, ceiling) in requests/second, per destination chat
+RATE_LIMITS = {
+    "send": (0.3, 0.05, float(os.environ.get("RATE_SEND_MAX", "1.0"))),
+    "edit": (0.5, 0.05, float(os.environ.get("RATE_EDIT_MAX", "1.5"))),
+    "forward": (0.5, 0.05, float(os.environ.get("RATE_FORWARD_MAX", "1.0"))),
+    "get": (2.0, 0.2, float(os.environ.get("RATE_GET_MAX", "10.0"))),
+}
+RATE_BURST = 3.0       # tokens a quiet bucket may bank
+RATE_INCREASE = 0.02   # additive step per clean call, as a fraction of the ceiling
+RATE_DECREASE = 0.5    # multiplicative factor on FloodWait
+
+class _RateBucket:
+    def __init__(self, rate: float, floor: float, ceiling: float):
+        self.rate = rate
+        self.floor = floor
+        self.ceiling = ceiling
+        self.tokens = 1.0
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket per (chat_id, kind) whose rate is learned AIMD-style:
+    every clean call nudges the rate up towards the ceiling, every FloodWait halves it
+    and parks the bucket for the server-mandated wait. Pacing therefore settles just under
+    the real server limit instead of a fixed worst-case sleep.
+    """
+    def __init__(self, limits: Optional[Dict[str, tuple]] = None):
+        self.limits = dict(limits or RATE_LIMITS)
+        self.buckets: Dict[tuple, _RateBucket] = {}
+
+    def configure(self, kind: str, initial: Optional[float] = None):
+        _, floor, ceiling = self.limits.get(kind, RATE_LIMITS["send"])
+        if initial is not None:
+            self.limits[kind] = (max(floor, min(ceiling, initial)), floor, ceiling)
+
+    def _bucket(self, chat_id, kind: str) -> _RateBucket:
+        key = (chat_id, kind)
+        b = self.buckets.get(key)
+        if b is None:
+            initial, floor, ceiling = self.limits.get(kind, RATE_LIMITS["send"])
+            b = self.buckets[key] = _RateBucket(initial, floor, ceiling)
+        return b
+
+    async def acquire(self, chat_id, kind: str):
+        b = self._bucket(chat_id, kind)
+        async with b.lock:
+            while True:
+                now = time.monotonic()
+                if now < b.blocked_until:
+                    await asyncio.sleep(b.blocked_until - now)
+                    continue
+                b.tokens = min(RATE_BURST, b.tokens + (now - b.stamp) * b.rate)
+                b.stamp = now
+                if b.tokens >= 1.0:
+                    b.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - b.tokens) / b.rate)
+
+    def try_acquire(self, chat_id, kind: str) -> bool:
+        """Non-blocking variant for best-effort calls (progress edits): take a token if one is there."""
+        b = self._bucket(chat_id, kind)
+        now = time.monotonic()
+        if b.lock.locked() or now < b.blocked_until:
+            return False
+        b.tokens = min(RATE_BURST, b.tokens + (now - b.stamp) * b.rate)
+        b.stamp = now
+        if b.tokens < 1.0:
+            return False
+        b.tokens -= 1.0
+        return True
+
+    def on_success(self, chat_id, kind: str):
+        b = self._bucket(chat_id, kind)
+        b.rate = min(b.ceiling, b.rate + b.ceiling * RATE_INCREASE)
+
+    def on_flood(self, chat_id, kind: str, seconds: float):
+        b = self._bucket(chat_id, kind)
+        b.rate = max(b.floor, b.rate * RATE_DECREASE)
+        b.tokens = 0.0
+        b.blocked_until = max(b.blocked_until, time.monotonic() + seconds)
+        logger.warning("FloodWait %ss on %s/%s -> %.2f req/s", seconds, chat_id, kind, b.rate)
+
+    async def call(self, chat_id, kind: str, fn, *args, **kwargs):
+        """Run `await fn(*args, **kwargs)` under the (chat_id, kind) bucket, retrying through FloodWait."""
+        while True:
+            await self.acquire(chat_id, kind)
+            try:
+                result = await fn(*args, **kwargs)
+            except FloodWait as fw:
+                self.on_flood(chat_id, kind, getattr(fw, "value", None) or getattr(fw, "seconds", None) or 10)
+                continue
+            self.on_success(chat_id, kind)
+            return result
+
+rate_limiter = AdaptiveRateLimiter()
+
+# ---------- peer cache ----------
+PEER_CACHE_FILE = "peers.json"
+PEER_NEGATIVE_TTL = int(os.environ.get("PEER_NEGATIVE_TTL", "600"))
+
+def _peer_type_name(chat_type) -> str:
+    # pyrogram 2 uses enums.ChatType; storage expects "user"/"bot"/"group"/"channel"/"supergroup"
+    t = getattr(chat_type, "value", chat_type)
+    return str(t or "channel").lower()
+
+class PeerCache:
+    """
+    chat_id -> {"access_hash", "type", "title", "username"} persisted to PEER_CACHE_FILE,
+    plus an in-memory negative cache so unresolvable peers are not retried for PEER_NEGATIVE_TTL s.
+    """
+
+    def __init__(self, path: str = PEER_CACHE_FILE, negative_ttl: int = PEER_NEGATIVE_TTL):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self.peers: Dict[int, Dict[str, Any]] = {}
+        self.misses: Dict[int, float] = {}
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.peers = {int(k): v for k, v in data.items() if isinstance(v, dict)}
+        except Exception as e:
+            dlog("peer cache load failed:", e)
+            self.peers = {}
+
+    def save(self):
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({str(k): v for k, v in self.peers.items()}, f, ensure_ascii=False)
+        except Exception as e:
+            dlog("peer cache save failed:", e)
+
+    def get(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        return self.peers.get(int(chat_id))
+
+    def put(self, chat_id: int, access_hash: int, peer_type: str, title: Optional[str] = None, username: Optional[str] = None):
+        self.peers[int(chat_id)] = {
+            "access_hash": int(access_hash or 0),
+            "type": peer_type,
+            "title": title or str(chat_id),
+            "username": username,
+        }
+        self.misses.pop(int(chat_id), None)
+
+    def is_negative(self, chat_id: int) -> bool:
+        ts = self.misses.get(int(chat_id))
+        if ts is None:
+            return False
+        if time.monotonic() - ts > self.negative_ttl:
+            self.misses.pop(int(chat_id), None)
+            return False
+        return True
+
+    def mark_missing(self, chat_id: int):
+        self.misses[int(chat_id)] = time.monotonic()
+
+# ---------- backup job journal ----------
+JOURNAL_DB = os.environ.get("JOURNAL_DB", "backup_journal.db")
+# item states that never need to be processed again on resume
+JOURNAL_FINAL_STATES = ("done", "skipped", "missing")
+
+class BackupJournal:
+    """
+    Durable checkpoint journal for /tgprobackup jobs (SQLite, WAL mode).
+    jobs:  one row per queued job (source, topic, ids, reply chat, destination, status)
+    items: (job, source chat, msg id) -> state + destination message id
+    Jobs with status 'queued'/'running' are reloaded by processor() after a restart.
+    """
+
+    def __init__(self, path: str = JOURNAL_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " chat_id INTEGER NOT NULL, title TEXT, topic_id INTEGER,"
+            " ids TEXT NOT NULL, reply_chat INTEGER, dest INTEGER,"
+            " status TEXT NOT NULL DEFAULT 'queued',"
+            " created REAL, updated REAL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " job_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, msg_id INTEGER NOT NULL,"
+            " state TEXT NOT NULL, dest_msg_id INTEGER, updated REAL,"
+            " PRIMARY KEY (job_id, msg_id))"
+        )
+
+    def create_job(self, chat_info: Dict[str, Any], topic_id: Optional[int], ids: List[int], reply_chat: int, dest: int) -> int:
+        now = time.time()
+        cur = self.conn.execute(
+            "INSERT INTO jobs (chat_id, title, topic_id, ids, reply_chat, dest, status, created, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (chat_info["id"], chat_info.get("title"), topic_id, json.dumps(ids), reply_chat, dest, now, now),
+        )
+        return cur.lastrowid
+
+    def set_job_status(self, job_id: int, status: str):
+        self.conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (status, time.time(), job_id))
+
+    def unfinished_jobs(self) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT id, chat_id, title, topic_id, ids, reply_chat, dest FROM jobs"
+            " WHERE status IN ('queued', 'running') ORDER BY id"
+        ).fetchall()
+        return [
+            {"id": r[0], "chat_id": r[1], "title": r[2], "topic_id": r[3], "ids": json.loads(r[4]), "reply_chat": r[5], "dest": r[6]}
+            for r in rows
+        ]
+
+    def finished_ids(self, job_id: int) -> set:
+        marks = ",".join("?" * len(JOURNAL_FINAL_STATES))
+        rows = self.conn.execute(
+            f"SELECT msg_id FROM items WHERE job_id = ? AND state IN ({marks})",
+            (job_id, *JOURNAL_FINAL_STATES),
+        ).fetchall()
+        return {r[0] for r in rows}
+
+    def mark(self, job_id: int, chat_id: int, msg_id: int, state: str, dest_msg_id: Optional[int] = None):
+        self.conn.execute(
+            "INSERT INTO items (job_id, chat_id, msg_id, state, dest_msg_id, updated) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(job_id, msg_id) DO UPDATE SET state = excluded.state,"
+            " dest_msg_id = COALESCE(excluded.dest_msg_id, items.dest_msg_id), updated = excluded.updated",
+            (job_id, chat_id, msg_id, state, dest_msg_id, time.time()),
+        )
+
+# ---------- media dedup index ----------
+MEDIA_KINDS = ("video", "document", "photo", "audio", "animation", "voice")
+HASH_CHUNK = 1024 * 1024
+
+def media_of(msg):
+    """(kind, media object) of the file carried by a message, or (None, None)."""
+    for kind in MEDIA_KINDS:
+        media = getattr(msg, kind, None)
+        if media:
+            return kind, media
+    return None, None
+
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class MediaIndex:
+    """
+    Upload index in JOURNAL_DB, so files are sent by reference instead of downloaded/uploaded again:
+    media:   source file_unique_id and/or sha256 of the downloaded bytes -> destination file_id (reposts)
+    sources: (source chat, msg id) -> destination file_id (repeat backups to the same or another destination)
+    `variant` keeps outputs apart that differ for the same source ("raw" or "wm-<watermark settings hash>").
+    """
+
+    def __init__(self, path: str = JOURNAL_DB):
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " unique_id TEXT, sha256 TEXT, variant TEXT NOT NULL,"
+            " kind TEXT NOT NULL, file_id TEXT NOT NULL, updated REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS media_uid ON media (unique_id, variant)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS media_sha ON media (sha256, variant)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " chat_id INTEGER NOT NULL, msg_id INTEGER NOT NULL, variant TEXT NOT NULL,"
+            " kind TEXT NOT NULL, file_id TEXT NOT NULL, updated REAL,"
+            " PRIMARY KEY (chat_id, msg_id, variant))"
+        )
+
+    def _find(self, unique_id: Optional[str], sha256: Optional[str], variant: str):
+        return self.conn.execute(
+            "SELECT id, kind, file_id, unique_id, sha256 FROM media"
+            " WHERE variant = ? AND (unique_id = ? OR sha256 = ?) ORDER BY updated DESC LIMIT 1",
+            (variant, unique_id, sha256),
+        ).fetchone()
+
+    def lookup(self, unique_id: Optional[str], sha256: Optional[str], variant: str) -> Optional[Dict[str, str]]:
+        if not (unique_id or sha256):
+            return None
+        row = self._find(unique_id, sha256, variant)
+        return {"kind": row[1], "file_id": row[2]} if row else None
+
+    def remember(self, unique_id: Optional[str], sha256: Optional[str], variant: str, kind: str, file_id: str):
+        if not (unique_id or sha256) or not file_id:
+            return
+        row = self._find(unique_id, sha256, variant)
+        # fill in a missing key on the matching row; a second source id for the same bytes gets its own row
+        if row and (unique_id is None or row[3] in (None, unique_id)):
+            self.conn.execute(
+                "UPDATE media SET unique_id = COALESCE(?, unique_id), sha256 = COALESCE(?, sha256),"
+                " kind = ?, file_id = ?, updated = ? WHERE id = ?",
+                (unique_id, sha256, kind, file_id, time.time(), row[0]),
+            )
+        else:
+            self.conn.execute(
+                "INSERT INTO media (unique_id, sha256, variant, kind, file_id, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (unique_id, sha256, variant, kind, file_id, time.time()),
+            )
+
+    def lookup_source(self, chat_id: int, msg_id: int, variant: str) -> Optional[Dict[str, str]]:
+        row = self.conn.execute(
+            "SELECT kind, file_id FROM sources WHERE chat_id = ? AND msg_id = ? AND variant = ?",
+            (chat_id, msg_id, variant),
+        ).fetchone()
+        return {"kind": row[0], "file_id": row[1]} if row else None
+
+    def remember_source(self, chat_id: int, msg_id: int, variant: str, kind: str, file_id: str):
+        self.conn.execute(
+            "INSERT INTO sources (chat_id, msg_id, variant, kind, file_id, updated) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(chat_id, msg_id, variant) DO UPDATE SET kind = excluded.kind,"
+            " file_id = excluded.file_id, updated = excluded.updated",
+            (chat_id, msg_id, variant, kind, file_id, time.time()),
+        )
+
+    def remember_upload(self, chat_id: int, msg_id: int, unique_id: Optional[str], sha256: Optional[str], variant: str, sent):
+        """Record the file_id of a sent Message under both the source message and its content keys."""
+        kind, media = media_of(sent)
+        if not media:
+            return
+        self.remember_source(chat_id, msg_id, variant, kind, media.file_id)
+        self.remember(unique_id, sha256, variant, kind, media.file_id)
+
+    def forget(self, file_id: str):
+        """Drop a reference the server no longer accepts."""
+        self.conn.execute("DELETE FROM media WHERE file_id = ?", (file_id,))
+        self.conn.execute("DELETE FROM sources WHERE file_id = ?", (file_id,))
+
+# ---------- live mirror registry ----------
+MIRROR_ALBUM_WAIT = float(os.environ.get("MIRROR_ALBUM_WAIT", "2"))  # seconds to wait for the rest of a live album
+
+class MirrorStore:
+    """
+    /tgpromirror state in JOURNAL_DB:
+    mirrors:    source chat -> destination, title, last synced source msg id (catch-up starts after it)
+    mirror_map: (source chat, source msg id, destination) -> destination msg id (source edits become dest edits)
+    """
+
+    def __init__(self, path: str = JOURNAL_DB):
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS mirrors ("
+            " source INTEGER PRIMARY KEY, dest INTEGER NOT NULL, title TEXT,"
+            " last_id INTEGER NOT NULL DEFAULT 0, created REAL, updated REAL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS mirror_map ("
+            " source INTEGER NOT NULL, src_id INTEGER NOT NULL, dest INTEGER NOT NULL, dest_id INTEGER NOT NULL,"
+            " updated REAL, PRIMARY KEY (source, src_id, dest))"
+        )
+
+    def add(self, source: int, dest: int, title: Optional[str], last_id: int):
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO mirrors (source, dest, title, last_id, created, updated) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(source) DO UPDATE SET dest = excluded.dest, title = excluded.title, updated = excluded.updated",
+            (source, dest, title, last_id, now, now),
+        )
+
+    def remove(self, source: int) -> bool:
+        cur = self.conn.execute("DELETE FROM mirrors WHERE source = ?", (source,))
+        return cur.rowcount > 0
+
+    def get(self, source: int) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT source, dest, title, last_id FROM mirrors WHERE source = ?", (source,)).fetchone()
+        return {"source": row[0], "dest": row[1], "title": row[2], "last_id": row[3]} if row else None
+
+    def all(self) -> List[Dict[str, Any]]:
+        rows = self.conn.execute("SELECT source, dest, title, last_id FROM mirrors ORDER BY created").fetchall()
+        return [{"source": r[0], "dest": r[1], "title": r[2], "last_id": r[3]} for r in rows]
+
+    def advance(self, source: int, msg_id: int):
+        self.conn.execute(
+            "UPDATE mirrors SET last_id = MAX(last_id, ?), updated = ? WHERE source = ?",
+            (msg_id, time.time(), source),
+        )
+
+    def map(self, source: int, src_id: int, dest: int, dest_id: Optional[int]):
+        if dest_id is None:
+            return
+        self.conn.execute(
+            "INSERT INTO mirror_map (source, src_id, dest, dest_id, updated) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(source, src_id, dest) DO UPDATE SET dest_id = excluded.dest_id, updated = excluded.updated",
+            (source, src_id, dest, dest_id, time.time()),
+        )
+
+    def lookup(self, source: int, src_id: int, dest: int) -> Optional[int]:
+        row = self.conn.execute(
+            "SELECT dest_id FROM mirror_map WHERE source = ? AND src_id = ? AND dest = ?", (source, src_id, dest)
+        ).fetchone()
+        return row[0] if row else None
+
+# ---------- parallel download engine ----------
+STREAM_CHUNK = 1024 * 1024  # stream_media yields (and offsets in) 1 MiB upload.GetFile parts
+DOWNLOAD_PART_MB = max(1, int(os.environ.get("DOWNLOAD_PART_MB", "8")))  # smallest range worth its own media session
+DOWNLOAD_PARALLEL = max(1, int(os.environ.get("DOWNLOAD_PARALLEL", "4")))  # concurrent ranges per file
+# below this a plain download_media wins: every range opens its own media session (an auth-key exchange when
+# the file lives on another DC), which only pays off once there is enough file to split
+PARALLEL_DOWNLOAD_MIN_MB = int(os.environ.get("PARALLEL_DOWNLOAD_MIN_MB", "20"))
+DOWNLOAD_RANGE_RETRIES = 3
+PARTIAL_DIR = os.path.join("downloads", ".partial")
+PARTIAL_SAVE_EVERY = 8  # parts between sidecar writes
+
+class ParallelDownloader:
+    """
+    Multi-connection, resumable download: the missing parts of a file are split into about DOWNLOAD_PARALLEL
+    ranges (at least DOWNLOAD_PART_MB each, since every range is a new media session) pulled by concurrent
+    app.stream_media(offset, limit) streams (each a run of upload.GetFile calls on the file's DC) and written
+    at their offsets into a preallocated `.part` file. The streams only overlap when the Client allows enough
+    max_concurrent_transmissions (see BackupBotFinalV2.__init__). Each stream holds one 1 MiB chunk at a
+    time, so memory is bounded by DOWNLOAD_PARALLEL x download workers chunks.
+    With a key (the source file_unique_id) the `.part` lives in PARTIAL_DIR next to a `.part.json` sidecar of
+    completed part ranges, so any later attempt — another fallback step or a restarted bot — resumes it.
+    """
+
+    def __init__(self, part_mb: int = DOWNLOAD_PART_MB, parallel: int = DOWNLOAD_PARALLEL, partial_dir: str = PARTIAL_DIR):
+        self.part_chunks = part_mb
+        self.parallel = parallel
+        self.partial_dir = partial_dir
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+    def _partial(self, key: str):
+        base = os.path.join(self.partial_dir, safe_filename(key))
+        return base + ".part", base + ".part.json"
+
+    @staticmethod
+    def _load_done(sidecar: str, size: int) -> set:
+        try:
+            with open(sidecar, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("size") != size:
+                return set()
+            return {p for a, b in data.get("ranges", []) for p in range(a, b)}
+        except Exception:
+            return set()
+
+    @staticmethod
+    def _save_done(sidecar: str, size: int, done: set):
+        ranges = []
+        for p in sorted(done):
+            if ranges and ranges[-1][1] == p:
+                ranges[-1][1] = p + 1
+            else:
+                ranges.append([p, p + 1])
+        try:
+            tmp = sidecar + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"size": size, "ranges": ranges}, f)
+            os.replace(tmp, sidecar)
+        except Exception as e:
+            dlog("partial sidecar save failed:", e)
+
+    def discard(self, key: Optional[str]):
+        """Forget a partial download (the file was obtained some other way)."""
+        if not key:
+            return
+        for p in self._partial(key):
+            try:
+                os.remove(p)
+            except Exception:
+                pass
+
+    async def _fetch_range(self, app, src, f, start: int, count: int, mark):
+        pos, end = start, start + count
+        attempt = 0
+        while pos < end:
+            gen = app.stream_media(src, limit=end - pos, offset=pos)
+            try:
+                while pos < end:
+                    chunk = await gen.__anext__()
+                    f.seek(pos * STREAM_CHUNK)
+                    f.write(chunk)
+                    mark(pos)
+                    pos += 1
+            except StopAsyncIteration:
+                if pos < end:
+                    raise IOError(f"stream ended early at part {pos} of {end}")
+            except FloodWait as fw:
+                await asyncio.sleep(getattr(fw, "value", None) or getattr(fw, "seconds", None) or 10)
+            except Exception as e:
+                attempt += 1
+                dlog("⬇️ [PARALLEL] range", start, "failed at part", pos, "attempt", attempt, e)
+                if attempt > DOWNLOAD_RANGE_RETRIES:
+                    raise
+            finally:
+                await gen.aclose()
+
+    async def download(self, app, src, path: str, size: int, key: Optional[str] = None) -> Optional[str]:
+        lock = self.locks.setdefault(key or path, asyncio.Lock())
+        async with lock:
+            return await self._download(app, src, path, size, key)
+
+    async def _download(self, app, src, path: str, size: int, key: Optional[str]) -> Optional[str]:
+        parts = -(-size // STREAM_CHUNK)
+        if key:
+            os.makedirs(self.partial_dir, exist_ok=True)
+            work, sidecar = self._partial(key)
+        else:
+            work, sidecar = path + ".part", None
+
+        done = set()
+        if sidecar and os.path.exists(work) and os.path.getsize(work) == size:
+            done = self._load_done(sidecar, size)
+        if done:
+            dlog("⬇️ [RESUME]", key, "has", len(done), "/", parts, "parts on disk")
+        else:
+            with open(work, "wb") as f:
+                f.truncate(size)
+
+        # one range per stream where possible: fewer, longer ranges mean fewer media sessions
+        span = max(self.part_chunks, -(-(parts - len(done)) // self.parallel))
+        ranges = asyncio.Queue()
+        run = []
+        for p in range(parts):
+            if p in done:
+                continue
+            if run and (run[-1] + 1 != p or len(run) >= span):
+                ranges.put_nowait((run[0], len(run)))
+                run = []
+            run.append(p)
+        if run:
+            ranges.put_nowait((run[0], len(run)))
+
+        unsaved = [0]
+
+        def mark(p: int):
+            done.add(p)
+            unsaved[0] += 1
+            if sidecar and unsaved[0] >= PARTIAL_SAVE_EVERY:
+                unsaved[0] = 0
+                self._save_done(sidecar, size, done)
+
+        async def worker():
+            with open(work, "r+b") as f:
+                while not ranges.empty():
+                    start, count = ranges.get_nowait()
+                    await self._fetch_range(app, src, f, start, count, mark)
+
+        t0 = time.monotonic()
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.parallel, ranges.qsize()))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if sidecar:
+                self._save_done(sidecar, size, done)  # keep the .part for the next attempt
+            else:
+                try:
+                    os.remove(work)
+                except Exception:
+                    pass
+            raise
+        if os.path.getsize(work) != size:
+            raise IOError(f"size mismatch {os.path.getsize(work)} != {size}")
+        os.replace(work, path)
+        if sidecar:
+            try:
+                os.remove(sidecar)
+            except Exception:
+                pass
+        dlog("⬇️ [PARALLEL] %d MiB in %.1fs" % (size // STREAM_CHUNK, time.monotonic() - t0))
+        return path
+
+# ---------- parallel upload engine ----------
+PARALLEL_UPLOAD_MIN_MB = int(os.environ.get("PARALLEL_UPLOAD_MIN_MB", "10"))
+
+# ---------- streaming relay (download -> upload without disk) ----------
+# A relay holds one of Pyrogram's max_concurrent_transmissions slots (get_file) for the whole file. Relays
+# run in the download workers, one per worker at most, and the Client sizes that semaphore for every
+# worker's DOWNLOAD_PARALLEL ranges (BackupBotFinalV2.__init__), so a relay no longer stalls the other
+# downloads; with Pyrogram's default of 1 slot it would serialize the whole download stage behind it.
+RELAY_ENABLED = os.environ.get("RELAY_MODE", "1") == "1"
+RELAY_BUFFER_MB = max(1, int(os.environ.get("RELAY_BUFFER_MB", "8")))
+RELAY_UPLOAD_WORKERS = max(1, int(os.environ.get("RELAY_UPLOAD_WORKERS", "4")))
+
+class StreamRelay:
+    """
+    Pipes a source file to Telegram's upload servers with no local copy: stream_media 1 MiB chunks are cut
+    into 512 KiB parts and pass through a bounded queue (the ring buffer) to RELAY_UPLOAD_WORKERS concurrent
+    SaveFilePart/SaveBigFilePart calls. Peak memory per file stays around RELAY_BUFFER_MB plus one part per
+    worker. upload() returns the raw InputFile/InputFileBig for messages.SendMedia and the sha256 of the bytes.
+    """
+
+    def __init__(self, buffer_mb: int = RELAY_BUFFER_MB, workers: int = RELAY_UPLOAD_WORKERS):
+        self.buffer_parts = max(1, buffer_mb * STREAM_CHUNK // UPLOAD_PART)
+        self.workers = workers
+
+    async def upload(self, app, src, size: int, name: str):
+        file_id = random.getrandbits(63)
+        is_big = size > BIG_FILE_THRESHOLD
+        total_parts = -(-size // UPLOAD_PART)
+        ring = asyncio.Queue(maxsize=self.buffer_parts)
+        digest = hashlib.sha256()
+
+        async def producer():
+            idx = 0
+            async for chunk in app.stream_media(src):
+                digest.update(chunk)
+                for off in range(0, len(chunk), UPLOAD_PART):
+                    await ring.put((idx, chunk[off:off + UPLOAD_PART]))
+                    idx += 1
+            if idx != total_parts:
+                raise IOError(f"relay got {idx} parts, expected {total_parts}")
+            for _ in range(self.workers):
+                await ring.put(None)
+
+        async def uploader():
+            while True:
+                job = await ring.get()
+                if job is None:
+                    return
+                idx, data = job
+                await save_file_part(app, file_id, idx, total_parts, is_big, data)
+
+        t0 = time.monotonic()
+        tasks = [asyncio.create_task(producer())] + [asyncio.create_task(uploader()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        dlog("🔁 [RELAY] %s: %d parts in %.1fs" % (name, total_parts, time.monotonic() - t0))
+        return uploaded_input_file(file_id, total_parts, name, is_big), digest.hexdigest()
+
+# ---------- batch message prefetch ----------
+FETCH_BATCH_SIZE = 100  # max ids per messages.GetMessages / channels.GetMessages call
+FORWARD_BATCH_SIZE = 100  # max ids per messages.ForwardMessages call
+FORWARD_RUNS_AHEAD = 3  # fetched forward runs allowed to wait ahead of the send stage
+# ForwardMessages errors that refuse the whole source/destination pair, not one message: bisecting cannot help
+FORWARD_FATAL_ERRORS = (
+    "CHAT_FORWARDS_RESTRICTED", "CHAT_WRITE_FORBIDDEN", "CHAT_ADMIN_REQUIRED", "CHAT_SEND_MEDIA_FORBIDDEN",
+    "CHANNEL_PRIVATE", "CHANNEL_INVALID", "CHAT_ID_INVALID", "PEER_ID_INVALID", "USER_BANNED_IN_CHANNEL",
+)
+
+def forward_error_is_fatal(e: Exception) -> bool:
+    ident = str(getattr(e, "ID", None) or "")
+    return ident in FORWARD_FATAL_ERRORS or any(name in str(e) for name in FORWARD_FATAL_ERRORS)
+ALBUM_MAX = 10  # max items per send_media_group
+
+class MessagePrefetcher:
+    """
+    Resolve a list of message ids in chunks of FETCH_BATCH_SIZE ids per RPC.
+    Keeps at most `lookahead` messages fetched ahead of the consumer.
+
+        async for mid, msg in MessagePrefetcher(app, chat_id, ids):
+            ...   # msg is None when the id is missing/deleted
+
+    Ids are yielded in the order given. If a whole chunk fails, its ids fall
+    back to `fallback(chat_id, mid)` one by one (usually bot.fetch_message).
+    """
+
+    def __init__(self, app, chat_id: int, ids: List[int], lookahead: int = 300, concurrency: int = 2, fallback=None):
+        self.app = app
+        self.chat_id = chat_id
+        self.ids = list(ids)
+        self.chunks = [self.ids[i:i + FETCH_BATCH_SIZE] for i in range(0, len(self.ids), FETCH_BATCH_SIZE)]
+        self.fallback = fallback
+        self.max_chunks_ahead = max(1, lookahead // FETCH_BATCH_SIZE)
+        self.sem = asyncio.Semaphore(max(1, concurrency))
+        self.rpc_calls = 0
+        self._producer = None
+        self._pending: Optional[asyncio.Queue] = None
+
+    async def _fetch_chunk(self, chunk: List[int]) -> Dict[int, Any]:
+        async with self.sem:
+            msgs = None
+            try:
+                self.rpc_calls += 1
+                msgs = await rate_limiter.call(self.chat_id, "get", self.app.get_messages, self.chat_id, chunk)
+            except Exception as e:
+                dlog("prefetch chunk failed:", chunk[0], "-", chunk[-1], e)
+
+        found: Dict[int, Any] = {}
+        if msgs is not None:
+            if not isinstance(msgs, list):
+                msgs = [msgs]
+            for mid, m in zip(chunk, msgs):
+                if m is None or getattr(m, "empty", False):
+                    continue
+                found[getattr(m, "id", None) or getattr(m, "message_id", None) or mid] = m
+            return found
+
+        if self.fallback:
+            for mid in chunk:
+                try:
+                    m = await self.fallback(self.chat_id, mid)
+                    if m:
+                        found[mid] = m
+                except Exception as e:
+                    dlog("prefetch fallback failed:", mid, e)
+        return found
+
+    async def _produce(self):
+        for chunk in self.chunks:
+            task = asyncio.create_task(self._fetch_chunk(chunk))
+            await self._pending.put((chunk, task))
+
+    def close(self):
+        if self._producer:
+            self._producer.cancel()
+        if self._pending:
+            while not self._pending.empty():
+                _, task = self._pending.get_nowait()
+                task.cancel()
+
+    async def __aiter__(self):
+        self._pending = asyncio.Queue(maxsize=self.max_chunks_ahead)
+        self._producer = asyncio.create_task(self._produce())
+        try:
+            for _ in self.chunks:
+                chunk, task = await self._pending.get()
+                found = await task
+                for mid in chunk:
+                    yield mid, found.get(mid)
+        finally:
+            self.close()
+            dlog("prefetch:", len(self.ids), "ids in", self.rpc_calls, "fetch RPCs")
+
 # ---------- bot ----------
 class BackupBotFinalV2:
     def __init__(self):
@@ -659,13 +1909,38 @@ class BackupBotFinalV2:
         self.max_delay = int(os.environ.get("MAX_DELAY", "8"))
         if self.max_delay < self.min_delay:
             self.max_delay = self.min_delay + 3
+        # MIN_DELAY/MAX_DELAY only seed the send rate now; rate_limiter adapts from there
+        avg_delay = (self.min_delay + self.max_delay) / 2.0
+        rate_limiter.configure("send", 1.0 / avg_delay if avg_delay > 0 else float("inf"))
+
+        # backup pipeline stage concurrency (see process_backup)
+        self.fetch_workers = max(1, int(os.environ.get("PIPELINE_FETCH_WORKERS", "2")))
+        self.download_workers = max(1, int(os.environ.get("PIPELINE_DOWNLOAD_WORKERS", "2")))
+        self.transform_workers = max(1, int(os.environ.get("PIPELINE_TRANSFORM_WORKERS", "1")))
+        self.pipeline_window = max(1, int(os.environ.get("PIPELINE_WINDOW", "6")))
+        # how many fetched Message objects may sit in memory ahead of the consumer
+        self.prefetch_lookahead = max(FETCH_BATCH_SIZE, int(os.environ.get("PREFETCH_LOOKAHEAD", "300")))
+        # concurrent caption edits in /tgprofilters_apply (all share one rate-limiter bucket per chat)
+        self.edit_workers = max(1, int(os.environ.get("BULK_EDIT_WORKERS", "3")))
 
         session = os.environ.get("USER_SESSION_STRING")
         client_kwargs = {"api_id": self.api_id, "api_hash": self.api_hash, "sleep_threshold": 60}
         if session:
             client_kwargs["session_string"] = session
-
-        self.app = Client("backup_final_v2", **client_kwargs)
+        # Pyrogram runs every get_file (stream_media / download_media) and save_file under one
+        # Semaphore(max_concurrent_transmissions), default 1, so the ranged downloads and relays of all
+        # download workers would queue behind each other: one slot per range per worker, plus one spare
+        # for everything else (thumbnails, /tgprofilters_apply_cp downloads)
+        client_kwargs["max_concurrent_transmissions"] = self.download_workers * DOWNLOAD_PARALLEL + 1
+        download_parallel = DOWNLOAD_PARALLEL
+        try:
+            self.app = Client("backup_final_v2", **client_kwargs)
+        except TypeError:
+            # older Pyrogram without the setting: transfers serialize anyway, so keep one stream per file
+            client_kwargs.pop("max_concurrent_transmissions")
+            self.app = Client("backup_final_v2", **client_kwargs)
+            download_parallel = 1
+            logger.warning("Pyrogram has no max_concurrent_transmissions: ranged downloads use one stream")
         self.queue: asyncio.Queue = asyncio.Queue()
         self.current_backup = None
         self.processor_task = None
@@ -673,40 +1948,117 @@ class BackupBotFinalV2:
         self.downloads = "downloads"
         os.makedirs(self.downloads, exist_ok=True)
         self._handlers_registered = False
-        # dynamic filters loaded at start
-        self.filters = load_filters()
 
         # watermark state
         self.watermark_enabled = load_watermark_state()
 
-        # dynamic filters loaded at start
+        # resolved peers (persisted); dialogs are scanned at most once per process
+        self.peer_cache = PeerCache()
+        self._dialogs_scanned = False
+
+        # durable job/progress journal (resume after restart)
+        self.journal = BackupJournal()
+        self.media_index = MediaIndex()
+        self.wm_cache = WatermarkCache(JOURNAL_DB)
+        self.downloader = ParallelDownloader(parallel=download_parallel)
+        self.relay = StreamRelay()
+        self.uploader = ParallelUploader()
+
+        # dynamic filters loaded at start (compiled once; rebuilt whenever the rules change)
         self.filters = load_filters()
+        self.filter_rules = load_filter_rules()
+        self.filter_sets = ScopedFilters(self.filters, self.filter_rules)
+
+        # /tgpromirror: persisted sources plus one update queue + worker task per live source
+        self.mirrors = MirrorStore()
+        self.mirror_queues: Dict[int, asyncio.Queue] = {}
+        self.mirror_tasks: Dict[int, asyncio.Task] = {}
+        self.mirror_unmirrored: Dict[int, int] = {}  # source -> edits dropped for lack of a mirror_map row
+
+    async def _remember_chat(self, chat) -> bool:
+        """Store a resolved Chat (id, access_hash, type, title) in the peer cache."""
+        try:
+            access_hash = 0
+            try:
+                peer = await self.app.resolve_peer(chat.id)
+                access_hash = getattr(peer, "access_hash", 0) or 0
+            except Exception as e:
+                dlog("remember_chat: resolve_peer failed", chat.id, e)
+            title = getattr(chat, "title", None) or getattr(chat, "first_name", None)
+            self.peer_cache.put(chat.id, access_hash, _peer_type_name(getattr(chat, "type", None)), title, getattr(chat, "username", None))
+            return True
+        except Exception as e:
+            dlog("remember_chat failed:", e)
+            return False
+
+    async def _seed_peer_storage(self):
+        """Push cached access hashes into the session storage so a fresh session string can resolve them."""
+        rows = []
+        for cid, p in self.peer_cache.peers.items():
+            if p.get("access_hash") or p.get("type") == "group":
+                rows.append((cid, p.get("access_hash", 0), p.get("type", "channel"), p.get("username"), None))
+        if not rows:
+            return
+        try:
+            await self.app.storage.update_peers(rows)
+            dlog("peer cache: seeded", len(rows), "peers into session storage")
+        except Exception as e:
+            dlog("peer cache: storage seed failed", e)
+
+    async def _scan_dialogs_once(self, limit: int = 2000):
+        if self._dialogs_scanned:
+            return
+        self._dialogs_scanned = True
+        n = 0
+        try:
+            async for d in self.app.get_dialogs(limit=limit):
+                if getattr(d, "chat", None) and await self._remember_chat(d.chat):
+                    n += 1
+        except Exception as e:
+            dlog("dialog scan failed", e)
+        self.peer_cache.save()
+        dlog("peer cache: dialog scan cached", n, "peers")
+
+    async def warm_peer_cache(self):
+        """Called once from start(): load persisted peers, seed the session, scan dialogs if the cache is empty."""
+        await self._seed_peer_storage()
+        if not self.peer_cache.peers or os.environ.get("PEER_WARM_DIALOGS", "0") == "1":
+            await self._scan_dialogs_once()
+        logger.info("Peer cache warm: %d peers", len(self.peer_cache.peers))
 
     async def ensure_peer(self, peer_id: int):
         """
         Ensure peer is known to session.
         Steps:
+         0) peer cache hit (O(1)) / negative-cache hit within PEER_NEGATIVE_TTL
          1) try get_chat(peer_id)
-         2) scan dialogs (increased limit)
+         2) scan dialogs - only if not already scanned by this process
          3) RAW force-load using channels.GetFullChannel(InputChannel(channel_id, access_hash=0))
         Returns True if peer resolvable, False otherwise.
         """
+        # 0) cache
+        if self.peer_cache.get(peer_id):
+            return True
+        if self.peer_cache.is_negative(peer_id):
+            dlog("ensure_peer: negative cache hit", peer_id)
+            return False
+
         # 1) try get_chat
         try:
-            await self.app.get_chat(peer_id)
+            chat = await self.app.get_chat(peer_id)
             dlog("ensure_peer: get_chat succeeded", peer_id)
+            await self._remember_chat(chat)
+            self.peer_cache.save()
             return True
         except Exception as e:
             dlog("ensure_peer: get_chat failed", e)
 
-        # 2) scan dialogs (larger limit)
-        try:
-            async for d in self.app.get_dialogs(limit=2000):
-                if getattr(d.chat, "id", None) == peer_id:
-                    dlog("ensure_peer: found in dialogs", peer_id)
-                    return True
-        except Exception as e:
-            dlog("ensure_peer: dialog scan failed", e)
+        # 2) scan dialogs once per process (caches every dialog it sees)
+        if not self._dialogs_scanned:
+            await self._scan_dialogs_once()
+            if self.peer_cache.get(peer_id):
+                dlog("ensure_peer: found in dialogs", peer_id)
+                return True
 
         # 3) RAW force-load via channels.GetFullChannel with access_hash=0
         try:
@@ -720,8 +2072,18 @@ class BackupBotFinalV2:
             inp_channel = raw_types.InputChannel(channel_id=channel_id_for_raw, access_hash=0)
             try:
                 dlog("ensure_peer: invoking channels.GetFullChannel for", channel_id_for_raw)
-                await self.app.invoke(raw_functions.channels.GetFullChannel(channel=inp_channel))
+                full = await self.app.invoke(raw_functions.channels.GetFullChannel(channel=inp_channel))
                 dlog("ensure_peer: RAW GetFullChannel succeeded for", channel_id_for_raw)
+                for ch in getattr(full, "chats", None) or []:
+                    if getattr(ch, "id", None) == channel_id_for_raw:
+                        self.peer_cache.put(
+                            peer_id,
+                            getattr(ch, "access_hash", 0),
+                            "channel" if getattr(ch, "broadcast", False) else "supergroup",
+                            getattr(ch, "title", None),
+                            getattr(ch, "username", None),
+                        )
+                        self.peer_cache.save()
                 return True
             except Exception as e:
                 # try alternative: messages.GetFullChat (for groups) or channels.GetFullChannel fallback tried
@@ -731,6 +2093,7 @@ class BackupBotFinalV2:
             dlog("ensure_peer: RAW fallback exception", e)
 
         dlog("ensure_peer: unable to resolve peer", peer_id)
+        self.peer_cache.mark_missing(peer_id)
         return False
 
     async def fetch_message(self, chat_id: int, msg_id: int):
@@ -749,32 +2112,299 @@ class BackupBotFinalV2:
             pass
         return None
 
-    # --------- NEW robust download fallback (5-step) ----------
-    async def download_with_fallbacks(self, msg_obj, chat_id: int, msg_id: int, filename_hint: Optional[str] = None) -> Optional[str]:
+    def prefetch(self, chat_id: int, ids: List[int]) -> MessagePrefetcher:
+        """Batched, bounded lookahead over `ids` (100 ids per fetch RPC)."""
+        return MessagePrefetcher(
+            self.app, chat_id, ids,
+            lookahead=self.prefetch_lookahead,
+            concurrency=self.fetch_workers,
+            fallback=self.fetch_message,
+        )
+
+    def filter_plan_entry(self, msg, chat_id: int, owner_id: Optional[int]) -> Dict[str, Any]:
         """
-        Steps:
-        1) app.download_media(msg_obj)
-        2) download by file_id (document/photo/video)
-        3) forward to "me" and download forwarded message
-        4) re-fetch high-level message and download
-        5) RAW messages.GetMessages -> convert to pyrogram message via _parse_message -> download_media
+        What /tgprofilters_apply(_cp) needs for one message, so they can run without re-fetching it: status,
+        hash of the current caption, filtered caption for the in-place edit (`new`) and for the copy to
+        dest_channel (`new_cp`, only when scoped rules make it differ), kind and media reference.
         """
-        def build_dest(name: str):
-            safe = safe_filename(name)
-            dest = os.path.join(self.downloads, safe)
-            base, ext = os.path.splitext(dest)
+        if not msg:
+            return {"status": "missing"}
+        cap = extract_src_caption(msg)
+        new_cap = self.filter_sets.apply(cap, chat_id, chat_id)
+        kind, media = media_of(msg)
+        if getattr(msg, "text", None) is not None:
+            kind = "text"
+        entry: Dict[str, Any] = {"old": caption_hash(cap), "new": new_cap, "kind": kind or "other"}
+        new_cp = self.filter_sets.apply(cap, chat_id, self.dest_channel)
+        if new_cp != new_cap:
+            entry["new_cp"] = new_cp
+        if media is not None:
+            entry["media"] = {"unique_id": getattr(media, "file_unique_id", None), "file_id": getattr(media, "file_id", None)}
+        if owner_id is not None and getattr(getattr(msg, "from_user", None), "id", None) != owner_id:
+            entry["status"] = "skip_not_owner"
+        elif kind is None:
+            entry["status"] = "skip"  # nothing captionable (sticker, poll, service message)
+        elif new_cap != (cap or ""):
+            entry["status"] = "will_change"
+        else:
+            entry["status"] = "no_change"
+        return entry
+
+    async def build_filter_plan(self, chat_id: int, ids: List[int]) -> Dict[str, Dict[str, Any]]:
+        owner_me = await self.app.get_me()
+        plan: Dict[str, Dict[str, Any]] = {}
+        async for mid, msg in self.prefetch(chat_id, ids):
+            plan[str(mid)] = self.filter_plan_entry(msg, chat_id, owner_me.id)
+        return plan
+
+    async def bulk_edit_captions(self, chat_id: int, ids: List[int], status_msg=None,
+                                 plan: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Re-caption the owner's messages in chat_id with the current filters. With a /tgprofilters `plan` only
+        the messages it would edit are re-read (batched) to check their caption still hashes to the planned
+        `old`; any edited since the plan counts as `stale` and is left alone. Without a plan every message
+        comes from the batched prefetcher. No-op edits are dropped
+        before any RPC; the rest go to `edit_workers` workers sharing the (chat_id, "edit") rate-limiter
+        bucket, so one FloodWait parks them all. Text messages go straight to edit_message_text and media to
+        edit_message_caption (no failed first attempt).
+        """
+        stats: Dict[str, Any] = {"checked": 0, "edited": 0, "unchanged": 0, "skipped": 0, "missing": 0, "stale": 0, "failed": []}
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.edit_workers * 4)
+        total = len(ids)
+
+        async def progress():
+            # best effort, like process_backup's progress: dropped when the status bucket is empty
+            if status_msg and rate_limiter.try_acquire(status_msg.chat.id, "edit"):
+                await safe_edit(
+                    status_msg,
+                    f"✏️ {stats['checked']}/{total} checked — edited {stats['edited']}, "
+                    f"unchanged {stats['unchanged']}, failed {len(stats['failed'])}"
+                )
+
+        async def worker():
+            while True:
+                job = await queue.get()
+                if job is None:
+                    return
+                mid, text, is_text = job
+                edit = self.app.edit_message_text if is_text else self.app.edit_message_caption
+                try:
+                    await rate_limiter.call(chat_id, "edit", edit, chat_id, mid, text)
+                    stats["edited"] += 1
+                except MessageNotModified:
+                    stats["unchanged"] += 1
+                except Exception as e:
+                    dlog("bulk edit failed for", mid, e)
+                    stats["failed"].append(mid)
+                await progress()
+
+        async def entries():
+            if plan is not None:
+                planned = [mid for mid in ids if (plan.get(str(mid)) or {}).get("status") == "will_change"]
+                current = self.prefetch(chat_id, planned).__aiter__()  # yields in `planned` order
+                try:
+                    for mid in ids:
+                        entry = plan.get(str(mid)) or {"status": "missing"}
+                        if entry.get("status") == "will_change":
+                            _, msg = await current.__anext__()
+                            if not msg:
+                                entry = {"status": "missing"}
+                            elif caption_hash(extract_src_caption(msg)) != entry.get("old"):
+                                entry = {"status": "stale"}
+                        yield mid, entry
+                finally:
+                    # an early exit (stop/cancel, an error downstream) must not leave the prefetch task running
+                    await current.aclose()
+                return
+            owner_me = await self.app.get_me()
+            async for mid, msg in self.prefetch(chat_id, ids):
+                yield mid, self.filter_plan_entry(msg, chat_id, owner_me.id)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.edit_workers)]
+        source = entries()
+        try:
+            async for mid, entry in source:
+                stats["checked"] += 1
+                status = entry.get("status")
+                if status == "missing":
+                    stats["missing"] += 1
+                elif status == "stale":
+                    stats["stale"] += 1  # edited since the plan: the planned caption would overwrite it
+                elif status == "no_change":
+                    stats["unchanged"] += 1
+                elif status != "will_change":
+                    stats["skipped"] += 1
+                elif entry["kind"] == "text" and not entry["new"].strip():
+                    stats["skipped"] += 1  # a text message can't be edited to empty
+                else:
+                    await queue.put((mid, entry["new"], entry["kind"] == "text"))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            await source.aclose()  # runs entries()' own finally, which closes the prefetcher
+            for w in workers:
+                w.cancel()
+        return stats
+
+    async def forward_bulk(self, from_chat: int, ids: List[int], to_chat: int, fallback=None) -> Dict[int, Optional[int]]:
+        """
+        Server-side copy: messages.ForwardMessages with drop_author=True (no "Forwarded from"
+        header, like copy_message) for up to FORWARD_BATCH_SIZE ids per call.
+        Returns {source_id: dest_id} for the ids the server accepted (dest_id from UpdateMessageID, else
+        paired in order with the returned new messages; None if neither resolves it). A rejected batch is bisected so one bad id does not sink its
+        neighbours; each rejected id is handed to `fallback(mid)` right where it sits, so the
+        destination keeps source order. Errors that refuse the whole chat (FORWARD_FATAL_ERRORS, e.g.
+        CHAT_FORWARDS_RESTRICTED) are not bisected: that batch and every later one fall back at once.
+        """
+        mapped: Dict[int, Optional[int]] = {}
+        if not ids:
+            return mapped
+        try:
+            from_peer = await self.app.resolve_peer(from_chat)
+            to_peer = await self.app.resolve_peer(to_chat)
+        except Exception as e:
+            dlog("forward_bulk: resolve_peer failed", e)
+            if fallback:
+                for mid in ids:
+                    await fallback(mid)
+            return mapped
+
+        refused = None  # set once the server refuses the whole chat
+
+        async def send_chunk(chunk: List[int]):
+            nonlocal refused
+            if refused is not None:
+                if fallback:
+                    for mid in chunk:
+                        await fallback(mid)
+                return
+            random_ids = [random.getrandbits(63) for _ in chunk]
+            by_rid = dict(zip(random_ids, chunk))
+            try:
+                res = await rate_limiter.call(to_chat, "forward", self.app.invoke, raw_functions.messages.ForwardMessages(
+                    from_peer=from_peer,
+                    id=chunk,
+                    random_id=random_ids,
+                    to_peer=to_peer,
+                    drop_author=True,
+                ))
+            except Exception as e:
+                dlog("forward_bulk: batch rejected", chunk[0], "-", chunk[-1], e)
+                if forward_error_is_fatal(e):
+                    refused = e
+                    logger.warning("forward_bulk: %s -> %s refused (%s), falling back for the remaining ids", from_chat, to_chat, e)
+                    if fallback:
+                        for mid in chunk:
+                            await fallback(mid)
+                    return
+                if len(chunk) > 1:
+                    half = len(chunk) // 2
+                    await send_chunk(chunk[:half])
+                    await send_chunk(chunk[half:])
+                elif fallback:
+                    await fallback(chunk[0])
+                return
+            for mid in chunk:
+                mapped[mid] = None
+            updates = getattr(res, "updates", None) or []
+            for u in updates:
+                if isinstance(u, raw_types.UpdateMessageID) and u.random_id in by_rid:
+                    mapped[by_rid[u.random_id]] = u.id
+            unresolved = [mid for mid in chunk if mapped[mid] is None]
+            if unresolved:
+                # no UpdateMessageID for these: the new messages are created in request order, so the
+                # unclaimed ones (ascending id) pair with the unresolved source ids when the counts agree
+                claimed = {mapped[mid] for mid in chunk}
+                new_ids = sorted(
+                    u.message.id for u in updates
+                    if isinstance(u, (raw_types.UpdateNewChannelMessage, raw_types.UpdateNewMessage))
+                    and getattr(u.message, "id", None) not in claimed
+                )
+                if len(new_ids) == len(unresolved):
+                    mapped.update(zip(unresolved, new_ids))
+                else:
+                    dlog("forward_bulk: no dest id for", len(unresolved), "of", len(chunk), "forwarded ids")
+
+        for i in range(0, len(ids), FORWARD_BATCH_SIZE):
+            await send_chunk(ids[i:i + FORWARD_BATCH_SIZE])
+        dlog("forward_bulk:", len(mapped), "/", len(ids), "accepted")
+        return mapped
+
+    # --------- NEW robust download fallback (5-step) ----------
+    async def download_with_fallbacks(self, msg_obj, chat_id: int, msg_id: int, filename_hint: Optional[str] = None) -> Optional[str]:
+        """Reserve-then-download wrapper: names claimed by steps that did not win are released afterwards."""
+        reserved: List[str] = []
+        path = None
+        try:
+            path = await self._download_with_fallbacks(msg_obj, chat_id, msg_id, filename_hint, reserved)
+            return path
+        finally:
+            for p in reserved:
+                try:
+                    if p != path and os.path.exists(p) and os.path.getsize(p) == 0:
+                        os.remove(p)
+                except Exception:
+                    pass
+
+    async def _download_with_fallbacks(self, msg_obj, chat_id: int, msg_id: int, filename_hint: Optional[str],
+                                       reserved: List[str]) -> Optional[str]:
+        """
+        Steps (each one first tries the resumable ranged engine, so a later step or a restarted bot
+        continues the same .part file instead of starting from byte zero):
+        1) app.download_media(msg_obj)
+        2) download by file_id (document/photo/video)
+        3) forward to "me" and download forwarded message
+        4) re-fetch high-level message and download
+        5) RAW messages.GetMessages -> convert to pyrogram message via _parse_message -> download_media
+        """
+        def build_dest(name: str):
+            # claim the name atomically (O_EXCL): with several download workers two "video.mp4"s from
+            # different messages must never share a path, or one overwrites / cleans up the other
+            safe = safe_filename(name)
+            dest = os.path.join(self.downloads, safe)
+            base, ext = os.path.splitext(dest)
             i = 0
             final = dest
-            while os.path.exists(final):
-                i += 1
-                final = f"{base}_{i}{ext}"
-            return final
+            while True:
+                try:
+                    os.close(os.open(final, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    reserved.append(final)
+                    return final
+                except FileExistsError:
+                    i += 1
+                    final = f"{base}_{i}{ext}"
+
+        # every step fetches the same file, so they all share one resumable .part keyed by file_unique_id
+        src_media = media_of(msg_obj)[1]
+        size = getattr(src_media, "file_size", 0) or 0
+        part_key = getattr(src_media, "file_unique_id", None)
+
+        async def ranged(src, name: str) -> Optional[str]:
+            # without a file_unique_id the download is still parallel, just not resumable
+            if size < PARALLEL_DOWNLOAD_MIN_MB * STREAM_CHUNK:
+                return None
+            try:
+                return await self.downloader.download(self.app, src, build_dest(name), size, key=part_key)
+            except Exception as e:
+                dlog("ranged download failed (partial kept for the next step):", e)
+                return None
 
-        # 1) direct download_media
+        def got(path: Optional[str]) -> Optional[str]:
+            # a single-stream step won: the shared .part is no longer needed
+            if path:
+                self.downloader.discard(part_key)
+            return path
+
+        # 1) direct download_media (ranged/resumable first)
         try:
-            dlog("⬇️ [DOWNLOAD] STEP-1 calling download_media for msg", msg_id)
             dest = filename_hint or f"{abs(chat_id)}_{msg_id}"
-            path = await self.app.download_media(msg_obj, file_name=os.path.join(self.downloads, dest))
+            dlog("⬇️ [DOWNLOAD] STEP-1 ranged download for msg", msg_id, "size", size)
+            path = await ranged(msg_obj, dest)
+            if path:
+                return path
+            dlog("⬇️ [DOWNLOAD] STEP-1 calling download_media for msg", msg_id)
+            path = got(await self.app.download_media(msg_obj, file_name=build_dest(dest)))
             if path:
                 dlog("📁 [DOWNLOAD] file saved at", path, "exists?", os.path.exists(path))
                 try:
@@ -801,7 +2431,10 @@ class BackupBotFinalV2:
             if file_id:
                 dlog("Attempting download_media with file_id")
                 dest_name = fname or filename_hint or f"{abs(chat_id)}_{msg_id}"
-                path = await self.app.download_media(file_id, file_name=os.path.join(self.downloads, dest_name))
+                path = await ranged(file_id, dest_name)
+                if path:
+                    return path
+                path = got(await self.app.download_media(file_id, file_name=build_dest(dest_name)))
                 if path:
                     dlog("📁 [DOWNLOAD] file saved at", path, "exists?", os.path.exists(path))
                 try:
@@ -819,7 +2452,9 @@ class BackupBotFinalV2:
             fwd = await self.app.forward_messages("me", chat_id, msg_id)
             if fwd:
                 try:
-                    fp = await self.app.download_media(fwd, file_name=os.path.join(self.downloads, filename_hint or f"{abs(chat_id)}_{msg_id}"))
+                    fp = await ranged(fwd, filename_hint or f"{abs(chat_id)}_{msg_id}")
+                    if not fp:
+                        fp = got(await self.app.download_media(fwd, file_name=build_dest(filename_hint or f"{abs(chat_id)}_{msg_id}")))
                     try:
                         await self.app.delete_messages("me", fwd.message_id)
                     except Exception:
@@ -838,7 +2473,9 @@ class BackupBotFinalV2:
             ref = await self.app.get_messages(chat_id, msg_id)
             if ref and not getattr(ref, "empty", False):
                 try:
-                    fp2 = await self.app.download_media(ref, file_name=os.path.join(self.downloads, filename_hint or f"{abs(chat_id)}_{msg_id}"))
+                    fp2 = await ranged(ref, filename_hint or f"{abs(chat_id)}_{msg_id}")
+                    if not fp2:
+                        fp2 = got(await self.app.download_media(ref, file_name=build_dest(filename_hint or f"{abs(chat_id)}_{msg_id}")))
                     if fp2:
                         dlog("re-fetch download ok:", fp2)
                         return fp2
@@ -885,7 +2522,9 @@ class BackupBotFinalV2:
                     if parsed:
                         dlog("Converted raw->pyrogram message; attempting download")
                         try:
-                            path_raw = await self.app.download_media(parsed, file_name=os.path.join(self.downloads, filename_hint or f"{abs(chat_id)}_{msg_id}"))
+                            path_raw = await ranged(parsed, filename_hint or f"{abs(chat_id)}_{msg_id}")
+                            if not path_raw:
+                                path_raw = got(await self.app.download_media(parsed, file_name=build_dest(filename_hint or f"{abs(chat_id)}_{msg_id}")))
                             if path_raw:
                                 dlog("RAW->converted download ok:", path_raw)
                                 return path_raw
@@ -1090,10 +2729,104 @@ class BackupBotFinalV2:
                 return
             forwarded = 0
             failures = 0
-            for mid in ids:
+            pending = []  # (mid, msg_obj) waiting for one bulk ForwardMessages call
+
+            async def reupload(mid, msg_obj):
+                nonlocal forwarded, failures
+                try:
+                    cap = extract_src_caption(msg_obj)
+                    cap = self.filter_sets.apply(cap, chat_id, self.dest_channel)
+                    filename_hint = None
+                    try:
+                        if getattr(msg_obj, "document", None):
+                            filename_hint = getattr(msg_obj.document, "file_name", None)
+                        elif getattr(msg_obj, "video", None):
+                            filename_hint = getattr(msg_obj.video, "file_name", None)
+                    except Exception:
+                        filename_hint = None
+                    dest = self.dest_channel
+                    unique_id = getattr(media_of(msg_obj)[1], "file_unique_id", None)
+
+                    async def send_ref(ref) -> bool:
+                        try:
+                            await rate_limiter.call(dest, "send", self._send_file_ref, dest, ref, cap)
+                            return True
+                        except Exception as e_ref:
+                            dlog("tgproforward: cached file_id rejected for", mid, e_ref)
+                            self.media_index.forget(ref["file_id"])
+                            return False
+
+                    ref = self.media_index.lookup_source(chat_id, mid, "raw") or self.media_index.lookup(unique_id, None, "raw")
+                    if ref and await send_ref(ref):
+                        dlog("♻️ [DEDUP] tgproforward reused file_id for", mid)
+                        forwarded += 1
+                        return
+                    path = await self.download_with_fallbacks(msg_obj, chat_id, mid, filename_hint=filename_hint)
+                    if path and os.path.exists(path):
+                        med = self.detect_media_type(msg_obj, path)
+                        digest = None
+                        try:
+                            digest = await asyncio.to_thread(sha256_file, path)
+                            ref = self.media_index.lookup(None, digest, "raw")
+                            if ref and await send_ref(ref):
+                                dlog("♻️ [DEDUP] tgproforward reused file_id (same content) for", mid)
+                                forwarded += 1
+                                try:
+                                    os.remove(path)
+                                except Exception:
+                                    pass
+                                return
+                        except Exception as e_hash:
+                            dlog("tgproforward: dedup check failed:", e_hash)
+                        try:
+                            if med.get("is_photo"):
+                                sent = await self.send_file(dest, path, "photo", cap)
+                            elif med.get("is_video"):
+                                dlog("⬆️ [UPLOAD] sending video", path)
+                                sent = await self.send_file(dest, path, "video", cap)
+                            elif med.get("is_audio"):
+                                try:
+                                    sent = await self.send_file(dest, path, "audio", cap)
+                                except Exception:
+                                    sent = await self.send_file(dest, path, "document", cap)
+                            else:
+                                fname = med.get("filename") or os.path.basename(path)
+                                sent = await self.send_file(dest, path, "document", cap, file_name=fname)
+                            forwarded += 1
+                            try:
+                                self.media_index.remember_upload(chat_id, mid, unique_id, digest, "raw", sent)
+                            except Exception as e_idx:
+                                dlog("media index remember failed:", e_idx)
+                        except Exception as e_send:
+                            failures += 1
+                            dlog("tgproforward: re-upload send failed:", e_send)
+                    else:
+                        failures += 1
+                        dlog("tgproforward: download failed for re-upload", mid)
+                except Exception as e_reup:
+                    failures += 1
+                    dlog("tgproforward: re-upload fallback error:", e_reup)
+
+            async def flush():
+                # Not protected -> server-side copy (drop_author hides the sender) for the whole run at once
+                nonlocal forwarded
+                if not pending:
+                    return
+                batch = pending[:]
+                pending.clear()
+                by_mid = dict(batch)
+
+                async def rejected(mid):
+                    dlog("tgproforward: bulk forward rejected", mid, "- re-uploading")
+                    await reupload(mid, by_mid[mid])
+
+                mapped = await self.forward_bulk(chat_id, list(by_mid), self.dest_channel, fallback=rejected)
+                forwarded += len(mapped)
+                dlog("tgproforward: bulk forward", len(mapped), "/", len(batch))
+
+            async for mid, msg_obj in self.prefetch(chat_id, ids):
                 try:
                     dlog("tgproforward: processing", chat_id, mid)
-                    msg_obj = await self.fetch_message(chat_id, mid)
                     if not msg_obj:
                         failures += 1
                         dlog("tgproforward: msg not found", mid)
@@ -1105,58 +2838,22 @@ class BackupBotFinalV2:
                     except Exception:
                         is_protected = False
                     if is_protected:
+                        # keep destination order: send everything queued before this one first
+                        await flush()
                         dlog("tgproforward: protected content, using re-upload for", mid)
-                        try:
-                            cap = extract_src_caption(msg_obj)
-                            cap = apply_filters(cap, self.filters)
-                            filename_hint = None
-                            try:
-                                if getattr(msg_obj, "document", None):
-                                    filename_hint = getattr(msg_obj.document, "file_name", None)
-                                elif getattr(msg_obj, "video", None):
-                                    filename_hint = getattr(msg_obj.video, "file_name", None)
-                            except Exception:
-                                filename_hint = None
-                            path = await self.download_with_fallbacks(msg_obj, chat_id, mid, filename_hint=filename_hint)
-                            if path and os.path.exists(path):
-                                med = self.detect_media_type(msg_obj, path)
-                                try:
-                                    if med.get("is_photo"):
-                                        await self.app.send_photo(self.dest_channel, path, caption=cap)
-                                    elif med.get("is_video"):
-                                        dlog("⬆️ [UPLOAD] sending video", path)
-                                        await self.app.send_video(self.dest_channel, path, caption=cap)
-                                    elif med.get("is_audio"):
-                                        try:
-                                            await self.app.send_audio(self.dest_channel, path, caption=cap)
-                                        except Exception:
-                                            await self.app.send_document(self.dest_channel, path, caption=cap)
-                                    else:
-                                        fname = med.get("filename") or os.path.basename(path)
-                                        await self.app.send_document(self.dest_channel, path, caption=cap, file_name=fname)
-                                    forwarded += 1
-                                except Exception as e_send:
-                                    failures += 1
-                                    dlog("tgproforward: re-upload send failed:", e_send)
-                            else:
-                                failures += 1
-                                dlog("tgproforward: download failed for re-upload", mid)
-                        except Exception as e_reup:
-                            failures += 1
-                            dlog("tgproforward: re-upload fallback error:", e_reup)
+                        await reupload(mid, msg_obj)
                         continue
-                    # Not protected -> use copy_message to hide sender and preserve media/caption
-                    try:
-                        await self.app.copy_message(self.dest_channel, chat_id, mid)
-                        forwarded += 1
-                        dlog("tgproforward: copy_message succeeded for", mid)
-                        await asyncio.sleep(random.uniform(1.0, 2.0))
-                    except Exception as e_copy:
-                        failures += 1
-                        dlog("tgproforward: copy_message failed for", mid, e_copy)
+                    pending.append((mid, msg_obj))
+                    if len(pending) >= FORWARD_BATCH_SIZE:
+                        await flush()
                 except Exception as e:
                     failures += 1
                     dlog("tgproforward loop error:", e)
+            try:
+                await flush()
+            except Exception as e:
+                failures += 1
+                dlog("tgproforward flush error:", e)
             await m.reply_text(f"✅ Forwarded {forwarded}, failures reported {failures}", quote=True)
 
         @self.app.on_message(filters.command("tgprofilters") & owner_only)
@@ -1183,37 +2880,23 @@ class BackupBotFinalV2:
             except Exception as e:
                 await m.reply_text("❌ Chat not found.", quote=True)
                 return
-            preview = []
-            owner_me = await self.app.get_me()
-            for mid in ids:
-                try:
-                    msg = await self.fetch_message(chat_id, mid)
-                    if not msg:
-                        preview.append((mid, "missing", None))
-                        continue
-                    if not getattr(msg, 'from_user', None) or getattr(msg.from_user, 'id', None) != owner_me.id:
-                        preview.append((mid, "skip_not_owner", None))
-                        continue
-                    cap = extract_src_caption(msg)
-                    new_cap = apply_filters(cap, self.filters)
-                    if new_cap != (cap or ""):
-                        preview.append((mid, "will_change", new_cap))
-                    else:
-                        preview.append((mid, "no_change", None))
-                except Exception as e:
-                    dlog("tgprofilters preview error:", e)
-                    preview.append((mid, "error", None))
+            plan = await self.build_filter_plan(chat_id, ids)
             try:
+                # the plan lets the apply commands run without fetching the messages again
                 with open(PENDING_FILE, "w", encoding="utf-8") as pf:
-                    json.dump({"chat_id": chat_id, "ids": ids, "preview": preview}, pf, ensure_ascii=False, indent=2)
+                    json.dump({"chat_id": chat_id, "ids": ids, "filters": self.filter_sets.fingerprint, "plan": plan},
+                              pf, ensure_ascii=False)
             except Exception:
                 pass
+            preview = [(mid, plan.get(str(mid), {}).get("status", "missing"), plan.get(str(mid), {}).get("new")) for mid in ids]
             lines = []
             for mid, status, info in preview:
                 if status == "missing":
                     lines.append(f"{mid} — missing")
                 elif status == "skip_not_owner":
                     lines.append(f"{mid} — skip (not owner)")
+                elif status == "skip":
+                    lines.append(f"{mid} — skip (no caption)")
                 elif status == "will_change":
                     lines.append(f"{mid} — will change to: {info[:200]}")
                 elif status == "no_change":
@@ -1222,28 +2905,69 @@ class BackupBotFinalV2:
                     lines.append(f"{mid} — error")
             await m.reply_text("Preview:\\n" + "\\n".join(lines) + "\\n\\nConfirm with /tgprofilters_apply", quote=True)
 
-        @self.app.on_message(filters.command("tgprofilters_apply") & owner_only)
-        @self.app.on_message(filters.command("tgprofilters_apply_cp") & owner_only)
-        async def tgprofilters_apply_cp_cmd(c, m: Message):
+        async def load_pending_plan(m: Message):
+            """(chat_id, ids, plan) from the last /tgprofilters preview; plan is None for an old-format file."""
             try:
                 with open(PENDING_FILE, "r", encoding="utf-8") as pf:
                     data = json.load(pf)
             except Exception:
+                data = {}
+            if not data.get("chat_id") or not data.get("ids"):
                 await m.reply_text("No pending preview found.", quote=True)
-                return
+                return None
+            plan = data.get("plan")
+            if plan is not None and data.get("filters") != self.filter_sets.fingerprint:
+                await m.reply_text("⚠️ Filters changed since the preview — run /tgprofilters again.", quote=True)
+                return None
+            return data["chat_id"], data["ids"], plan
 
-            chat_id = data.get("chat_id")
-            ids = data.get("ids", [])
+        @self.app.on_message(filters.command("tgprofilters_apply_cp") & owner_only)
+        async def tgprofilters_apply_cp_cmd(c, m: Message):
+            pending = await load_pending_plan(m)
+            if not pending:
+                return
+            chat_id, ids, plan = pending
             reposted = 0
+            stale = 0
 
-            for mid in ids:
+            # every id is re-read through the batched prefetcher (100 ids per RPC): a planned caption is only
+            # reused while the source still hashes to the planned `old`, otherwise the entry is rebuilt from
+            # the current message before anything is sent (file_id, text or re-upload alike)
+            async for mid, msg in self.prefetch(chat_id, ids):
                 try:
-                    msg = await self.fetch_message(chat_id, mid)
+                    dest = self.dest_channel
+                    entry = None
+                    if plan is not None:
+                        entry = plan.get(str(mid))
+                        if not entry or entry.get("status") == "missing":
+                            continue
                     if not msg:
                         continue
+                    if entry is None or caption_hash(extract_src_caption(msg)) != entry.get("old"):
+                        if entry is not None:
+                            stale += 1
+                        entry = self.filter_plan_entry(msg, chat_id, None)
+                    new_cap = entry.get("new_cp", entry["new"])
+
+                    unique_id = (entry.get("media") or {}).get("unique_id")
+                    ref = None
+                    if entry.get("media"):
+                        ref = self.media_index.lookup_source(chat_id, mid, "raw") or self.media_index.lookup(unique_id, None, "raw")
+                    if ref:
+                        # uploaded before: re-send by file_id, zero bytes transferred
+                        try:
+                            await rate_limiter.call(dest, "send", self._send_file_ref, dest, ref, new_cap)
+                            reposted += 1
+                            continue
+                        except Exception as e_ref:
+                            dlog("tgprofilters_apply_cp: cached file_id rejected for", mid, e_ref)
+                            self.media_index.forget(ref["file_id"])
 
-                    cap = extract_src_caption(msg)
-                    new_cap = apply_filters(cap, self.filters)
+                    if entry["kind"] == "text":
+                        if new_cap.strip():
+                            await rate_limiter.call(dest, "send", self.app.send_message, dest, new_cap)
+                            reposted += 1
+                        continue
 
                     filename_hint = None
                     if getattr(msg, "document", None):
@@ -1259,69 +2983,80 @@ class BackupBotFinalV2:
                         med = self.detect_media_type(msg, path)
 
                         if med.get("is_photo"):
-                            await self.app.send_photo(self.dest_channel, path, caption=new_cap)
+                            sent = await self.send_file(dest, path, "photo", new_cap)
                         elif med.get("is_video"):
-                            await self.app.send_video(self.dest_channel, path, caption=new_cap)
+                            sent = await self.send_file(dest, path, "video", new_cap)
                         elif med.get("is_audio"):
-                            await self.app.send_audio(self.dest_channel, path, caption=new_cap)
+                            sent = await self.send_file(dest, path, "audio", new_cap)
                         else:
-                            await self.app.send_document(
-                                self.dest_channel,
+                            sent = await self.send_file(
+                                dest,
                                 path,
-                                caption=new_cap,
+                                "document",
+                                new_cap,
                                 file_name=med.get("filename") or os.path.basename(path)
                             )
 
                         reposted += 1
+                        try:
+                            self.media_index.remember_upload(chat_id, mid, unique_id, None, "raw", sent)
+                        except Exception as e_idx:
+                            dlog("media index remember failed:", e_idx)
                         try:
                             os.remove(path)
                         except Exception:
                             pass
 
-                        await asyncio.sleep(random.uniform(1.2, 2.0))
-
                     else:
                         if new_cap.strip():
-                            await self.app.send_message(self.dest_channel, new_cap)
+                            await rate_limiter.call(self.dest_channel, "send", self.app.send_message, self.dest_channel, new_cap)
                             reposted += 1
 
-                except FloodWait as fw:
-                    await asyncio.sleep(fw.value or fw.seconds or 10)
                 except Exception as e:
                     dlog("tgprofilters_apply_cp error:", e)
 
-            await m.reply_text(f"✅ Reposted (copy-paste) messages: {reposted}", quote=True)
+            await m.reply_text(
+                f"✅ Reposted (copy-paste) messages: {reposted}"
+                + (f"\n⚠️ {stale} changed since the plan, reposted with their current caption" if stale else ""),
+                quote=True,
+            )
 
+        @self.app.on_message(filters.command("tgprofilters_apply") & owner_only)
         async def tgprofilters_apply_cmd(c, m: Message):
+            pending = await load_pending_plan(m)
+            if not pending:
+                return
+            chat_id, ids, plan = pending
+
+            # progress + report go to the owner's DM (falls back to replying here)
+            status_msg = None
             try:
-                with open(PENDING_FILE, "r", encoding="utf-8") as pf:
-                    data = json.load(pf)
+                status_msg = await self.app.send_message(self.owner_id, f"✏️ Applying filters to {len(ids)} messages…")
             except Exception:
-                await m.reply_text("No pending preview found.", quote=True)
-                return
-            chat_id = data.get("chat_id")
-            ids = data.get("ids", [])
-            applied = 0
-            owner_me = await self.app.get_me()
-            for mid in ids:
                 try:
-                    msg = await self.fetch_message(chat_id, mid)
-                    if not msg:
-                        continue
-                    if not getattr(msg, 'from_user', None) or getattr(msg.from_user, 'id', None) != owner_me.id:
-                        continue
-                    cap = extract_src_caption(msg)
-                    new_cap = apply_filters(cap, self.filters)
-                    if new_cap != (cap or ""):
-                        edited = await safe_edit_message(self.app, chat_id, mid, new_cap)
-                        if edited:
-                            applied += 1
-                        else:
-                            dlog("edit failed permanently for", mid)
-                        applied += 1
-                except Exception as e:
-                    dlog("tgprofilters apply error:", e)
-            await m.reply_text(f"✅ Applied edits: {applied}", quote=True)
+                    status_msg = await m.reply_text(f"✏️ Applying filters to {len(ids)} messages…", quote=True)
+                except Exception:
+                    pass
+
+            t0 = time.monotonic()
+            try:
+                stats = await self.bulk_edit_captions(chat_id, ids, status_msg, plan)
+            except Exception as e:
+                dlog("tgprofilters apply error:", e)
+                await m.reply_text(f"❌ Apply failed: {e}", quote=True)
+                return
+            report = (
+                f"✅ Applied edits: {stats['edited']}\n"
+                f"➖ Unchanged: {stats['unchanged']} · skipped: {stats['skipped']} · missing: {stats['missing']}\n"
+                + (f"⚠️ Stale (edited since the plan, not touched): {stats['stale']}\n" if stats['stale'] else "")
+                + f"❌ Failed: {len(stats['failed'])}"
+                + (f" ({', '.join(map(str, stats['failed'][:20]))})" if stats['failed'] else "")
+                + f"\n⏱ {time.monotonic() - t0:.0f}s"
+            )
+            if status_msg:
+                await safe_edit(status_msg, report)
+            else:
+                await m.reply_text(report, quote=True)
 
         # ---- Filter management commands (owner only) ----
         @self.app.on_message(filters.command("addfilter") & owner_only)
@@ -1336,20 +3071,130 @@ class BackupBotFinalV2:
             try:
                 self.filters[bad] = rep
                 save_filters(self.filters)
+                self.filter_sets = ScopedFilters(self.filters, self.filter_rules)
                 await m.reply_text(f"✅ Added filter: `{bad}` → `{rep}`", quote=True)
             except Exception as e:
                 dlog("addfilter failed:", e)
                 await m.reply_text("❌ Failed to add filter.", quote=True)
 
+        @self.app.on_message(filters.command("clearfilters") & owner_only)
+        async def clearfilters_cmd(c, m: Message):
+            self.filters.clear()
+            self.filter_rules.clear()
+            self.filter_sets = ScopedFilters(self.filters, self.filter_rules)
+            try:
+                save_filters(self.filters)
+                save_filter_rules(self.filter_rules)
+                await m.reply_text("🧹 All filters cleared successfully.", quote=True)
+            except Exception as e:
+                dlog("clearfilters failed:", e)
+                await m.reply_text("❌ Failed to clear filters.", quote=True)
+
+        @self.app.on_message(filters.command("addrule") & owner_only)
+        async def addrule_cmd(c, m: Message):
+            # usage: /addrule <text|word|regex|links|mentions> [src:<chat_id>|dest:<chat_id>] <pattern> <replacement>
+            args = m.command[1:]
+            kind = args[0].lower() if args else ""
+            if kind not in RULE_KINDS:
+                await m.reply_text(
+                    "Usage: /addrule <text|word|regex|links|mentions> [src:<chat_id>|dest:<chat_id>] <pattern> <replacement>\n"
+                    "links/mentions take no pattern. Use \"\" (two quotes) or nothing as replacement to remove.",
+                    quote=True
+                )
+                return
+            args = args[1:]
+            scope = "*"
+            if args and parse_rule_scope(args[0]):
+                scope = parse_rule_scope(args.pop(0))
+            pattern = ""
+            if kind not in ("links", "mentions"):
+                if not args:
+                    await m.reply_text("❌ Missing pattern.", quote=True)
+                    return
+                pattern = args.pop(0)
+            rep = " ".join(args)
+            if rep in ('""', "''"):
+                rep = ""
+            rule = {"kind": kind, "pattern": pattern, "replace": rep, "scope": scope}
+            try:
+                compile_rule(rule)
+            except re.error as e:
+                await m.reply_text(f"❌ Invalid regex: {e}", quote=True)
+                return
+            self.filter_rules.append(rule)
+            save_filter_rules(self.filter_rules)
+            self.filter_sets = ScopedFilters(self.filters, self.filter_rules)
+            await m.reply_text(f"✅ Added rule {len(self.filter_rules)}: {kind} `{pattern}` → `{rep}` ({scope})", quote=True)
+
+        @self.app.on_message(filters.command("delrule") & owner_only)
+        async def delrule_cmd(c, m: Message):
+            if len(m.command) < 2 or not m.command[1].isdigit() or not 1 <= int(m.command[1]) <= len(self.filter_rules):
+                await m.reply_text("Usage: /delrule <number from /listfilters>", quote=True)
+                return
+            rule = self.filter_rules.pop(int(m.command[1]) - 1)
+            save_filter_rules(self.filter_rules)
+            self.filter_sets = ScopedFilters(self.filters, self.filter_rules)
+            await m.reply_text(f"🗑 Removed rule: {rule.get('kind')} `{rule.get('pattern', '')}`", quote=True)
+
         @self.app.on_message(filters.command("listfilters") & owner_only)
         async def listfilters_cmd(c, m: Message):
-            if not self.filters:
+            if not self.filters and not self.filter_rules:
                 await m.reply_text("No filters set.", quote=True)
                 return
             lines = [f"`{k}` → `{v}`" for k, v in self.filters.items()]
+            for n, r in enumerate(self.filter_rules, 1):
+                lines.append(f"{n}. [{r.get('kind')} {r.get('scope') or '*'}] `{r.get('pattern', '')}` → `{r.get('replace', '')}`")
             out = "Current filters:\n\n" + "\n".join(lines)
             await m.reply_text(out, quote=True)
 
+        @self.app.on_message(filters.command("tgpromirror") & owner_only)
+        async def mirror_cmd(c, m: Message):
+            # usage: /tgpromirror <source> [dest] | /tgpromirror stop <source> | /tgpromirror (list)
+            args = m.command[1:]
+            if not args:
+                recs = self.mirrors.all()
+                if not recs:
+                    await m.reply_text("Usage: /tgpromirror <source> [dest]\nNo live mirrors.", quote=True)
+                    return
+                lines = []
+                for r in recs:
+                    line = f"{r['title'] or r['source']} (`{r['source']}`) → `{r['dest']}` — synced to #{r['last_id']}"
+                    if self.mirror_unmirrored.get(r["source"]):
+                        line += f", {self.mirror_unmirrored[r['source']]} edits not mirrored"
+                    lines.append(line)
+                await m.reply_text("🪞 Live mirrors:\n" + "\n".join(lines), quote=True)
+                return
+
+            if args[0].lower() in ("stop", "off") and len(args) > 1:
+                source = await self.resolve_chat_ref(args[1])
+                if source is None or not self.mirrors.remove(source):
+                    await m.reply_text("❌ No mirror for that source.", quote=True)
+                    return
+                self.stop_mirror(source)
+                await m.reply_text(f"🛑 Mirror of `{source}` stopped.", quote=True)
+                return
+
+            source = await self.resolve_chat_ref(args[0])
+            dest = await self.resolve_chat_ref(args[1]) if len(args) > 1 else self.dest_channel
+            if source is None or dest is None:
+                await m.reply_text("❌ Chat not found or you lack access.", quote=True)
+                return
+            try:
+                await self.ensure_peer(source)
+            except Exception as e:
+                dlog("mirror ensure_peer failed:", e)
+            existing = self.mirrors.get(source)
+            # a new mirror starts at the newest message; older history is /tgprobackup's job
+            top = existing["last_id"] if existing else await self.latest_message_id(source)
+            title = (self.peer_cache.get(source) or {}).get("title") or str(source)
+            self.mirrors.add(source, dest, title, top)
+            self.start_mirror(source)
+            await m.reply_text(
+                f"🪞 Mirroring {title} (`{source}`) → `{dest}` from message #{top}.\n"
+                f"New posts and edits follow live; use /tgprobackup for older history.",
+                quote=True,
+            )
+
         @self.app.on_message(filters.command("tgprobackup") & owner_only)
         async def backup_cmd(c, m: Message):
             if len(m.command) < 2:
@@ -1361,11 +3206,12 @@ class BackupBotFinalV2:
 
         @self.app.on_message(filters.command("status") & owner_only)
         async def status_cmd(c, m: Message):
+            mirrors = f"\n🪞 Live mirrors: {len(self.mirror_tasks)}" if self.mirror_tasks else ""
             if self.current_backup:
                 chat, idx, total, done = self.current_backup
-                await m.reply_text(f"📊 Running: {idx}/{total} in {chat.get('title')} (done {done}). Queue: {self.queue.qsize()}", quote=True)
+                await m.reply_text(f"📊 Running: {idx}/{total} in {chat.get('title')} (done {done}). Queue: {self.queue.qsize()}\n⚙️ {ffmpeg_scheduler.describe()}{mirrors}", quote=True)
             else:
-                await m.reply_text(f"📊 Idle. Queue: {self.queue.qsize()}", quote=True)
+                await m.reply_text(f"📊 Idle. Queue: {self.queue.qsize()}\n⚙️ {ffmpeg_scheduler.describe()}{mirrors}", quote=True)
 
         @self.app.on_message(filters.command("tgprostop") & owner_only)
         async def stop_cmd(c, m: Message):
@@ -1387,6 +3233,21 @@ class BackupBotFinalV2:
             else:
                 await m.reply_text("📋 Your chats:\n\n" + "\n".join(out[:60]), quote=True)
 
+        # live mirror updates: group 1 so command handlers in group 0 never swallow them
+        mirrored = filters.create(lambda _, __, m: bool(m.chat) and m.chat.id in self.mirror_queues)
+
+        @self.app.on_message(mirrored, group=1)
+        async def mirror_new(c, m: Message):
+            queue = self.mirror_queues.get(m.chat.id)
+            if queue is not None:
+                queue.put_nowait(("new", m))
+
+        @self.app.on_edited_message(mirrored, group=1)
+        async def mirror_edited(c, m: Message):
+            queue = self.mirror_queues.get(m.chat.id)
+            if queue is not None:
+                queue.put_nowait(("edit", m))
+
     async def enqueue_backup(self, link: str, message: Message):
         parsed = parse_link(link)
         dlog("enqueue parsed:", parsed)
@@ -1435,7 +3296,12 @@ class BackupBotFinalV2:
             dlog("enqueue ensure_peer exception:", e)
             peer_ok = False
 
-        await self.queue.put(({"id": chat_id, "title": str(chat_id)}, topic_id, ids, message.chat.id))
+        cached = self.peer_cache.get(chat_id) or {}
+        chat_info = {"id": chat_id, "title": cached.get("title") or str(chat_id)}
+        # the destination is fixed when the job is queued: a later /setdest only affects new jobs
+        dest = self.dest_channel
+        job_id = self.journal.create_job(chat_info, topic_id, ids, message.chat.id, dest)
+        await self.queue.put((chat_info, topic_id, ids, message.chat.id, job_id, dest))
         await message.reply_text(f"✅ Queued {len(ids)} messages from {chat_id} (topic filter: {topic_id}) — position #{self.queue.qsize()}", quote=True)
 
     
@@ -1446,17 +3312,31 @@ class BackupBotFinalV2:
 
         
 
+    async def resume_unfinished_jobs(self):
+        """Re-queue jobs the journal still has as queued/running (e.g. after a Render restart)."""
+        try:
+            jobs = self.journal.unfinished_jobs()
+        except Exception as e:
+            logger.warning("journal: could not load unfinished jobs: %s", e)
+            return
+        for job in jobs:
+            chat_info = {"id": job["chat_id"], "title": job["title"] or str(job["chat_id"])}
+            # resume into the journaled destination, even if /setdest changed it since
+            await self.queue.put((chat_info, job["topic_id"], job["ids"], job["reply_chat"], job["id"], job["dest"]))
+            logger.info("journal: re-queued job #%s (%s ids) from %s", job["id"], len(job["ids"]), job["chat_id"])
+
     async def processor(self):
         logger.info("Processor started")
+        await self.resume_unfinished_jobs()
         while not self.stop_flag.is_set():
             try:
                 item = await asyncio.wait_for(self.queue.get(), timeout=1.0)
             except asyncio.TimeoutError:
                 continue
 
-            chat_info, topic_id, ids, reply_chat = item
+            chat_info, topic_id, ids, reply_chat, job_id, dest = item
             try:
-                await self.process_backup(chat_info, topic_id, ids, reply_chat)
+                await self.process_backup(chat_info, topic_id, ids, reply_chat, job_id=job_id, dest=dest)
             except Exception:
                 logger.exception("process_backup failed")
             finally:
@@ -1491,277 +3371,1036 @@ class BackupBotFinalV2:
             dlog("get_msg_topic_id raw fallback fail:", e)
         return None
 
-    async def process_backup(self, chat_info: Dict[str, Any], topic_id: Optional[int], ids: List[int], reply_chat: int):
-        total = len(ids)
-        done = 0
-        status_msg = None
+    # ---------- backup pipeline stages ----------
+    def _build_backup_item(self, chat_info: Dict[str, Any], seq: int, mid: int, msg, dest: int) -> Dict[str, Any]:
+        """Turn a fetched source message into a pipeline item (caption, filename hint, route)."""
+        # caption/text
+        caption = extract_src_caption(msg)
         try:
-            try:
-                status_msg = await self.app.send_message(reply_chat, f"🚀 Starting backup for {chat_info.get('title')} — {total} messages (topic_filter={topic_id})")
-            except Exception:
-                status_msg = None
+            caption = (getattr(msg, "caption", None) or getattr(msg, "text", None) or "")
+            if caption is None:
+                caption = ""
+        except Exception:
+            caption = ""
 
-            self.current_backup = (chat_info, 0, total, 0)
-            for i, mid in enumerate(ids, start=1):
-                if self.current_backup is None:
-                    if status_msg:
-                        await safe_edit(status_msg, "🛑 Backup stopped.")
-                    break
+        # apply dynamic filters to caption (and later to filename)
+        try:
+            caption = self.filter_sets.apply(caption, chat_info.get("id"), dest)
+        except Exception as e:
+            dlog("apply_filters caption failed:", e)
+
+        # filename hint
+        filename_hint = None
+        try:
+            if getattr(msg, "document", None):
+                filename_hint = getattr(msg.document, "file_name", None)
+            elif getattr(msg, "video", None):
+                filename_hint = getattr(msg.video, "file_name", None)
+        except Exception:
+            filename_hint = None
+        if not filename_hint:
+            filename_hint = f"{abs(chat_info.get('id'))}_{mid}"
+
+        # apply dynamic filters to filename_hint
+        try:
+            filename_hint = self.filter_sets.apply(filename_hint or "", chat_info.get("id"), dest)
+        except Exception as e:
+            dlog("apply_filters filename failed:", e)
 
-                self.current_backup = (chat_info, i, total, done)
-                dlog("Processing", mid, "in", chat_info.get("id"))
+        # Auto-forward if allowed (hide sender) - skip download logic
+        forwardable = False
+        try:
+            forwardable = hasattr(msg, "has_protected_content") and not msg.has_protected_content
+        except Exception as e:
+            dlog("auto-forward check failed:", e)
+
+        return {
+            "seq": seq,
+            "mid": mid,
+            "chat_info": chat_info,
+            "dest": dest,
+            "msg": msg,
+            "caption": caption,
+            "filename_hint": filename_hint,
+            "action": "forward" if forwardable else "upload",
+            "path": None,
+            "med": None,
+            "final": None,
+            "thumb": None,
+            "video_meta": None,
+            "transformed": False,
+            "unique_id": getattr(media_of(msg)[1], "file_unique_id", None),
+            "sha256": None,
+            "cached": None,
+            "relay": None,
+        }
+
+    def _media_variant(self, item: Dict[str, Any]) -> str:
+        # watermarking changes the uploaded bytes, so those uploads are indexed per watermark settings.
+        # Lookups ask for what the item should become; once the transform ran, item["watermarked"] says
+        # what was actually produced, so a failed watermark's raw upload is never indexed as wm-*
+        watermarked = item.get("watermarked")
+        if watermarked is None:
+            watermarked = self.watermark_enabled and self.detect_media_type(item["msg"], item.get("path")).get("is_video")
+        return f"wm-{watermark_settings_hash()}" if watermarked else "raw"
+
+    def _lookup_cached_media(self, item: Dict[str, Any]) -> bool:
+        variant = self._media_variant(item)
+        try:
+            hit = (
+                self.media_index.lookup_source(item["chat_info"]["id"], item["mid"], variant)
+                or self.media_index.lookup(item.get("unique_id"), item.get("sha256"), variant)
+            )
+        except Exception as e:
+            dlog("media index lookup failed:", e)
+            hit = None
+        item["cached"] = hit
+        return bool(hit)
+
+    def _remember_upload(self, item: Dict[str, Any], sent):
+        try:
+            self.media_index.remember_upload(
+                item["chat_info"]["id"], item["mid"], item.get("unique_id"), item.get("sha256"), self._media_variant(item), sent
+            )
+        except Exception as e:
+            dlog("media index remember failed:", e)
+
+    async def _send_file_ref(self, dest: int, ref: Dict[str, str], caption: str):
+        """Send an already-uploaded file by file_id with the method matching its kind."""
+        kind = ref["kind"] if ref["kind"] in MEDIA_KINDS else "document"
+        sender = getattr(self.app, f"send_{kind}")
+        return await sender(dest, ref["file_id"], caption=caption)
+
+    def _needs_transform(self, item: Dict[str, Any]) -> bool:
+        med = item.get("med") or {}
+        return bool(item.get("path") and med.get("is_video") and not item.get("transformed"))
+
+    def _can_relay(self, item: Dict[str, Any]) -> bool:
+        # only media that goes out unchanged (no watermark/thumbnail) and is not part of an album
+        if not RELAY_ENABLED or getattr(item["msg"], "media_group_id", None):
+            return False
+        kind, media = media_of(item["msg"])
+        if kind not in ("document", "audio", "photo") or not getattr(media, "file_size", 0):
+            return False
+        return not self.detect_media_type(item["msg"], None).get("is_video")
+
+    async def _relay_backup_item(self, item: Dict[str, Any]) -> bool:
+        """Stream the source file straight into an upload (see StreamRelay); False -> use the disk path."""
+        kind, media = media_of(item["msg"])
+        name = safe_filename(item["filename_hint"] or f"{item['mid']}")
+        try:
+            item["relay"], item["sha256"] = await self.relay.upload(self.app, item["msg"], media.file_size, name)
+        except Exception as e:
+            dlog("🔁 [RELAY] failed for", item["mid"], "- falling back to disk:", e)
+            item["relay"] = None
+            return False
+        item["med"] = self.detect_media_type(item["msg"], None)
+        return True
+
+    async def _send_input_file(self, dest: int, uploaded, kind: str, caption: str, mime_type: Optional[str] = None,
+                               thumb=None, duration: int = 0, title: Optional[str] = None, performer: Optional[str] = None,
+                               width: int = 0, height: int = 0):
+        """messages.SendMedia for a file uploaded by ParallelUploader/StreamRelay; returns the parsed Message."""
+        if kind == "photo":
+            media_in = raw_types.InputMediaUploadedPhoto(file=uploaded)
+        else:
+            attributes = [raw_types.DocumentAttributeFilename(file_name=uploaded.name)]
+            if kind == "video":
+                attributes.append(raw_types.DocumentAttributeVideo(duration=duration or 0, w=width or 0, h=height or 0, supports_streaming=True))
+            elif kind == "audio":
+                attributes.append(raw_types.DocumentAttributeAudio(duration=duration or 0, title=title, performer=performer))
+            media_in = raw_types.InputMediaUploadedDocument(
+                file=uploaded,
+                mime_type=mime_type or "application/octet-stream",
+                attributes=attributes,
+                thumb=thumb,
+            )
+        text = await pyro_utils.parse_text_entities(self.app, caption or "", None, None)
+        r = await self.app.invoke(raw_functions.messages.SendMedia(
+            peer=await self.app.resolve_peer(dest),
+            media=media_in,
+            random_id=random.getrandbits(63),
+            **text,
+        ))
+        users = {u.id: u for u in getattr(r, "users", [])}
+        chats = {c.id: c for c in getattr(r, "chats", [])}
+        for u in getattr(r, "updates", None) or []:
+            if isinstance(u, (raw_types.UpdateNewMessage, raw_types.UpdateNewChannelMessage)):
+                return await Message._parse(self.app, u.message, users, chats)
+        return r  # posted, but no message to parse
+
+    async def _send_relayed(self, item: Dict[str, Any]):
+        kind, media = media_of(item["msg"])
+        return await self._send_input_file(
+            item["dest"], item["relay"], kind if kind in ("photo", "audio") else "document", item["caption"],
+            mime_type=getattr(media, "mime_type", None),
+            duration=getattr(media, "duration", 0) or 0,
+            title=getattr(media, "title", None),
+            performer=getattr(media, "performer", None),
+        )
 
-                # Ensure peer is present before each message attempt (helps fresh sessions)
+    async def send_file(self, dest: int, path: str, kind: str, caption: str, thumb: Optional[str] = None,
+                        file_name: Optional[str] = None, src_media=None, video_meta: Optional[Dict[str, int]] = None):
+        """
+        Send a local file as photo/video/audio/document. Files of PARALLEL_UPLOAD_MIN_MB or more go through
+        ParallelUploader + SendMedia; photos and small files keep using Pyrogram's send_* helpers.
+        `video_meta` (duration/width/height of a transformed video) wins over the source media's values.
+        Rate limited here, not by the caller: the upload runs outside the (dest, "send") bucket and only
+        the final send goes through rate_limiter.call, so a FloodWait retries SendMedia with the parts
+        already on the server instead of uploading the whole file again.
+        """
+        meta = {k: v for k, v in (video_meta or {}).items() if v} if kind == "video" else {}
+        if kind == "photo" or os.path.getsize(path) < PARALLEL_UPLOAD_MIN_MB * STREAM_CHUNK:
+            kwargs = {"caption": caption, **meta}
+            if thumb:
+                kwargs["thumb"] = thumb
+            if file_name and kind == "document":
+                kwargs["file_name"] = file_name
+            return await rate_limiter.call(dest, "send", getattr(self.app, f"send_{kind}"), dest, path, **kwargs)
+        name = file_name or os.path.basename(path)
+        uploaded = await self.uploader.upload(self.app, path, name)
+        thumb_file = None
+        if thumb and os.path.exists(thumb):
+            try:
+                thumb_file = await self.uploader.upload(self.app, thumb)
+            except Exception as e:
+                dlog("thumbnail upload failed:", e)
+        mime = mimetypes.guess_type(name)[0] or getattr(src_media, "mime_type", None)
+        if not mime and kind == "video":
+            mime = "video/mp4"
+        return await rate_limiter.call(
+            dest, "send", self._send_input_file, dest, uploaded, kind, caption, mime_type=mime, thumb=thumb_file,
+            duration=meta.get("duration") or getattr(src_media, "duration", 0) or 0,
+            title=getattr(src_media, "title", None),
+            performer=getattr(src_media, "performer", None),
+            width=meta.get("width") or getattr(src_media, "width", 0) or 0,
+            height=meta.get("height") or getattr(src_media, "height", 0) or 0,
+        )
+
+    def _restore_watermarked(self, item: Dict[str, Any]) -> bool:
+        """Watermark cache hit: take the stored output instead of downloading and encoding again."""
+        if not self.watermark_enabled or not self.detect_media_type(item["msg"], None).get("is_video"):
+            return False
+        try:
+            hit = self.wm_cache.get(
+                item.get("unique_id"), watermark_settings_hash(), self.downloads, f"{item['chat_info']['id']}_{item['mid']}"
+            )
+        except Exception as e:
+            dlog("watermark cache lookup failed:", e)
+            return False
+        if not hit:
+            return False
+        dlog("♻️ [WM-CACHE] reusing watermarked output for", item["mid"])
+        item["path"] = item["final"] = hit["video"]
+        item["med"] = self.detect_media_type(item["msg"], hit["video"])
+        item["thumb"] = hit["thumb"]
+        item["video_meta"] = {k: hit[k] for k in ("duration", "width", "height")}
+        item["transformed"] = True
+        item["watermarked"] = True
+        return True
+
+    async def _download_backup_item(self, item: Dict[str, Any], relay: bool = True):
+        if self._restore_watermarked(item):
+            return
+        if relay and self._can_relay(item) and await self._relay_backup_item(item):
+            return
+        chat_id = item["chat_info"]["id"]
+        downloaded = await self.download_with_fallbacks(item["msg"], chat_id, item["mid"], filename_hint=item["filename_hint"])
+        if downloaded and os.path.exists(downloaded):
+            item["path"] = downloaded
+            item["med"] = self.detect_media_type(item["msg"], downloaded)
+            item["final"] = downloaded
+            try:
+                item["sha256"] = await asyncio.to_thread(sha256_file, downloaded)
+            except Exception as e:
+                dlog("sha256 failed for", downloaded, e)
+            if self._lookup_cached_media(item):
+                # same bytes were uploaded before under another source id -> no transform/upload needed
+                dlog("♻️ [DEDUP] content already uploaded, reusing file_id for", item["mid"])
+                self._cleanup_backup_item(item)
+                item["path"] = item["final"] = None
+
+    async def _transform_backup_item(self, item: Dict[str, Any]):
+        downloaded = item["path"]
+        item["transformed"] = True
+        if self.watermark_enabled:
+            dlog("🎨 [WATERMARK] watermark + thumbnail + probe in one pass for", downloaded)
+            job = await watermark_media_job(downloaded)
+            dlog("🎨 [WATERMARK] job output:", job)
+            if job:
                 try:
-                    await self.ensure_peer(chat_info["id"])
+                    self.wm_cache.put(item.get("unique_id"), watermark_settings_hash(), job)
                 except Exception as e:
-                    dlog("process_backup: ensure_peer on message failed", e)
-
-                msg = await self.fetch_message(chat_info["id"], mid)
-                dlog("fetch result for", mid, ":", type(msg))
+                    dlog("watermark cache store failed:", e)
+                item["final"] = job["video"]
+                item["thumb"] = job["thumb"]
+                item["video_meta"] = {k: job[k] for k in ("duration", "width", "height")}
+                item["watermarked"] = True
+                return
+            dlog("🎨 [WATERMARK] failed for", item["mid"], "- sending the original, indexed as raw")
+        # untouched video: the source message already carries duration/width/height
+        item["watermarked"] = False
+        item["final"] = downloaded
+        dlog("🖼️ [THUMBNAIL] generating thumbnail at", THUMB_SECOND, "s for", downloaded)
+        item["thumb"] = await generate_video_thumbnail(downloaded, second=THUMB_SECOND)
+        dlog("🖼️ [THUMBNAIL] thumbnail path:", item["thumb"])
+
+    async def _prepare_backup_item(self, item: Dict[str, Any]):
+        """Download + transform inline (used when a forward falls back to re-upload)."""
+        await self._download_backup_item(item)
+        if self._needs_transform(item):
+            await self._transform_backup_item(item)
+
+    def _cleanup_backup_item(self, item: Dict[str, Any]):
+        for p in {item.get("path"), item.get("final"), item.get("thumb")}:
+            if p:
                 try:
-                    if DEBUG:
-                        dlog("PROCESS_BACKUP MSG PREVIEW:", "caption:", getattr(msg, "caption", None), "text:", getattr(msg, "text", None))
-                        dlog("PROCESS_BACKUP ENTITIES:", getattr(msg, "caption_entities", None), getattr(msg, "entities", None))
+                    os.remove(p)
                 except Exception:
                     pass
 
-                if not msg:
-                    logger.warning("Message %s not found in %s", mid, chat_info.get("id"))
-                    if status_msg:
-                        await safe_edit(status_msg, f"{i}/{total} processed — done {done} (missing {mid})")
-                    await asyncio.sleep(0.5)
-                    continue
+    async def _upload_backup_media(self, item: Dict[str, Any]):
+        med = item["med"] or {}
+        dest = item["dest"]
+        downloaded = item["path"]
+        caption = item["caption"]
+        src_media = media_of(item["msg"])[1]
+        if med.get("is_photo"):
+            return await self.send_file(dest, downloaded, "photo", caption)
+        elif med.get("is_video"):
+            final_video = item.get("final") or downloaded
+            dlog("⬆️ [UPLOAD] sending video", final_video)
+            return await self.send_file(
+                dest,
+                final_video,
+                "video",
+                caption,
+                thumb=item.get("thumb"),
+                src_media=src_media,
+                video_meta=item.get("video_meta")
+            )
+        elif med.get("is_audio"):
+            try:
+                return await self.send_file(dest, downloaded, "audio", caption, src_media=src_media)
+            except Exception:
+                return await self.send_file(dest, downloaded, "document", caption, src_media=src_media)
+        else:
+            fname = med.get("filename") or os.path.basename(downloaded)
+            return await self.send_file(dest, downloaded, "document", caption, file_name=fname, src_media=src_media)
+
+    def _album_media(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        cached = item.get("cached")
+        if cached:
+            kind = cached["kind"]
+            return {"is_photo": kind == "photo", "is_video": kind == "video", "is_audio": kind == "audio"}
+        return item.get("med") or {}
+
+    def _album_kind(self, item: Dict[str, Any]) -> Optional[str]:
+        # send_media_group only mixes photos with videos; documents and audio go in albums of their own kind
+        if not item.get("cached") and not (item.get("path") and os.path.exists(item["path"])):
+            return None
+        med = self._album_media(item)
+        if med.get("is_photo") or med.get("is_video"):
+            return "visual"
+        if med.get("is_audio"):
+            return "audio"
+        return "document"
 
-                # If topic filter provided -> check message's topic id
-                if topic_id is not None:
+    def _album_input_media(self, item: Dict[str, Any]):
+        med = self._album_media(item)
+        caption = item.get("caption") or ""
+        cached = item.get("cached")
+        media = cached["file_id"] if cached else item["path"]
+        if med.get("is_photo"):
+            return InputMediaPhoto(media, caption=caption)
+        if med.get("is_video"):
+            if cached:
+                return InputMediaVideo(media, caption=caption)
+            meta = {k: v for k, v in (item.get("video_meta") or {}).items() if v}
+            return InputMediaVideo(item.get("final") or item["path"], caption=caption, thumb=item.get("thumb"), **meta)
+        if med.get("is_audio"):
+            return InputMediaAudio(media, caption=caption)
+        return InputMediaDocument(media, caption=caption)
+
+    async def _send_backup_album(self, items: List[Dict[str, Any]]) -> Optional[list]:
+        """
+        Post a buffered source album with one send_media_group call (captions kept per item).
+        Returns the sent Messages in order, or None if the album cannot be grouped so the caller
+        falls back to per-item sends (files are left in place for that).
+        """
+        kinds = {self._album_kind(it) for it in items}
+        if len(kinds) != 1 or None in kinds:
+            dlog("album not groupable, sending one by one:", [it["mid"] for it in items])
+            return None
+        dest = items[0]["dest"]
+        try:
+            sent = await rate_limiter.call(dest, "send", self.app.send_media_group, dest, [self._album_input_media(it) for it in items])
+        except Exception:
+            logger.exception("send_media_group failed, falling back to single sends")
+            return None
+        sent = list(sent or [])
+        for it, msg in zip(items, sent):
+            if not it.get("cached"):
+                self._remember_upload(it, msg)
+        for it in items:
+            self._cleanup_backup_item(it)
+        return sent
+
+    async def _send_backup_item(self, item: Dict[str, Any]):
+        """Post one prepared item to the destination. Returns the sent Message (or None if nothing was posted)."""
+        chat_info = item["chat_info"]
+        dest = item["dest"]
+        mid = item["mid"]
+        caption = item["caption"]
+
+        if item.get("cached"):
+            try:
+                sent = await rate_limiter.call(dest, "send", self._send_file_ref, dest, item["cached"], caption)
+                self._remember_upload(item, sent)
+                return sent
+            except Exception as e:
+                # stale reference: forget it and fall through to a real download/upload
+                dlog("♻️ [DEDUP] cached file_id rejected for", mid, e)
+                self.media_index.forget(item["cached"]["file_id"])
+                item["cached"] = None
+                if not item.get("path"):
                     try:
-                        msg_topic = await self.get_msg_topic_id(chat_info["id"], msg)
-                        dlog("msg_topic:", msg_topic, "expected:", topic_id)
-                        if msg_topic != topic_id:
-                            dlog("Skipping", mid, "not in topic", topic_id)
-                            if status_msg:
-                                await safe_edit(status_msg, f"{i}/{total} processed — done {done} (skipped {mid} not in topic)")
-                            await asyncio.sleep(0.3)
-                            continue
+                        await self._prepare_backup_item(item)
                     except Exception:
-                        dlog("topic check failed for", mid)
-                        if status_msg:
-                            await safe_edit(status_msg, f"{i}/{total} processed — done {done} (skipped {mid} topic-check error)")
-                        await asyncio.sleep(0.3)
-                        continue
+                        logger.exception("inline prepare failed for %s", mid)
+                if item.get("cached"):
+                    return await self._send_backup_item(item)
 
-                # caption/text
-                caption = extract_src_caption(msg)
+        if item.get("relay"):
+            try:
+                sent = await rate_limiter.call(dest, "send", self._send_relayed, item)
+                self._remember_upload(item, sent)
+                return sent
+            except Exception as e:
+                dlog("🔁 [RELAY] SendMedia failed for", mid, "- downloading to disk instead:", e)
+                item["relay"] = None
                 try:
-                    caption = (getattr(msg, "caption", None) or getattr(msg, "text", None) or "")
-                    if caption is None:
-                        caption = ""
+                    await self._download_backup_item(item, relay=False)
                 except Exception:
-                    caption = ""
+                    logger.exception("inline download failed for %s", mid)
+                if item.get("cached"):
+                    return await self._send_backup_item(item)
 
-                
-                # apply dynamic filters to caption (and later to filename)
-                try:
-                    caption = apply_filters(caption, self.filters)
-                except Exception as e:
-                    dlog("apply_filters caption failed:", e)
-# filename hint
-                filename_hint = None
+        downloaded = item.get("path")
+        if downloaded and os.path.exists(downloaded):
+            try:
                 try:
-                    if getattr(msg, "document", None):
-                        filename_hint = getattr(msg.document, "file_name", None)
-                    elif getattr(msg, "video", None):
-                        filename_hint = getattr(msg.video, "file_name", None)
+                    sent = await self._upload_backup_media(item)  # send_file rate-limits the send itself
+                    self._remember_upload(item, sent)
+                    return sent
                 except Exception:
-                    filename_hint = None
-                if not filename_hint:
-                    filename_hint = f"{abs(chat_info.get('id'))}_{mid}"
+                    logger.exception("upload failed fallback")
+                return None
+            finally:
+                self._cleanup_backup_item(item)
 
-                # apply dynamic filters to filename_hint
-                try:
-                    filename_hint = apply_filters(filename_hint or "", self.filters)
-                except Exception as e:
-                    dlog("apply_filters filename failed:", e)
-                # attempt downloads with fallbacks
-                
-                # Auto-forward if allowed (hide sender) - skip download logic
-                try:
-                    if hasattr(msg, "has_protected_content") and not msg.has_protected_content:
-                        try:
-                            await self.app.forward_messages(self.dest_channel, chat_info["id"], mid, protect_content=False)
-                            done += 1
-                            if status_msg:
-                                await safe_edit(status_msg, f"Processing {i}/{total} — forwarded {mid} (no protection) — done {done}")
-                            await asyncio.sleep(random.randint(self.min_delay, self.max_delay))
-                            continue
-                        except Exception as e:
-                            dlog("auto-forward failed (send forward):", e)
-                except Exception as e:
-                    dlog("auto-forward check failed:", e)
-                downloaded = await self.download_with_fallbacks(msg, chat_info["id"], mid, filename_hint=filename_hint)
+        # Not downloadable: try to send caption or placeholder
+        if caption and caption.strip():
+            try:
+                return await rate_limiter.call(dest, "send", self.app.send_message, dest, caption)
+            except Exception:
+                logger.exception("send_message failed for text-only")
+            return None
+        placeholder = f"[deleted or non-downloadable message preserved]\nSource: {chat_info.get('title')} ({chat_info.get('id')})\nMsgID: {mid}"
+        try:
+            return await rate_limiter.call(dest, "send", self.app.send_message, dest, placeholder)
+        except Exception:
+            try:
+                return await rate_limiter.call(dest, "forward", self.app.forward_messages, dest, chat_info.get("id"), mid)
+            except Exception:
+                logger.exception("final forward fallback failed")
+        return None
 
-                if downloaded and os.path.exists(downloaded):
-                    med = self.detect_media_type(msg, downloaded)
-                    try:
-                        if med.get("is_photo"):
-                            await self.app.send_photo(self.dest_channel, downloaded, caption=caption)
-                        
-                        elif med.get("is_video"):
-                            final_video = downloaded
-                            if self.watermark_enabled:
-                                dlog("🎨 [WATERMARK] applying watermark to", downloaded)
-                                wm = await apply_video_watermark(downloaded)
-                                dlog("🎨 [WATERMARK] watermark output:", wm)
-                                if wm:
-                                    final_video = wm
-                            dlog("🖼️ [THUMBNAIL] generating thumbnail at 10s for", final_video)
-                            thumb = await generate_video_thumbnail(final_video, second=10)
-                            dlog("🖼️ [THUMBNAIL] thumbnail path:", thumb)
-                            dlog("⬆️ [UPLOAD] sending video", final_video)
-                            await self.app.send_video(
-                                self.dest_channel,
-                                final_video,
-                                caption=caption,
-                                thumb=thumb
-                            )
-                            if final_video != downloaded:
-                                try: os.remove(final_video)
-                                except Exception: pass
-                            if thumb:
-                                try: os.remove(thumb)
-                                except Exception: pass
+    async def process_backup(self, chat_info: Dict[str, Any], topic_id: Optional[int], ids: List[int], reply_chat: int, job_id: Optional[int] = None, dest: Optional[int] = None):
+        """
+        Staged backup pipeline:
+          fetch -> download_with_fallbacks -> watermark/thumbnail -> send
+        Stages are connected by bounded asyncio queues and run concurrently
+        (PIPELINE_FETCH_WORKERS / PIPELINE_DOWNLOAD_WORKERS / PIPELINE_TRANSFORM_WORKERS).
+        The send stage is a single in-order sequencer, so destination order == source order.
+        PIPELINE_WINDOW caps how many messages are in flight (and on disk) at once. Consecutive
+        forwardable ids (plus missing ones) skip all of that: the feeder groups them into runs of
+        up to FORWARD_BATCH_SIZE that travel as one unit and go out in one ForwardMessages call.
+        With a journal job_id, ids already finished in an earlier run are skipped and every
+        result (state + destination message id) is checkpointed as soon as it is posted.
+        """
+        dest = dest or self.dest_channel
+        resumed = 0
+        if job_id is not None:
+            try:
+                finished = self.journal.finished_ids(job_id)
+                resumed = sum(1 for mid in ids if mid in finished)
+                ids = [mid for mid in ids if mid not in finished]
+                self.journal.set_job_status(job_id, "running")
+            except Exception as e:
+                logger.warning("journal: resume lookup failed for job #%s: %s", job_id, e)
+        total = len(ids)
+        done = 0
+        status_msg = None
 
-                        elif med.get("is_audio"):
-                            try:
-                                await self.app.send_audio(self.dest_channel, downloaded, caption=caption)
-                            except Exception:
-                                await self.app.send_document(self.dest_channel, downloaded, caption=caption)
-                        else:
-                            fname = med.get("filename") or os.path.basename(downloaded)
-                            await self.app.send_document(self.dest_channel, downloaded, caption=caption, file_name=fname)
-                        done += 1
-                    except FloodWait as fw:
-                        wait = getattr(fw, "value", None) or getattr(fw, "seconds", None) or 10
-                        logger.warning("FloodWait %s sec", wait)
-                        await asyncio.sleep(int(wait))
+        fetch_q: asyncio.Queue = asyncio.Queue()
+        download_q: asyncio.Queue = asyncio.Queue(maxsize=max(1, self.download_workers * 2))
+        transform_q: asyncio.Queue = asyncio.Queue(maxsize=max(1, self.transform_workers * 2))
+        window = asyncio.Semaphore(max(1, self.pipeline_window))
+        # forward runs need no disk, but still cap how many fetched runs wait ahead of the send stage
+        runs_ahead = asyncio.Semaphore(FORWARD_RUNS_AHEAD)
+        slots: Dict[int, asyncio.Semaphore] = {}  # unit seq -> the semaphore it holds until the send stage takes it
+        ready: Dict[int, Dict[str, Any]] = {}
+        ready_cond = asyncio.Condition()
+        live: Dict[int, Dict[str, Any]] = {}
+
+        def stopped() -> bool:
+            return self.current_backup is None
+
+        def checkpoint(mid: int, state: str, dest_msg_id: Optional[int] = None):
+            if job_id is None:
+                return
+            try:
+                self.journal.mark(job_id, chat_info["id"], mid, state, dest_msg_id)
+            except Exception as e:
+                logger.warning("journal: checkpoint failed for %s: %s", mid, e)
 
-                        try:
-                            if med.get("is_photo"):
-                                await self.app.send_photo(
-                                    self.dest_channel,
-                                    downloaded,
-                                    caption=caption
-                                )
+        async def progress(text: str):
+            # best effort: intermediate status edits are dropped when the edit bucket is empty
+            if status_msg and rate_limiter.try_acquire(reply_chat, "edit"):
+                await safe_edit(status_msg, text)
 
-                            elif med.get("is_video"):
-                                final_video = downloaded
-
-                                if self.watermark_enabled:
-                                    dlog("🎨 [WATERMARK] applying watermark to", downloaded)
-                                    wm = await apply_video_watermark(downloaded)
-                                    dlog("🎨 [WATERMARK] watermark output:", wm)
-
-                                    if wm:
-                                        final_video = wm
-
-                                dlog("🖼️ [THUMBNAIL] generating thumbnail at 10s for", final_video)
-                                thumb = await generate_video_thumbnail(final_video, second=10)
-                                dlog("🖼️ [THUMBNAIL] thumbnail path:", thumb)
-
-                                dlog("⬆️ [UPLOAD] sending video", final_video)
-                                await self.app.send_video(
-                                    self.dest_channel,
-                                    final_video,
-                                    caption=caption,
-                                    thumb=thumb
-                                )
-
-                                if final_video != downloaded:
-                                    try:
-                                        os.remove(final_video)
-                                    except Exception:
-                                        pass
-
-                                if thumb:
-                                    try:
-                                        os.remove(thumb)
-                                    except Exception:
-                                        pass
+        async def publish(item: Dict[str, Any]):
+            async with ready_cond:
+                ready[item["seq"]] = item
+                ready_cond.notify_all()
 
-                            elif med.get("is_audio"):
-                                try:
-                                    await self.app.send_audio(
-                                        self.dest_channel,
-                                        downloaded,
-                                        caption=caption
-                                    )
-                                except Exception:
-                                    await self.app.send_document(
-                                        self.dest_channel,
-                                        downloaded,
-                                        caption=caption
-                                    )
-                            else:
-                                await self.app.send_document(
-                                    self.dest_channel,
-                                    downloaded,
-                                    caption=caption
-                                )
+        def forwardable(msg) -> bool:
+            try:
+                return hasattr(msg, "has_protected_content") and not msg.has_protected_content
+            except Exception:
+                return False
 
-                            done += 1
+        async def feeder():
+            # Ensure peer is present before fetching (helps fresh sessions)
+            try:
+                await self.ensure_peer(chat_info["id"])
+            except Exception as e:
+                dlog("process_backup: ensure_peer failed", e)
 
-                        except Exception:
-                            logger.exception("retry upload failed")
-                    except Exception:
-                        logger.exception("upload failed fallback")
-                    finally:
+            seq = 0
+            run: List[tuple] = []
+
+            async def unit(kind: str, pairs: List[tuple], sem: asyncio.Semaphore):
+                nonlocal seq
+                await sem.acquire()
+                seq += 1
+                slots[seq] = sem
+                await fetch_q.put((seq, kind, pairs))
+
+            async def flush(keep: int = 0):
+                nonlocal run
+                cut = len(run) - keep
+                out, run = run[:cut], run[cut:]
+                if out:
+                    await unit("run", out, runs_ahead)
+
+            try:
+                async for mid, msg in self.prefetch(chat_info["id"], ids):
+                    if stopped():
+                        break
+                    if not msg or forwardable(msg):
+                        if len(run) >= FORWARD_BATCH_SIZE:
+                            # never cut a source album in two: its start moves over to the next run
+                            gid = getattr(msg, "media_group_id", None)
+                            keep = 0
+                            while gid and keep < len(run) - 1 and getattr(run[-1 - keep][1], "media_group_id", None) == gid:
+                                keep += 1
+                            await flush(keep)
+                        run.append((mid, msg))
+                        continue
+                    await flush()
+                    await unit("one", [(mid, msg)], window)
+                await flush()
+            except Exception:
+                logger.exception("feeder failed for %s", chat_info.get("id"))
+            # end marker: the send stage stops after the last unit
+            await publish({"seq": seq + 1, "action": "end"})
+            for _ in range(self.fetch_workers):
+                await fetch_q.put(None)
+
+        async def inspect(seq: int, mid: int, msg) -> Dict[str, Any]:
+            """Fetched source message -> pipeline item, or a missing/skip marker."""
+            dlog("Processing", mid, "in", chat_info.get("id"))
+            dlog("fetch result for", mid, ":", type(msg))
+            try:
+                if DEBUG:
+                    dlog("PROCESS_BACKUP MSG PREVIEW:", "caption:", getattr(msg, "caption", None), "text:", getattr(msg, "text", None))
+                    dlog("PROCESS_BACKUP ENTITIES:", getattr(msg, "caption_entities", None), getattr(msg, "entities", None))
+            except Exception:
+                pass
+
+            if not msg:
+                return {"seq": seq, "mid": mid, "action": "missing"}
+
+            # If topic filter provided -> check message's topic id
+            if topic_id is not None:
+                try:
+                    msg_topic = await self.get_msg_topic_id(chat_info["id"], msg)
+                    dlog("msg_topic:", msg_topic, "expected:", topic_id)
+                    if msg_topic != topic_id:
+                        dlog("Skipping", mid, "not in topic", topic_id)
+                        return {"seq": seq, "mid": mid, "action": "skip", "reason": "not in topic"}
+                except Exception:
+                    dlog("topic check failed for", mid)
+                    return {"seq": seq, "mid": mid, "action": "skip", "reason": "topic-check error"}
+
+            return self._build_backup_item(chat_info, seq, mid, msg, dest)
+
+        async def fetch_worker():
+            while True:
+                job = await fetch_q.get()
+                if job is None:
+                    return
+                seq, kind, pairs = job
+                if kind == "run":
+                    items = []
+                    for mid, msg in pairs:
                         try:
-                            os.remove(downloaded)
+                            items.append(await inspect(seq, mid, msg))
                         except Exception:
+                            logger.exception("fetch stage failed for %s", mid)
+                            items.append({"seq": seq, "mid": mid, "action": "missing"})
+                    await publish({"seq": seq, "action": "run", "items": items})
+                    continue
+                mid, msg = pairs[0]
+                try:
+                    item = await inspect(seq, mid, msg)
+                    if item["action"] in ("missing", "skip"):
+                        await publish(item)
+                    elif item["action"] == "forward":
+                        await publish({"seq": seq, "action": "run", "items": [item]})
+                    elif self._lookup_cached_media(item):
+                        dlog("♻️ [DEDUP] file_unique_id already uploaded, skipping download for", mid)
+                        live[seq] = item
+                        await publish(item)
+                    else:
+                        live[seq] = item
+                        await download_q.put(item)
+                except Exception:
+                    logger.exception("fetch stage failed for %s", mid)
+                    await publish({"seq": seq, "mid": mid, "action": "missing"})
+
+        async def download_worker():
+            while True:
+                item = await download_q.get()
+                if item is None:
+                    return
+                try:
+                    await self._download_backup_item(item)
+                except Exception:
+                    logger.exception("download stage failed for %s", item["mid"])
+                if self._needs_transform(item):
+                    await transform_q.put(item)
+                else:
+                    await publish(item)
+
+        async def transform_worker():
+            while True:
+                item = await transform_q.get()
+                if item is None:
+                    return
+                try:
+                    await self._transform_backup_item(item)
+                except Exception:
+                    logger.exception("transform stage failed for %s", item["mid"])
+                await publish(item)
+
+        async def run_fetch():
+            await asyncio.gather(feeder(), *[fetch_worker() for _ in range(self.fetch_workers)])
+            for _ in range(self.download_workers):
+                await download_q.put(None)
+
+        async def run_downloads():
+            await asyncio.gather(*[download_worker() for _ in range(self.download_workers)])
+            for _ in range(self.transform_workers):
+                await transform_q.put(None)
+
+        async def run_transforms():
+            await asyncio.gather(*[transform_worker() for _ in range(self.transform_workers)])
+
+        async def take(seq: int):
+            """Wait for item `seq` to clear the earlier stages and hand it to the send stage; None once stopped."""
+            while not stopped():
+                async with ready_cond:
+                    if seq not in ready:
+                        try:
+                            await asyncio.wait_for(ready_cond.wait(), timeout=1.0)
+                        except asyncio.TimeoutError:
                             pass
+                    item = ready.pop(seq, None)
+                if item is not None:
+                    sem = slots.pop(seq, None)
+                    if sem:
+                        sem.release()
+                    live.pop(seq, None)
+                    return item
+            return None
+
+        def group_of(item: Dict[str, Any]):
+            return getattr(item.get("msg"), "media_group_id", None)
+
+        tasks = []
+        held = None  # item taken while probing an album's end, sent on the next turn
+        try:
+            try:
+                note = f" (resuming job #{job_id}: {resumed} already done)" if resumed else ""
+                status_msg = await self.app.send_message(reply_chat, f"🚀 Starting backup for {chat_info.get('title')} — {total} messages (topic_filter={topic_id}){note}")
+            except Exception:
+                status_msg = None
+
+            self.current_backup = (chat_info, 0, total, 0)
+            tasks = [
+                asyncio.create_task(run_fetch()),
+                asyncio.create_task(run_downloads()),
+                asyncio.create_task(run_transforms()),
+            ]
+
+            # ---- send stage: strictly in source order (i counts units, n source messages) ----
+            i = 1
+            n = 0
+            completed = True
+            while True:
+                if held is not None and stopped():
+                    item = None  # a stop wins over the item held back while probing an album's end (cleaned up below)
                 else:
-                    # Not downloadable: try to send caption or placeholder
-                    if caption and caption.strip():
+                    item, held = (held, None) if held is not None else (await take(i), None)
+                if item is None:
+                    completed = False
+                    if job_id is not None:
+                        self.journal.set_job_status(job_id, "stopped")
+                    if status_msg:
+                        await safe_edit(status_msg, "🛑 Backup stopped.")
+                    break
+                if item["action"] == "end":
+                    break
+
+                if item["action"] == "run":
+                    # a feeder run of forwardable (and missing/skipped) ids: one ForwardMessages call
+                    by_mid = {}
+                    for b in item["items"]:
+                        if b["action"] == "forward":
+                            by_mid[b["mid"]] = b
+                        elif b["action"] == "skip":
+                            checkpoint(b["mid"], "skipped")
+                        else:
+                            checkpoint(b["mid"], "missing")
+                    self.current_backup = (chat_info, n + 1, total, done)
+
+                    async def reupload(rejected_mid):
+                        # rejected by the server -> fall back to the download/re-upload path inline
+                        nonlocal done
+                        b = by_mid[rejected_mid]
+                        dlog("bulk forward rejected", rejected_mid, "- re-uploading")
                         try:
-                            await self.app.send_message(self.dest_channel, caption)
-                            done += 1
+                            await self._prepare_backup_item(b)
                         except Exception:
-                            logger.exception("send_message failed for text-only")
-                    else:
-                        placeholder = f"[deleted or non-downloadable message preserved]\nSource: {chat_info.get('title')} ({chat_info.get('id')})\nMsgID: {mid}"
-                        try:
-                            await self.app.send_message(self.dest_channel, placeholder)
+                            logger.exception("inline prepare failed for %s", rejected_mid)
+                        sent = await self._send_backup_item(b)
+                        if sent:
+                            checkpoint(rejected_mid, "done", getattr(sent, "id", None))
                             done += 1
-                        except Exception:
-                            try:
-                                await self.app.forward_messages(self.dest_channel, chat_info.get("id"), mid)
-                                done += 1
-                            except Exception:
-                                logger.exception("final forward fallback failed")
+                        else:
+                            checkpoint(rejected_mid, "failed")
 
-                if status_msg:
-                    await safe_edit(status_msg, f"Processing {i}/{total} — done {done}")
+                    mapped = await self.forward_bulk(chat_info["id"], list(by_mid), dest, fallback=reupload)
+                    for fmid, dest_mid in mapped.items():
+                        checkpoint(fmid, "done", dest_mid)
+                        done += 1
+                    i += 1
+                    n += len(item["items"])
+                    await progress(f"Processing {n}/{total} — forwarded {len(mapped)}/{len(by_mid)} in one batch (no protection) — done {done}")
+                    continue
 
-                await asyncio.sleep(random.randint(self.min_delay, self.max_delay))
+                mid = item["mid"]
+                self.current_backup = (chat_info, n + 1, total, done)
 
-            if status_msg:
-                await safe_edit(status_msg, f"✅ Completed — processed {done}/{total}")
+                if item["action"] == "missing":
+                    checkpoint(mid, "missing")
+                    logger.warning("Message %s not found in %s", mid, chat_info.get("id"))
+                    i += 1
+                    n += 1
+                    await progress(f"{n}/{total} processed — done {done} (missing {mid})")
+                    continue
+                if item["action"] == "skip":
+                    checkpoint(mid, "skipped")
+                    i += 1
+                    n += 1
+                    await progress(f"{n}/{total} processed — done {done} (skipped {mid} {item.get('reason')})")
+                    continue
+
+                # buffer the rest of a source album so it goes out as one send_media_group
+                album = [item]
+                gid = group_of(item)
+                while gid and len(album) < ALBUM_MAX:
+                    nxt = await take(i + len(album))
+                    if nxt is None:
+                        break
+                    if nxt.get("action") != "upload" or group_of(nxt) != gid:
+                        held = nxt
+                        break
+                    album.append(nxt)
+
+                sent_album = await self._send_backup_album(album) if len(album) > 1 else None
+                if sent_album:
+                    for b, sent in zip(album, sent_album):
+                        checkpoint(b["mid"], "done", getattr(sent, "id", None))
+                        done += 1
+                else:
+                    for b in album:
+                        sent = await self._send_backup_item(b)
+                        if sent:
+                            checkpoint(b["mid"], "done", getattr(sent, "id", None))
+                            done += 1
+                        else:
+                            checkpoint(b["mid"], "failed")
+
+                i += len(album)
+                n += len(album)
+                await progress(f"Processing {n}/{total} — done {done}" + (f" (album of {len(album)})" if sent_album else ""))
+
+            if completed:
+                if job_id is not None:
+                    self.journal.set_job_status(job_id, "done")
+                if status_msg:
+                    await safe_edit(status_msg, f"✅ Completed — processed {done}/{total}")
         finally:
+            for t in tasks:
+                t.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            # drop any files from items that never reached the send stage
+            for item in list(live.values()) + list(ready.values()) + ([held] if held else []):
+                self._cleanup_backup_item(item)
             self.current_backup = None
 
+    # ---------- live mirror ----------
+    async def latest_message_id(self, chat_id: int) -> int:
+        """Id of the newest message in chat_id (0 when its history cannot be read)."""
+        try:
+            async for msg in self.app.get_chat_history(chat_id, limit=1):
+                return msg.id
+        except Exception as e:
+            dlog("latest_message_id failed for", chat_id, e)
+        return 0
+
+    async def resolve_chat_ref(self, ref: str) -> Optional[int]:
+        """Chat id from a numeric id, a t.me/c/<internal> link or a @username / t.me/<username> link."""
+        ref = ref.strip()
+        if re.fullmatch(r"-?\d+", ref):
+            return int(ref)
+        parsed = parse_link(ref)
+        if parsed and parsed["kind"] == "internal" and str(parsed["root"]).isdigit():
+            return int(f"-100{parsed['root']}")
+        root = parsed["root"] if parsed else ref.rstrip("/").rsplit("/", 1)[-1]
+        try:
+            chat = await self.app.get_chat(root.lstrip("@"))
+            await self._remember_chat(chat)
+            return chat.id
+        except Exception as e:
+            dlog("resolve_chat_ref failed:", ref, e)
+            return None
+
+    def start_mirror(self, source: int):
+        task = self.mirror_tasks.get(source)
+        if task and not task.done():
+            return
+        self.mirror_queues.setdefault(source, asyncio.Queue())
+        self.mirror_tasks[source] = asyncio.create_task(self.mirror_worker(source))
+
+    def stop_mirror(self, source: int):
+        self.mirror_queues.pop(source, None)
+        task = self.mirror_tasks.pop(source, None)
+        if task:
+            task.cancel()
+
+    async def mirror_sync(self, rec: Dict[str, Any], msgs: list) -> int:
+        """
+        Post new source messages (a single message or one album) through the /tgprobackup stages:
+        server-side forward when the source allows it, otherwise dedup lookup -> download -> watermark
+        -> upload. Records source -> destination ids for later edits and advances the mirror's last id.
+        Returns how many messages were posted.
+        """
+        source, dest = rec["source"], rec["dest"]
+        msgs = [
+            m for m in msgs
+            if m and not getattr(m, "empty", False) and not getattr(m, "service", None) and m.id > rec["last_id"]
+        ]
+        if not msgs:
+            return 0
+        chat_info = {"id": source, "title": rec.get("title") or str(source)}
+        items = [self._build_backup_item(chat_info, seq, m.id, m, dest) for seq, m in enumerate(msgs, 1)]
+        posted: Dict[int, Optional[int]] = {}
+        try:
+            if all(it["action"] == "forward" for it in items):
+                by_mid = {it["mid"]: it for it in items}
+
+                async def reupload(rejected_mid):
+                    b = by_mid[rejected_mid]
+                    try:
+                        await self._prepare_backup_item(b)
+                    except Exception:
+                        logger.exception("inline prepare failed for %s", rejected_mid)
+                    sent = await self._send_backup_item(b)
+                    if sent:
+                        posted[rejected_mid] = getattr(sent, "id", None)
+
+                posted.update(await self.forward_bulk(source, list(by_mid), dest, fallback=reupload))
+            else:
+                for it in items:
+                    it["action"] = "upload"
+                    # text posts need no download: _send_backup_item sends the filtered text directly
+                    if media_of(it["msg"])[0] is None or self._lookup_cached_media(it):
+                        continue
+                    try:
+                        await self._prepare_backup_item(it)
+                    except Exception:
+                        logger.exception("mirror prepare failed for %s", it["mid"])
+                sent_album = await self._send_backup_album(items) if len(items) > 1 else None
+                if sent_album:
+                    for it, sent in zip(items, sent_album):
+                        posted[it["mid"]] = getattr(sent, "id", None)
+                else:
+                    for it in items:
+                        sent = await self._send_backup_item(it)
+                        if sent:
+                            posted[it["mid"]] = getattr(sent, "id", None)
+        finally:
+            for it in items:
+                self._cleanup_backup_item(it)
+        for mid, dest_id in posted.items():
+            try:
+                self.mirrors.map(source, mid, dest, dest_id)
+            except Exception as e:
+                logger.warning("mirror: map failed for %s/%s: %s", source, mid, e)
+        if len(posted) < len(items):
+            logger.warning("mirror: %s/%s of %s not posted", len(items) - len(posted), len(items), [it["mid"] for it in items])
+        last = max(m.id for m in msgs)
+        self.mirrors.advance(source, last)
+        rec["last_id"] = max(rec["last_id"], last)
+        return len(posted)
+
+    async def mirror_edit(self, rec: Dict[str, Any], msg):
+        """Apply a source edit to its destination copy (text or caption, through the filters)."""
+        source, dest = rec["source"], rec["dest"]
+        dest_id = self.mirrors.lookup(source, msg.id, dest)
+        if dest_id is None:
+            if msg.id > rec["last_id"]:
+                await self.mirror_sync(rec, [msg])  # edited before it was mirrored: post the current version
+            else:
+                self.mirror_unmirrored[source] = self.mirror_unmirrored.get(source, 0) + 1
+                logger.warning("mirror: edit of %s/%s not mirrored, no destination id recorded", source, msg.id)
+            return
+        text = self._build_backup_item({"id": source, "title": rec.get("title")}, 0, msg.id, msg, dest)["caption"]
+        try:
+            if getattr(msg, "text", None) is not None:
+                if text.strip():
+                    await rate_limiter.call(dest, "edit", self.app.edit_message_text, dest, dest_id, text)
+            elif media_of(msg)[0] is not None:
+                await rate_limiter.call(dest, "edit", self.app.edit_message_caption, dest, dest_id, text)
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            logger.warning("mirror: edit of %s -> %s/%s failed: %s", msg.id, dest, dest_id, e)
+
+    async def mirror_catch_up(self, source: int) -> int:
+        """Gap-fill: post everything after the stored last id up to the newest source message."""
+        rec = self.mirrors.get(source)
+        if not rec:
+            return 0
+        top = await self.latest_message_id(source)
+        if top <= rec["last_id"]:
+            return 0
+        ids = list(range(rec["last_id"] + 1, top + 1))
+        logger.info("mirror: catching up %s ids in %s after #%s", len(ids), source, rec["last_id"])
+        synced = 0
+        group: list = []
+        async for mid, msg in self.prefetch(source, ids):
+            if self.stop_flag.is_set() or source not in self.mirror_queues:
+                return synced
+            if not msg:
+                continue
+            gid = getattr(msg, "media_group_id", None)
+            if group and (not gid or gid != getattr(group[0], "media_group_id", None) or len(group) >= ALBUM_MAX):
+                synced += await self.mirror_sync(rec, group)
+                group = []
+            group.append(msg)
+        if group:
+            synced += await self.mirror_sync(rec, group)
+        # trailing deleted ids count as synced too
+        self.mirrors.advance(source, top)
+        rec["last_id"] = max(rec["last_id"], top)
+        return synced
+
+    async def mirror_worker(self, source: int):
+        """
+        Keep one source in sync: first the catch-up for whatever was posted while the bot was down,
+        then live updates in arrival order. One worker per source, so destination order == source
+        order and an edit never overtakes the post it edits. Album parts arriving as separate
+        updates are held up to MIRROR_ALBUM_WAIT seconds so they go out as one media group.
+        """
+        queue = self.mirror_queues[source]
+        try:
+            await self.ensure_peer(source)
+            await self.mirror_catch_up(source)
+        except Exception:
+            logger.exception("mirror catch-up failed for %s", source)
+        held = None
+        while not self.stop_flag.is_set():
+            if held is not None:
+                update, held = held, None
+            else:
+                try:
+                    update = await asyncio.wait_for(queue.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+            rec = self.mirrors.get(source)
+            if not rec:
+                return
+            kind, msg = update
+            try:
+                if kind == "edit":
+                    await self.mirror_edit(rec, msg)
+                    continue
+                group = [msg]
+                gid = getattr(msg, "media_group_id", None)
+                while gid and len(group) < ALBUM_MAX:
+                    try:
+                        nxt = await asyncio.wait_for(queue.get(), timeout=MIRROR_ALBUM_WAIT)
+                    except asyncio.TimeoutError:
+                        break
+                    if nxt[0] != "new" or getattr(nxt[1], "media_group_id", None) != gid:
+                        held = nxt
+                        break
+                    group.append(nxt[1])
+                await self.mirror_sync(rec, group)
+            except Exception:
+                logger.exception("mirror update failed for %s", source)
+
     async def start(self):
         await self.app.start()
         me = await self.app.get_me()
         logger.info("Logged in as: %s", getattr(me, "first_name", getattr(me, "id", str(me))))
-        # prefetch dialogs - increased to 2000 to better populate peers for fresh sessions
+        # warm the peer cache once (persisted peers + a single dialog scan when empty)
         try:
-            async for _ in self.app.get_dialogs(limit=2000):
-                pass
-        except Exception:
-            pass
+            await self.warm_peer_cache()
+        except Exception as e:
+            dlog("warm_peer_cache failed:", e)
         self.register_handlers()
         self.processor_task = asyncio.create_task(self.processor())
+        # live mirrors survive restarts; each worker gap-fills from its last synced id first
+        for rec in self.mirrors.all():
+            self.start_mirror(rec["source"])
 
     async def stop(self):
         self.stop_flag.set()
@@ -1770,6 +4409,8 @@ class BackupBotFinalV2:
                 await asyncio.wait_for(self.processor_task, timeout=5)
             except Exception:
                 pass
+        for source in list(self.mirror_tasks):
+            self.stop_mirror(source)
         try:
             await self.app.stop()
         except Exception:
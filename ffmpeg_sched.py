@@ -0,0 +1,205 @@
+"""
+Shared ffmpeg plumbing for the watermark bots (wm*.py and the backup bot)
+- FFmpegScheduler: process-wide admission control for ffmpeg/ffprobe subprocesses
+- probe_video: one ffprobe for codec / size / pix_fmt / fps / duration
+- libx264 preset stepping against an encode-time budget (plan_encode, x264_preset_for)
+- watermark_outputs: encode + thumbnail from one decode
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+from typing import Optional, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# ---------- ffmpeg scheduler ----------
+FFMPEG_SLOTS = max(1, int(os.environ.get("FFMPEG_SLOTS", "0")) or (os.cpu_count() or 1))
+PRIO_PROBE, PRIO_THUMB, PRIO_ENCODE = 0, 1, 2  # lower starts first
+PRIO_NAMES = {PRIO_PROBE: "probe", PRIO_THUMB: "thumb", PRIO_ENCODE: "encode"}
+
+class FFmpegCancelled(Exception):
+    pass
+
+class FFmpegScheduler:
+    """
+    Process-wide admission control for ffmpeg/ffprobe. At most `slots` subprocesses run at once; waiting
+    jobs start by priority (probe, then thumbnail, then full encodes) and FIFO within a priority.
+    Cancelling the awaiting task drops a queued job or kills its process; cancel_all() does the same for
+    every job (optionally only those submitted with a given tag).
+    """
+
+    def __init__(self, slots: int = FFMPEG_SLOTS):
+        self.slots = slots
+        self.running = 0
+        self._queue: list = []  # heap of (priority, seq, future, tag)
+        self._seq = itertools.count()
+        self._procs: Dict[Any, Any] = {}  # process -> tag
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "max_queue": 0}
+
+    def queue_depth(self) -> Dict[str, int]:
+        depth = {name: 0 for name in PRIO_NAMES.values()}
+        for prio, _, fut, _ in self._queue:
+            if not fut.done():
+                depth[PRIO_NAMES.get(prio, str(prio))] += 1
+        return depth
+
+    def describe(self) -> str:
+        depth = self.queue_depth()
+        queued = ", ".join(f"{k} {v}" for k, v in depth.items())
+        return (
+            f"ffmpeg {self.running}/{self.slots} running, queued {sum(depth.values())} ({queued}), "
+            f"done {self.stats['completed']}, failed {self.stats['failed']}, cancelled {self.stats['cancelled']}"
+        )
+
+    async def _acquire(self, priority: int, tag):
+        while self._queue and self._queue[0][2].done():
+            heapq.heappop(self._queue)
+        if self.running < self.slots and not self._queue:
+            self.running += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), fut, tag))
+        self.stats["max_queue"] = max(self.stats["max_queue"], sum(self.queue_depth().values()))
+        logger.info("⏳ [FFMPEG] %s job queued: %s", PRIO_NAMES.get(priority, priority), self.describe())
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self._release()  # the slot was handed over just before the cancel
+            raise
+
+    def _release(self):
+        while self._queue:
+            _, _, fut, _ = heapq.heappop(self._queue)
+            if not fut.done():
+                fut.set_result(None)  # hand the slot straight to the next job
+                return
+        self.running -= 1
+
+    async def run(self, cmd: List[str], priority: int = PRIO_ENCODE, timeout: Optional[float] = None, tag=None):
+        """Run cmd when a slot is free; returns (returncode, stdout, stderr). Raises asyncio.TimeoutError / FFmpegCancelled."""
+        self.stats["submitted"] += 1
+        try:
+            await self._acquire(priority, tag)
+        except (asyncio.CancelledError, FFmpegCancelled):
+            self.stats["cancelled"] += 1
+            raise
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            self._procs[proc] = tag
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+            except BaseException as e:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                self.stats["failed" if isinstance(e, asyncio.TimeoutError) else "cancelled"] += 1
+                raise
+            finally:
+                self._procs.pop(proc, None)
+            self.stats["completed" if proc.returncode == 0 else "failed"] += 1
+            return proc.returncode, stdout, stderr
+        finally:
+            self._release()
+
+    def cancel_all(self, tag=None) -> int:
+        """Fail queued jobs with FFmpegCancelled and kill running ones (only `tag`'s if given); returns the count."""
+        hit = 0
+        for _, _, fut, job_tag in self._queue:
+            if not fut.done() and (tag is None or job_tag == tag):
+                fut.set_exception(FFmpegCancelled())
+                hit += 1
+        for proc, job_tag in list(self._procs.items()):
+            if proc.returncode is None and (tag is None or job_tag == tag):
+                proc.kill()
+                hit += 1
+        return hit
+
+ffmpeg_scheduler = FFmpegScheduler()
+
+# ---------- probe + encode planning ----------
+# how many times realtime one libx264 "medium" process encodes 854x480 @ 30 fps on this host
+ENCODE_REALTIME_480P = float(os.environ.get("ENCODE_REALTIME_480P", "4"))
+X264_PRESETS = ["veryslow", "slower", "slow", "medium", "fast", "faster", "veryfast", "superfast", "ultrafast"]
+X264_SPEED = {"veryslow": 0.15, "slower": 0.3, "slow": 0.6, "medium": 1.0, "fast": 1.3,
+              "faster": 1.7, "veryfast": 2.6, "superfast": 4.0, "ultrafast": 6.0}
+X264_PIX_FMTS = {"yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p", "nv12"}
+
+async def probe_video(path: str) -> Dict[str, Any]:
+    """ffprobe the first video stream: codec, width, height, pix_fmt, fps, duration ({} when it fails)."""
+    try:
+        _, stdout, _ = await ffmpeg_scheduler.run([
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=codec_name,width,height,pix_fmt,avg_frame_rate:format=duration",
+            "-of", "json",
+            path
+        ], PRIO_PROBE)
+        data = json.loads(stdout.decode(errors="ignore") or "{}")
+        stream = (data.get("streams") or [{}])[0]
+        num, _, den = (stream.get("avg_frame_rate") or "0/1").partition("/")
+        return {
+            "codec": stream.get("codec_name"),
+            "width": int(stream.get("width") or 0),
+            "height": int(stream.get("height") or 0),
+            "pix_fmt": stream.get("pix_fmt"),
+            "fps": float(num) / float(den) if float(den or 0) else 0.0,
+            "duration": float((data.get("format") or {}).get("duration") or 0),
+        }
+    except Exception as e:
+        logger.warning("❌ [PROBE] ffprobe failed: %r", e)
+        return {}
+
+def encode_work(info: Dict[str, Any], width: int, height: int, jobs: int = 1) -> float:
+    """Estimated seconds of libx264 "medium" work for `info` encoded at width x height over `jobs` processes."""
+    fps = info.get("fps") or 30
+    duration = info.get("duration") or 0
+    return duration * (fps / 30) * (width * height) / (854 * 480) / (ENCODE_REALTIME_480P * max(1, jobs))
+
+def x264_preset_for(work: float, preset: str, crf: int, budget: float) -> tuple:
+    """Step from `preset` to faster presets (+1 CRF per step) until work / speed fits `budget`; (preset, crf)."""
+    idx = X264_PRESETS.index(preset) if preset in X264_PRESETS else X264_PRESETS.index("veryfast")
+    while work / X264_SPEED[X264_PRESETS[idx]] > budget and idx < len(X264_PRESETS) - 1:
+        idx += 1
+        crf += 1
+    return X264_PRESETS[idx], crf
+
+def x264_args(preset: str, crf: int, pix_fmt: Optional[str]) -> tuple:
+    """libx264 output args keeping the source pixel format when libx264 can; (args, pix_fmt used)."""
+    args = ["-c:v", "libx264", "-preset", preset, "-crf", str(crf)]
+    if pix_fmt:
+        pix_fmt = pix_fmt if pix_fmt in X264_PIX_FMTS else "yuv420p"
+        args += ["-pix_fmt", pix_fmt]
+    return args, pix_fmt
+
+def plan_encode(info: Dict[str, Any], preset: str, crf: int, budget: float) -> Dict[str, Any]:
+    """Keep the source pixel format and step to faster presets until the estimated encode time fits `budget`."""
+    width, height = info.get("width") or 854, info.get("height") or 480
+    work = encode_work(info, width, height)
+    preset, crf = x264_preset_for(work, preset, crf, budget)
+    args, pix_fmt = x264_args(preset, crf, info.get("pix_fmt"))
+    est = work / X264_SPEED[preset]
+    logger.info(
+        f"🎨 Encode plan: {width}x{height} {info.get('codec') or '?'}/{info.get('pix_fmt') or '?'} {info.get('duration') or 0:.0f}s "
+        f"→ preset={preset} crf={crf} pix_fmt={pix_fmt or 'auto'}, est ~{est:.0f}s (budget {budget}s)"
+    )
+    return {"args": args, "preset": preset, "crf": crf, "pix_fmt": pix_fmt, "est_seconds": est}
+
+def watermark_outputs(vf: str, video_args: List[str], output_path: str, thumb_path: Optional[str] = None,
+                      thumb_at: float = 10) -> List[str]:
+    """Output args of the watermark encode; with thumb_path the same decode also writes the thumbnail JPEG."""
+    if not thumb_path:
+        return ["-vf", vf, *video_args, "-c:a", "copy", output_path]
+    return [
+        "-filter_complex", f"[0:v]{vf},split=2[wm][th];[th]trim=start={thumb_at:.3f},setpts=PTS-STARTPTS[thumb]",
+        "-map", "[wm]", "-map", "0:a:0?", *video_args, "-c:a", "copy", output_path,
+        "-map", "[thumb]", "-frames:v", "1", "-q:v", "3", thumb_path,
+    ]
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("flask")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot_raw_backup_final_v9_wm_PYROGRAM_ONLY_FINAL_CLEAN as bot  # noqa: E402
+
+def text_rule(pattern, replace, scope="*"):
+    return {"kind": "text", "pattern": pattern, "replace": replace, "scope": scope}
+
+def test_more_specific_text_rule_wins():
+    sets = bot.ScopedFilters({"foo": "GLOBAL"}, [
+        text_rule("foo", "DEST", "dest:2"),
+        text_rule("foo", "SRC", "src:1"),
+        text_rule("foo", "STAR"),
+    ])
+    assert sets.apply("a foo b", src=5, dest=6) == "a STAR b"
+    assert sets.apply("a foo b", src=1, dest=6) == "a SRC b"
+    assert sets.apply("a foo b", src=1, dest=2) == "a DEST b"
+    assert sets.apply("a foo b", src=5, dest=2) == "a DEST b"
+
+def test_global_filter_applies_without_scoped_rule():
+    sets = bot.ScopedFilters({"foo": "GLOBAL"}, [text_rule("bar", "SRC", "src:1")])
+    assert sets.apply("foo bar", src=1, dest=2) == "GLOBAL SRC"
+    assert sets.apply("foo bar", src=5, dest=2) == "GLOBAL bar"
+
+def test_scoped_rule_overrides_global_key_in_other_case():
+    sets = bot.ScopedFilters({"Foo": "GLOBAL"}, [text_rule("foo", "SRC", "src:1")])
+    assert sets.apply("FOO", src=1) == "SRC"
+
+def test_later_rule_wins_within_a_scope():
+    sets = bot.ScopedFilters({}, [text_rule("foo", "OLD", "src:1"), text_rule("foo", "NEW", "src:1")])
+    assert sets.apply("foo", src=1) == "NEW"
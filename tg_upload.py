@@ -0,0 +1,100 @@
+"""
+Shared parallel upload for the bots (wm5.py and the backup bot)
+- save_file_part: one SaveFilePart / SaveBigFilePart call with FloodWait + retry handling
+- ParallelUploader: a local file as 512 KiB parts over several concurrent calls, returned as a raw InputFile
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Optional, List, Dict, Any
+
+from pyrogram.errors import FloodWait
+from pyrogram.raw import functions as raw_functions
+from pyrogram.raw import types as raw_types
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_PART = 512 * 1024  # max part size for upload.SaveFilePart / SaveBigFilePart
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024  # above this Telegram requires SaveBigFilePart + InputFileBig
+UPLOAD_WORKERS = max(1, int(os.environ.get("UPLOAD_WORKERS", "4")))
+UPLOAD_PART_RETRIES = 3
+
+async def save_file_part(app, file_id: int, idx: int, total_parts: int, is_big: bool, data: bytes):
+    """One upload.SaveFilePart / SaveBigFilePart call, retried through FloodWait and transient errors."""
+    if is_big:
+        query = raw_functions.upload.SaveBigFilePart(file_id=file_id, file_part=idx, file_total_parts=total_parts, bytes=data)
+    else:
+        query = raw_functions.upload.SaveFilePart(file_id=file_id, file_part=idx, bytes=data)
+    attempt = 0
+    while True:
+        try:
+            return await app.invoke(query)
+        except FloodWait as fw:
+            await asyncio.sleep(getattr(fw, "value", None) or getattr(fw, "seconds", None) or 10)
+        except Exception:
+            attempt += 1
+            if attempt > UPLOAD_PART_RETRIES:
+                raise
+
+def uploaded_input_file(file_id: int, total_parts: int, name: str, is_big: bool):
+    if is_big:
+        return raw_types.InputFileBig(id=file_id, parts=total_parts, name=name)
+    return raw_types.InputFile(id=file_id, parts=total_parts, name=name, md5_checksum="")
+
+class ParallelUploader:
+    """
+    Uploads a local file as 512 KiB parts over UPLOAD_WORKERS concurrent SaveBigFilePart calls
+    (SaveFilePart up to 10 MiB) and builds the raw InputFile/InputFileBig itself, ready for messages.SendMedia.
+    Per-part throughput of the last upload is kept in `last_stats` and summarised in the log.
+    """
+
+    def __init__(self, workers: int = UPLOAD_WORKERS):
+        self.workers = workers
+        self.last_stats: Dict[str, Any] = {}
+
+    async def upload(self, app, path: str, name: Optional[str] = None):
+        size = os.path.getsize(path)
+        is_big = size > BIG_FILE_THRESHOLD
+        total_parts = max(1, -(-size // UPLOAD_PART))
+        file_id = random.getrandbits(63)
+        next_part = iter(range(total_parts))
+        rates: List[float] = []
+
+        async def worker():
+            with open(path, "rb") as f:
+                for idx in next_part:
+                    f.seek(idx * UPLOAD_PART)
+                    data = f.read(UPLOAD_PART)
+                    t = time.monotonic()
+                    await save_file_part(app, file_id, idx, total_parts, is_big, data)
+                    rates.append(len(data) / max(time.monotonic() - t, 1e-6))
+
+        t0 = time.monotonic()
+        tasks = [asyncio.create_task(worker()) for _ in range(min(self.workers, total_parts))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        elapsed = max(time.monotonic() - t0, 1e-6)
+        mb = 1024 * 1024
+        self.last_stats = {
+            "parts": total_parts,
+            "bytes": size,
+            "seconds": elapsed,
+            "mbps": size / elapsed / mb,
+            "part_mbps_min": min(rates) / mb,
+            "part_mbps_avg": sum(rates) / len(rates) / mb,
+            "part_mbps_max": max(rates) / mb,
+        }
+        logger.info(
+            "⬆️ [UPLOAD] %s: %d parts x%d workers, %.1f MB/s overall, per part %.2f/%.2f/%.2f MB/s (min/avg/max)",
+            name or os.path.basename(path), total_parts, len(tasks), self.last_stats["mbps"],
+            self.last_stats["part_mbps_min"], self.last_stats["part_mbps_avg"], self.last_stats["part_mbps_max"],
+        )
+        return uploaded_input_file(file_id, total_parts, name or os.path.basename(path), is_big)
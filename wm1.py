@@ -15,6 +15,8 @@ from pyrogram import Client, filters
 from pyrogram.types import Message
 from pyrogram.errors import FloodWait
 
+from ffmpeg_sched import PRIO_THUMB, PRIO_ENCODE, ffmpeg_scheduler, probe_video, plan_encode, watermark_outputs
+
 # ---------- CONFIG ----------
 API_ID = int(os.environ.get("API_ID", 0))
 API_HASH = os.environ.get("API_HASH", "")
@@ -27,6 +29,11 @@ DEFAULT_WATERMARK_TEXT = os.environ.get("WATERMARK_TEXT", "@YourChannel")
 WATERMARK_STATE_FILE = "watermark_state.json"
 MAX_VIDEO_SIZE_MB = 2000  # Max video size to process (2GB)
 
+# Encode planner (ffprobe → preset/CRF/pix_fmt)
+WATERMARK_PRESET = os.environ.get("WATERMARK_PRESET", "fast")
+WATERMARK_CRF = int(os.environ.get("WATERMARK_CRF", 23))
+ENCODE_BUDGET = int(os.environ.get("ENCODE_BUDGET", 240))  # target seconds per watermark encode (ffmpeg is killed at 300)
+
 # ---------- LOGGING ----------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger("text_watermark_bot")
@@ -63,32 +70,21 @@ def save_watermark_state(enabled: bool):
         pass
 
 # ---------- TEXT WATERMARK FUNCTION ----------
-async def add_text_watermark(input_path: str, watermark_text: str, output_path: str = None, font_size: int = 30) -> Optional[str]:
+async def add_text_watermark(input_path: str, watermark_text: str, output_path: str = None, font_size: int = 30,
+                             thumb_second: Optional[int] = None, info: dict = None) -> tuple:
     """
     Add text watermark to video using ffmpeg drawtext
-    Returns path to watermarked video or None if failed
+    Returns (watermarked video, thumbnail or None) or (None, None) if failed
     """
     try:
         if not output_path:
             base, ext = os.path.splitext(input_path)
             output_path = f"{base}_watermarked{ext}"
         
-        # Get video dimensions to position watermark
-        probe_cmd = [
-            'ffprobe', '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height',
-            '-of', 'csv=p=0',
-            input_path
-        ]
-        
-        proc = await asyncio.create_subprocess_exec(
-            *probe_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        width, height = map(int, stdout.decode().strip().split(','))
+        # Probe once: dimensions position the watermark, the rest feeds the encode plan
+        info = info or await probe_video(input_path)
+        width, height = info["width"], info["height"]
+        plan = plan_encode(info, WATERMARK_PRESET, WATERMARK_CRF, ENCODE_BUDGET)
         
         # Position: bottom-right with 20px padding
         x_pos = width - 20
@@ -105,51 +101,49 @@ async def add_text_watermark(input_path: str, watermark_text: str, output_path:
             f"shadowx=2:shadowy=2:shadowcolor=black"
         )
         
+        # thumb_second: write the thumbnail from the same decode; its path is returned with the video
+        thumb_path = None
+        thumb_at = thumb_second or 0
+        if thumb_second is not None:
+            thumb_path = output_path.rsplit(".", 1)[0] + "_thumb.jpg"
+            if info.get("duration"):
+                thumb_at = min(thumb_second, info["duration"] / 2)
+
         cmd = [
             "ffmpeg",
             "-y",
             "-loglevel", "error",
             "-i", input_path,
-            "-vf", drawtext_filter,
-            "-c:v", "libx264",
-            "-preset", "fast",
-            "-crf", "23",
-            "-c:a", "copy",
-            output_path
+            *watermark_outputs(drawtext_filter, plan["args"], output_path, thumb_path, thumb_at)
         ]
         
         if DEBUG:
             logger.info(f"🎨 ffmpeg command: {' '.join(cmd)}")
         
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
         try:
-            stdout, stderr = await asyncio.wait_for(
-                proc.communicate(),
+            _, stdout, stderr = await ffmpeg_scheduler.run(
+                cmd,
+                PRIO_ENCODE,
                 timeout=300  # 5 minutes timeout
             )
         except asyncio.TimeoutError:
             logger.error("❌ ffmpeg timeout")
-            proc.kill()
-            return None
+            return None, None
         
         if stderr and DEBUG:
             logger.error(f"ffmpeg stderr: {stderr.decode()[:500]}")
         
         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             logger.info(f"✅ Text watermark added: {output_path}")
-            return output_path
+            thumb_ok = thumb_path and os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0
+            return output_path, thumb_path if thumb_ok else None
         else:
             logger.error("❌ Output file missing or empty")
-            return None
+            return None, None
             
     except Exception as e:
         logger.error(f"❌ Text watermark exception: {e}")
-        return None
+        return None, None
 
 async def generate_video_thumbnail(video_path: str, second: int = 10) -> Optional[str]:
     """Generate thumbnail from video at specified second"""
@@ -163,12 +157,7 @@ async def generate_video_thumbnail(video_path: str, second: int = 10) -> Optiona
             "-q:v", "3",
             thumb_path
         ]
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        await proc.communicate()
+        await ffmpeg_scheduler.run(cmd, PRIO_THUMB)
         
         if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
             return thumb_path
@@ -176,23 +165,11 @@ async def generate_video_thumbnail(video_path: str, second: int = 10) -> Optiona
         logger.error(f"Thumbnail generation failed: {e}")
     return None
 
-async def compress_video(input_path: str, target_size_mb: int = 50) -> Optional[str]:
+async def compress_video(input_path: str, target_size_mb: int = 50, info: dict = None) -> Optional[str]:
     """Compress video to target size using ffmpeg"""
     try:
-        # Get video duration
-        duration_cmd = [
-            'ffprobe', '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            input_path
-        ]
-        proc = await asyncio.create_subprocess_exec(
-            *duration_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        duration = float(stdout.decode().strip())
+        info = info or await probe_video(input_path)
+        duration = info.get("duration") or 0
         
         if duration <= 0:
             return None
@@ -213,8 +190,7 @@ async def compress_video(input_path: str, target_size_mb: int = 50) -> Optional[
             output_path
         ]
         
-        proc = await asyncio.create_subprocess_exec(*cmd)
-        await proc.communicate()
+        await ffmpeg_scheduler.run(cmd, PRIO_ENCODE)
         
         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             return output_path
@@ -273,9 +249,10 @@ class TextWatermarkBot:
             
             # Step 1: Compress if too large (over 500MB)
             current_path = video_path
+            info = await probe_video(video_path)  # one probe for compress, encode plan and send_video attributes
             if file_size_mb > 500:
                 await status_msg.edit_text(f"📦 Compressing {file_size_mb:.1f}MB video...")
-                compressed = await compress_video(video_path, target_size_mb=200)
+                compressed = await compress_video(video_path, target_size_mb=200, info=info)
                 if compressed:
                     current_path = compressed
                     compressed_size = os.path.getsize(compressed) / (1024 * 1024)
@@ -285,18 +262,20 @@ class TextWatermarkBot:
             
             # Step 2: Add text watermark if enabled
             final_path = current_path
+            thumbnail = None
             if self.watermark_enabled and self.watermark_text:
                 await status_msg.edit_text(f"✍️ Adding text watermark: '{self.watermark_text}'")
-                watermarked = await add_text_watermark(current_path, self.watermark_text, font_size=30)
+                watermarked, thumbnail = await add_text_watermark(current_path, self.watermark_text, font_size=30, thumb_second=10, info=info)
                 if watermarked:
                     final_path = watermarked
                     await status_msg.edit_text("✅ Text watermark added")
                 else:
                     await status_msg.edit_text("⚠️ Watermark failed, sending original")
             
-            # Step 3: Generate thumbnail
-            await status_msg.edit_text("📸 Generating thumbnail...")
-            thumbnail = await generate_video_thumbnail(final_path)
+            # Step 3: Generate thumbnail (unless the watermark pass wrote one)
+            if not thumbnail:
+                await status_msg.edit_text("📸 Generating thumbnail...")
+                thumbnail = await generate_video_thumbnail(final_path)
             
             # Step 4: Send watermarked video
             await status_msg.edit_text("📤 Uploading video...")
@@ -316,6 +295,9 @@ class TextWatermarkBot:
                 caption=caption,
                 thumb=thumbnail,
                 supports_streaming=True,
+                duration=int(info.get("duration") or 0),
+                width=info.get("width") or 0,
+                height=info.get("height") or 0
             )
             
             await status_msg.delete()
@@ -16,6 +16,8 @@ from pyrogram import Client, filters
 from pyrogram.types import Message
 from pyrogram.errors import FloodWait
 
+from ffmpeg_sched import PRIO_PROBE, PRIO_THUMB, PRIO_ENCODE, ffmpeg_scheduler, probe_video, plan_encode, watermark_outputs
+
 # ---------- CONFIG ----------
 API_ID = int(os.environ.get("API_ID", 0))
 API_HASH = os.environ.get("API_HASH", "")
@@ -28,6 +30,11 @@ DEFAULT_WATERMARK_TEXT = os.environ.get("WATERMARK_TEXT", "@YourChannel")
 WATERMARK_STATE_FILE = "watermark_state.json"
 MAX_VIDEO_SIZE_MB = 2000
 
+# Encode planner (ffprobe → preset/CRF/pix_fmt)
+WATERMARK_PRESET = os.environ.get("WATERMARK_PRESET", "ultrafast")
+WATERMARK_CRF = int(os.environ.get("WATERMARK_CRF", 28))
+ENCODE_BUDGET = int(os.environ.get("ENCODE_BUDGET", 600))  # target seconds per watermark encode
+
 # ---------- LOGGING ----------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger("batch_watermark_bot")
@@ -62,49 +69,51 @@ def save_watermark_state(enabled: bool):
         pass
 
 # ---------- FFMPEG FUNCTIONS (WORKING FROM wm2.py) ----------
-async def add_text_watermark(input_path: str, watermark_text: str, output_path: str = None, font_size: int = 30) -> Optional[str]:
+async def add_text_watermark(input_path: str, watermark_text: str, output_path: str = None, font_size: int = 30,
+                             thumb_second: Optional[int] = None, info: dict = None) -> tuple:
     """Add text watermark to video using ffmpeg drawtext"""
     try:
         if not output_path:
             base, ext = os.path.splitext(input_path)
             output_path = f"{base}_watermarked{ext}"
         
+        info = info or await probe_video(input_path)
+        plan = plan_encode(info, WATERMARK_PRESET, WATERMARK_CRF, ENCODE_BUDGET)
+
+        # thumb_second: write the thumbnail from the same decode; its path is returned with the video
+        thumb_path = None
+        thumb_at = thumb_second or 0
+        if thumb_second is not None:
+            thumb_path = output_path.rsplit(".", 1)[0] + "_thumb.jpg"
+            if info.get("duration"):
+                thumb_at = min(thumb_second, info["duration"] / 2)
+
         cmd = [
             "ffmpeg",
             "-y",
             "-i", input_path,
-            "-vf", f"drawtext=text='{watermark_text}':fontcolor=white:fontsize={font_size}:x=10:y=10",
-            "-c:v", "libx264",
-            "-preset", "ultrafast",
-            "-crf", "28",
-            "-c:a", "copy",
-            output_path
+            *watermark_outputs(f"drawtext=text='{watermark_text}':fontcolor=white:fontsize={font_size}:x=10:y=10", plan["args"], output_path, thumb_path, thumb_at)
         ]
         
         logger.info(f"🎨 Running ffmpeg...")
         
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await proc.communicate()
+        returncode, stdout, stderr = await ffmpeg_scheduler.run(cmd, PRIO_ENCODE)
         
-        if proc.returncode != 0:
+        if returncode != 0:
             logger.error(f"❌ FFmpeg error: {stderr.decode()[:500]}")
-            return None
+            return None, None
         
         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             logger.info(f"✅ Watermark added")
-            return output_path
+            thumb_ok = thumb_path and os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0
+            return output_path, thumb_path if thumb_ok else None
         else:
             logger.error("❌ Output file missing")
-            return None
+            return None, None
             
     except Exception as e:
         logger.error(f"❌ Exception: {e}")
-        return None
+        return None, None
 
 async def generate_video_thumbnail(video_path: str, second: int = 10) -> Optional[str]:
     """Generate thumbnail from video"""
@@ -118,8 +127,7 @@ async def generate_video_thumbnail(video_path: str, second: int = 10) -> Optiona
             "-q:v", "3",
             thumb_path
         ]
-        proc = await asyncio.create_subprocess_exec(*cmd)
-        await proc.communicate()
+        await ffmpeg_scheduler.run(cmd, PRIO_THUMB)
         
         if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
             return thumb_path
@@ -127,22 +135,11 @@ async def generate_video_thumbnail(video_path: str, second: int = 10) -> Optiona
         logger.error(f"Thumbnail failed: {e}")
     return None
 
-async def compress_video(input_path: str, target_size_mb: int = 50) -> Optional[str]:
+async def compress_video(input_path: str, target_size_mb: int = 50, info: dict = None) -> Optional[str]:
     """Compress video"""
     try:
-        duration_cmd = [
-            'ffprobe', '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            input_path
-        ]
-        proc = await asyncio.create_subprocess_exec(
-            *duration_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        duration = float(stdout.decode().strip())
+        info = info or await probe_video(input_path)
+        duration = info.get("duration") or 0
         
         if duration <= 0:
             return None
@@ -161,8 +158,7 @@ async def compress_video(input_path: str, target_size_mb: int = 50) -> Optional[
             output_path
         ]
         
-        proc = await asyncio.create_subprocess_exec(*cmd)
-        await proc.communicate()
+        await ffmpeg_scheduler.run(cmd, PRIO_ENCODE)
         
         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             return output_path
@@ -195,14 +191,9 @@ class BatchWatermarkBot:
     async def check_ffmpeg(self):
         """Check if ffmpeg is available"""
         try:
-            proc = await asyncio.create_subprocess_exec(
-                "ffmpeg", "-version",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
+            returncode, stdout, stderr = await ffmpeg_scheduler.run(["ffmpeg", "-version"], PRIO_PROBE)
             
-            if proc.returncode == 0:
+            if returncode == 0:
                 version_line = stdout.decode().split('\n')[0]
                 logger.info(f"✅ FFmpeg found: {version_line}")
                 return True
@@ -237,18 +228,20 @@ class BatchWatermarkBot:
             
             # Compress if needed
             current_path = video_path
+            info = await probe_video(video_path)  # one probe for the encode plan and send_video attributes
             
             # Add watermark
             await status_msg.edit_text(f"✍️ Adding watermark to video {index}/{total}...")
-            watermarked = await add_text_watermark(current_path, self.watermark_text)
+            watermarked, thumbnail = await add_text_watermark(current_path, self.watermark_text, thumb_second=10, info=info)
             
             if not watermarked:
                 await message.reply(f"❌ Failed to add watermark to video {index}/{total}")
                 return False
             
-            # Generate thumbnail
-            await status_msg.edit_text(f"📸 Generating thumbnail for video {index}/{total}...")
-            thumbnail = await generate_video_thumbnail(watermarked)
+            # Generate thumbnail (unless the watermark pass wrote one)
+            if not thumbnail:
+                await status_msg.edit_text(f"📸 Generating thumbnail for video {index}/{total}...")
+                thumbnail = await generate_video_thumbnail(watermarked)
             
             # Send video
             await status_msg.edit_text(f"📤 Uploading video {index}/{total}...")
@@ -264,7 +257,10 @@ Watermark: {'ON' if self.watermark_enabled else 'OFF'}"""
                 video=watermarked,
                 caption=caption,
                 thumb=thumbnail,
-                supports_streaming=True
+                supports_streaming=True,
+                duration=int(info.get("duration") or 0),
+                width=info.get("width") or 0,
+                height=info.get("height") or 0
             )
             
             # Cleanup
@@ -385,6 +381,7 @@ Watermark: {'ON' if self.watermark_enabled else 'OFF'}"""
                 await message.reply(
                     f"🎬 Processing batch...\n"
                     f"Watermark: {status}\n"
+                    f"⚙️ {ffmpeg_scheduler.describe()}\n"
                     f"Use `/cancel` to stop"
                 )
             else:
@@ -428,6 +425,7 @@ Watermark: {'ON' if self.watermark_enabled else 'OFF'}"""
         async def cancel_cmd(client, message: Message):
             if self.is_processing and message.chat.id == self.current_chat_id:
                 self.cancel_flag = True
+                ffmpeg_scheduler.cancel_all()  # stop the running encode too
                 await message.reply("🛑 Cancelling current batch...")
             elif self.collecting:
                 self.pending_videos = []
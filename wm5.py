@@ -8,13 +8,20 @@ Batch Text Watermark Bot
 
 import os
 import asyncio
+import hashlib
 import json
 import logging
+import random
 from typing import Optional, List, Dict
 from flask import Flask
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from pyrogram.errors import FloodWait
+from pyrogram.raw import functions as raw_functions, types as raw_types
+
+from ffmpeg_sched import PRIO_PROBE, PRIO_THUMB, PRIO_ENCODE, ffmpeg_scheduler, probe_video, plan_encode, watermark_outputs
+from tg_upload import ParallelUploader
+from wm_cache import WatermarkCache
 
 # ---------- CONFIG ----------
 API_ID = int(os.environ.get("API_ID", 0))
@@ -28,6 +35,18 @@ DEFAULT_WATERMARK_TEXT = os.environ.get("WATERMARK_TEXT", "@YourChannel")
 WATERMARK_STATE_FILE = "watermark_state.json"
 MAX_VIDEO_SIZE_MB = 2000
 
+# Encode planner (ffprobe → preset/CRF/pix_fmt)
+WATERMARK_PRESET = os.environ.get("WATERMARK_PRESET", "veryfast")
+WATERMARK_CRF = int(os.environ.get("WATERMARK_CRF", 28))
+ENCODE_BUDGET = int(os.environ.get("ENCODE_BUDGET", 600))  # target seconds per watermark encode
+
+# Batch pipeline (download video N+1 while N is encoded and N-1 uploads)
+PIPELINE_DEPTH = max(1, int(os.environ.get("PIPELINE_DEPTH", 3)))  # videos in flight per batch (bounds disk use)
+ENCODE_WORKERS = max(1, int(os.environ.get("ENCODE_WORKERS", 1)))  # concurrent watermark encodes per batch
+
+# Watermark output cache (same source file + same settings → reuse the encode); WM_CACHE_DIR / WM_CACHE_MB in wm_cache.py
+WM_CACHE_DB = "watermark_cache.db"
+
 # ---------- LOGGING ----------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger("batch_watermark_bot")
@@ -62,67 +81,80 @@ def save_watermark_state(enabled: bool):
         pass
 
 # ---------- FFMPEG FUNCTIONS (WORKING FROM wm2.py) ----------
+def watermark_filter(watermark_text: str) -> str:
+    """drawtext filter for the text watermark (also part of the cache key)"""
+    return (
+        f"drawtext="
+        f"text='{watermark_text}':"
+        f"fontcolor=white@0.35:"
+        f"shadowcolor=black@0.6:"
+        f"shadowx=2:"
+        f"shadowy=2:"
+        f"fontsize=h*0.018:"
+        f"x=10:"
+        f"y=10"
+    )
+
+def watermark_settings_hash(watermark_text: str) -> str:
+    """Fingerprint of everything that shapes a watermarked upload (filter, encoder settings)"""
+    settings = json.dumps([watermark_filter(watermark_text), WATERMARK_PRESET, WATERMARK_CRF, ENCODE_BUDGET])
+    return hashlib.sha1(settings.encode()).hexdigest()[:16]
+
 async def add_text_watermark(
     input_path: str,
     watermark_text: str,
-    output_path: str = None
-) -> Optional[str]:
+    output_path: str = None,
+    thumb_second: Optional[int] = None,
+    info: dict = None,
+    tag=None
+) -> tuple:
 
     try:
         if not output_path:
             base, ext = os.path.splitext(input_path)
             output_path = f"{base}_watermarked{ext}"
 
-        vf = (
-            f"drawtext="
-            f"text='{watermark_text}':"
-            f"fontcolor=white@0.35:"
-            f"shadowcolor=black@0.6:"
-            f"shadowx=2:"
-            f"shadowy=2:"
-            f"fontsize=h*0.018:"
-            f"x=10:"
-            f"y=10"
-        )
+        vf = watermark_filter(watermark_text)
+
+        info = info or await probe_video(input_path)
+        plan = plan_encode(info, WATERMARK_PRESET, WATERMARK_CRF, ENCODE_BUDGET)
+
+        # thumb_second: write the thumbnail from the same decode; its path is returned with the video
+        thumb_path = None
+        thumb_at = thumb_second or 0
+        if thumb_second is not None:
+            thumb_path = output_path.rsplit(".", 1)[0] + "_thumb.jpg"
+            if info.get("duration"):
+                thumb_at = min(thumb_second, info["duration"] / 2)
 
         cmd = [
             "ffmpeg",
             "-y",
             "-threads", "0",
             "-i", input_path,
-            "-vf", vf,
-            "-c:v", "libx264",
-            "-preset", "veryfast",
-            "-crf", "28",
-            "-c:a", "copy",
-            output_path
+            *watermark_outputs(vf, plan["args"], output_path, thumb_path, thumb_at)
         ]
 
         logger.info("🎨 Watermark processing started")
 
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-
-        _, stderr = await proc.communicate()
+        returncode, _, stderr = await ffmpeg_scheduler.run(cmd, PRIO_ENCODE, tag=tag)
 
-        if proc.returncode != 0:
+        if returncode != 0:
             logger.error(stderr.decode(errors="ignore")[:1000])
-            return None
+            return None, None
 
         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             logger.info("✅ Watermark completed")
-            return output_path
+            thumb_ok = thumb_path and os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0
+            return output_path, thumb_path if thumb_ok else None
 
-        return None
+        return None, None
 
     except Exception as e:
         logger.error(f"Watermark failed: {e}")
-        return None
+        return None, None
 
-async def generate_video_thumbnail(video_path: str, second: int = 10) -> Optional[str]:
+async def generate_video_thumbnail(video_path: str, second: int = 10, tag=None) -> Optional[str]:
     """Generate thumbnail from video"""
     try:
         thumb_path = video_path.rsplit(".", 1)[0] + "_thumb.jpg"
@@ -134,8 +166,7 @@ async def generate_video_thumbnail(video_path: str, second: int = 10) -> Optiona
             "-q:v", "3",
             thumb_path
         ]
-        proc = await asyncio.create_subprocess_exec(*cmd)
-        await proc.communicate()
+        await ffmpeg_scheduler.run(cmd, PRIO_THUMB, tag=tag)
         
         if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
             return thumb_path
@@ -143,22 +174,11 @@ async def generate_video_thumbnail(video_path: str, second: int = 10) -> Optiona
         logger.error(f"Thumbnail failed: {e}")
     return None
 
-async def compress_video(input_path: str, target_size_mb: int = 50) -> Optional[str]:
+async def compress_video(input_path: str, target_size_mb: int = 50, info: dict = None) -> Optional[str]:
     """Compress video"""
     try:
-        duration_cmd = [
-            'ffprobe', '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            input_path
-        ]
-        proc = await asyncio.create_subprocess_exec(
-            *duration_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        duration = float(stdout.decode().strip())
+        info = info or await probe_video(input_path)
+        duration = info.get("duration") or 0
         
         if duration <= 0:
             return None
@@ -177,8 +197,7 @@ async def compress_video(input_path: str, target_size_mb: int = 50) -> Optional[
             output_path
         ]
         
-        proc = await asyncio.create_subprocess_exec(*cmd)
-        await proc.communicate()
+        await ffmpeg_scheduler.run(cmd, PRIO_ENCODE)
         
         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             return output_path
@@ -187,6 +206,14 @@ async def compress_video(input_path: str, target_size_mb: int = 50) -> Optional[
     return None
 
 # ---------- BOT CLASS ----------
+def remove_files(*paths):
+    for path in set(paths):
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except Exception:
+            pass
+
 class BatchWatermarkBot:
     def __init__(self):
         self.app = Client(
@@ -199,26 +226,20 @@ class BatchWatermarkBot:
         self.watermark_text = DEFAULT_WATERMARK_TEXT
         self.downloads_dir = "downloads"
         os.makedirs(self.downloads_dir, exist_ok=True)
+        self.wm_cache = WatermarkCache(WM_CACHE_DB)
+        self.uploader = ParallelUploader()
         
-        # Batch processing variables
-        self.collecting = False
-        self.pending_videos: List[Dict] = []
-        self.collect_msg = None
-        self.is_processing = False
-        self.cancel_flag = False
-        self.current_chat_id = None
+        # Batch processing variables (per chat)
+        self.pending_videos: Dict[int, List[Dict]] = {}  # chat_id -> videos collected before /done
+        self.collect_msgs: Dict[int, Message] = {}
+        self.batches: Dict[int, Dict] = {}  # chat_id -> running batch (new videos join its queue)
     
     async def check_ffmpeg(self):
         """Check if ffmpeg is available"""
         try:
-            proc = await asyncio.create_subprocess_exec(
-                "ffmpeg", "-version",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
+            returncode, stdout, stderr = await ffmpeg_scheduler.run(["ffmpeg", "-version"], PRIO_PROBE)
             
-            if proc.returncode == 0:
+            if returncode == 0:
                 version_line = stdout.decode().split('\n')[0]
                 logger.info(f"✅ FFmpeg found: {version_line}")
                 return True
@@ -235,7 +256,7 @@ class BatchWatermarkBot:
     async def download_media(self, message: Message, video_data: Dict) -> Optional[str]:
         """Download video from message"""
         try:
-            file_path = os.path.join(self.downloads_dir, f"video_{message.id}.mp4")
+            file_path = os.path.join(self.downloads_dir, f"video_{message.chat.id}_{message.id}.mp4")
             await message.download(file_name=file_path)
             
             if os.path.exists(file_path):
@@ -246,27 +267,74 @@ class BatchWatermarkBot:
             logger.error(f"Download failed: {e}")
         return None
     
-    async def process_single_video(self, message: Message, video_path: str, index: int, total: int, status_msg: Message) -> bool:
-        """Process a single video with watermark"""
+    async def safe_edit(self, msg: Message, text: str):
+        """Best-effort status edit: pipeline stages edit the same message concurrently, so a rejected edit is only logged"""
         try:
-            file_size_mb = os.path.getsize(video_path) / (1024 * 1024)
-            
-            current_path = video_path
+            await msg.edit_text(text)
+        except Exception as e:
+            logger.debug(f"Status edit skipped: {e}")
+    
+    async def reply_video_parallel(self, message: Message, video_path: str, caption: str, thumbnail: Optional[str] = None,
+                                   info: dict = None):
+        """Reply with a video uploaded by ParallelUploader + messages.SendMedia"""
+        uploaded = await self.uploader.upload(self.app, video_path)
+        thumb = await self.uploader.upload(self.app, thumbnail) if thumbnail and os.path.exists(thumbnail) else None
+        info = info or {}
+        duration = int(info.get("duration") or 0) or getattr(getattr(message, "video", None), "duration", 0) or 0
+        await self.app.invoke(raw_functions.messages.SendMedia(
+            peer=await self.app.resolve_peer(message.chat.id),
+            media=raw_types.InputMediaUploadedDocument(
+                file=uploaded,
+                mime_type="video/mp4",
+                attributes=[
+                    raw_types.DocumentAttributeVideo(duration=duration, w=info.get("width") or 0, h=info.get("height") or 0, supports_streaming=True),
+                    raw_types.DocumentAttributeFilename(file_name=os.path.basename(video_path)),
+                ],
+                thumb=thumb,
+            ),
+            message=caption,
+            random_id=random.getrandbits(63),
+            reply_to_msg_id=message.id,
+        ))
+
+    async def watermark_video(self, message: Message, video_path: str, index: int, total: int, status_msg: Message,
+                              cache_key: Optional[tuple] = None) -> Optional[tuple]:
+        """Watermark a downloaded video; returns (watermarked, thumbnail, info) and removes the download"""
+        tag = message.chat.id  # /cancel kills only this chat's ffmpeg jobs
+        try:
+            info = await probe_video(video_path)  # one probe for the encode plan and send_video attributes
             
             # Add watermark
-            await status_msg.edit_text(f"✍️ Adding watermark to video {index}/{total}...")
-            watermarked = await add_text_watermark(current_path, self.watermark_text)
+            await self.safe_edit(status_msg, f"✍️ Adding watermark to video {index}/{total}...")
+            watermarked, thumbnail = await add_text_watermark(video_path, self.watermark_text, thumb_second=10, info=info, tag=tag)
             
             if not watermarked:
                 await message.reply(f"❌ Failed to add watermark to video {index}/{total}")
-                return False
+                return None
             
-            # Generate thumbnail
-            await status_msg.edit_text(f"📸 Generating thumbnail for video {index}/{total}...")
-            thumbnail = await generate_video_thumbnail(watermarked)
+            # Generate thumbnail (unless the watermark pass wrote one)
+            if not thumbnail:
+                thumbnail = await generate_video_thumbnail(watermarked, tag=tag)
+            if cache_key:
+                try:
+                    self.wm_cache.put(*cache_key, {"video": watermarked, "thumb": thumbnail, **info})
+                except Exception as e:
+                    logger.warning(f"Watermark cache store failed: {e}")
+            return watermarked, thumbnail, info
             
+        except Exception as e:
+            logger.error(f"Process failed: {e}")
+            await message.reply(f"❌ Error processing video {index}/{total}: {str(e)[:100]}")
+            return None
+        finally:
+            remove_files(video_path)
+    
+    async def send_watermarked(self, message: Message, watermarked: str, thumbnail: Optional[str], info: dict,
+                               index: int, total: int, status_msg: Message) -> bool:
+        """Upload a watermarked video (fresh or from the cache) and remove the local copies"""
+        try:
             # Send video
-            await status_msg.edit_text(f"📤 Uploading video {index}/{total}...")
+            await self.safe_edit(status_msg, f"📤 Uploading video {index}/{total}...")
             
             caption = f"""✅ Video {index}/{total} Processed
 
@@ -275,98 +343,161 @@ class BatchWatermarkBot:
 
 Watermark: {'ON' if self.watermark_enabled else 'OFF'}"""
             
-            await message.reply_video(
-                video=watermarked,
-                caption=caption,
-                thumb=thumbnail,
-                supports_streaming=True
-            )
+            try:
+                await self.reply_video_parallel(message, watermarked, caption, thumbnail, info)
+            except Exception as e:
+                logger.warning(f"Parallel upload failed, falling back to reply_video: {e}")
+                await message.reply_video(
+                    video=watermarked,
+                    caption=caption,
+                    thumb=thumbnail,
+                    supports_streaming=True,
+                    duration=int(info.get("duration") or 0),
+                    width=info.get("width") or 0,
+                    height=info.get("height") or 0
+                )
             
             # Cleanup
-            for path in {
-                video_path,
-                current_path,
-                watermarked,
-                thumbnail
-            }:
-                try:
-                    if path and os.path.exists(path):
-                        os.remove(path)
-                except Exception:
-                    pass
+            remove_files(watermarked, thumbnail)
 
             return True
            
             
         except Exception as e:
-            logger.error(f"Process failed: {e}")
-            await message.reply(f"❌ Error processing video {index}/{total}: {str(e)[:100]}")
+            logger.error(f"Upload failed: {e}")
+            await message.reply(f"❌ Error sending video {index}/{total}: {str(e)[:100]}")
+            remove_files(watermarked, thumbnail)
             return False
     
-    async def process_batch(self, message: Message):
-        """Process all pending videos one by one"""
-        total = len(self.pending_videos)
-        success_count = 0
-        
-        self.is_processing = True
-        self.cancel_flag = False
-        self.current_chat_id = message.chat.id
+    def start_batch(self, chat_id: int, videos: List[Dict]) -> Dict:
+        """Register a running batch for chat_id (synchronously, so videos sent from now on join it)"""
+        batch = {
+            "videos": videos,
+            "ok": 0,
+            "done": 0,
+            "cancel": False,
+            "tasks": set(),
+            "status_msg": None,
+            "inflight": asyncio.Semaphore(PIPELINE_DEPTH),
+            "download": asyncio.Semaphore(1),
+            "encode": asyncio.Semaphore(ENCODE_WORKERS),
+        }
+        self.batches[chat_id] = batch
+        return batch
+    
+    async def pipeline_video(self, message: Message, batch: Dict, idx: int,
+                             previous: asyncio.Event, uploaded: asyncio.Event):
+        """One video through download → watermark → upload; uploads wait for `previous` to keep the order"""
+        video_data = batch["videos"][idx - 1]
+        video_msg = video_data['message']
+        status_msg = batch["status_msg"]
+        files = []
+        try:
+            media = getattr(video_msg, "video", None) or getattr(video_msg, "document", None)
+            unique_id = getattr(media, "file_unique_id", None)
+            cache_key = (unique_id, watermark_settings_hash(self.watermark_text)) if unique_id else None
+            try:
+                cached = cache_key and self.wm_cache.get(
+                    *cache_key, self.downloads_dir, f"video_{video_msg.chat.id}_{video_msg.id}"
+                )
+            except Exception as e:
+                logger.warning(f"Watermark cache lookup failed: {e}")
+                cached = None
+            if cached:
+                # Same file + same watermark settings: skip download and ffmpeg
+                result = cached["video"], cached["thumb"], cached
+                files += result[:2]
+            else:
+                async with batch["download"]:
+                    await self.safe_edit(status_msg, f"📥 Downloading video {idx}/{len(batch['videos'])}...")
+                    video_path = await self.download_media(video_msg, video_data)
+                if not video_path:
+                    await message.reply(f"❌ Failed to download video {idx}/{len(batch['videos'])}")
+                    return
+                files.append(video_path)
+                async with batch["encode"]:
+                    result = await self.watermark_video(
+                        message, video_path, idx, len(batch['videos']), status_msg, cache_key
+                    )
+                if not result:
+                    return
+                files += result[:2]
+            
+            await previous.wait()
+            if batch["cancel"]:
+                return
+            if await self.send_watermarked(message, *result, idx, len(batch['videos']), status_msg):
+                batch["ok"] += 1
+        except Exception as e:
+            logger.error(f"Video {idx} failed: {e}")
+        finally:
+            remove_files(*files)
+            batch["done"] += 1
+            uploaded.set()
+            batch["inflight"].release()
+    
+    async def process_batch(self, message: Message, batch: Dict):
+        """Process the chat's videos in a download/encode/upload pipeline (PIPELINE_DEPTH videos in flight)"""
+        chat_id = message.chat.id
         
         # Send status message
         status_msg = await message.reply(
             f"🎬 Starting batch processing\n"
-            f"📊 Total videos: {total}\n"
+            f"📊 Total videos: {len(batch['videos'])}\n"
             f"✍️ Watermark: {self.watermark_text}\n\n"
-            f"🔄 Processing one by one...\n"
+            f"🔄 Download, watermark and upload run in parallel\n"
+            f"Send more videos to add them to this batch\n"
             f"Use /cancel to stop"
         )
+        batch["status_msg"] = status_msg
         
-        for idx, video_data in enumerate(self.pending_videos, 1):
-            # Check for cancel
-            if self.cancel_flag:
-                await status_msg.edit_text(
-                    f"🛑 Batch cancelled!\n"
-                    f"✅ Completed: {success_count}/{total}\n"
-                    f"❌ Remaining: {total - success_count}"
-                )
-                break
-            
-            # Download video
-            await status_msg.edit_text(f"📥 Downloading video {idx}/{total}...")
-            video_msg = video_data['message']
-            video_path = await self.download_media(video_msg, video_data)
-            
-            if not video_path:
-                await message.reply(f"❌ Failed to download video {idx}/{total}")
-                continue
-            
-            # Process video
-            success = await self.process_single_video(message, video_path, idx, total, status_msg)
-            if success:
-                success_count += 1
-            
-            # Delay between videos
-            await asyncio.sleep(2)
+        tasks = batch["tasks"]
+        previous = asyncio.Event()
+        previous.set()
+        started = 0
+        try:
+            while not batch["cancel"]:
+                if started < len(batch["videos"]):
+                    await batch["inflight"].acquire()
+                    if batch["cancel"]:
+                        batch["inflight"].release()
+                        break
+                    started += 1
+                    uploaded = asyncio.Event()
+                    task = asyncio.create_task(self.pipeline_video(message, batch, started, previous, uploaded))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    previous = uploaded
+                elif tasks:
+                    await asyncio.wait(set(tasks), return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    break
+        finally:
+            # Videos sent after this point start a new collection
+            if self.batches.get(chat_id) is batch:
+                del self.batches[chat_id]
+            for task in list(tasks):
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        
+        total = len(batch["videos"])
+        success_count = batch["ok"]
         
         # Final status
-        if not self.cancel_flag:
-            await status_msg.edit_text(
+        if not batch["cancel"]:
+            await self.safe_edit(status_msg,
                 f"✅ Batch completed!\n"
                 f"📊 Success: {success_count}/{total}\n"
                 f"✍️ Watermark: {self.watermark_text}\n\n"
                 f"Send more videos to process!"
             )
         else:
-            await status_msg.edit_text(
+            await self.safe_edit(status_msg,
                 f"🛑 Batch stopped!\n"
-                f"✅ Completed: {success_count}/{total}"
+                f"✅ Completed: {success_count}/{total}\n"
+                f"❌ Remaining: {total - success_count}"
             )
-        
-        # Reset
-        self.is_processing = False
-        self.pending_videos = []
-        self.collecting = False
-        self.current_chat_id = None
     
     def register_handlers(self):
         """Register bot commands"""
@@ -379,7 +510,8 @@ Watermark: {'ON' if self.watermark_enabled else 'OFF'}"""
                 f"*How to use:*\n"
                 f"1️⃣ Send multiple videos\n"
                 f"2️⃣ Type `/done` when ready\n"
-                f"3️⃣ Bot processes them one by one\n"
+                f"3️⃣ Bot downloads, watermarks and uploads them in parallel\n"
+                f"    (videos sent meanwhile join the running batch)\n"
                 f"4️⃣ Use `/cancel` to stop\n\n"
                 f"*Commands:*\n"
                 f"/setwatermark `<text>` - Change watermark\n"
@@ -393,19 +525,23 @@ Watermark: {'ON' if self.watermark_enabled else 'OFF'}"""
         @self.app.on_message(filters.command("status"))
         async def status_cmd(client, message: Message):
             status = "ON" if self.watermark_enabled else "OFF"
+            chat_id = message.chat.id
+            batch = self.batches.get(chat_id)
             
-            if self.collecting:
+            if chat_id in self.pending_videos:
                 await message.reply(
                     f"📥 Collecting videos...\n"
-                    f"Pending: {len(self.pending_videos)} videos\n"
+                    f"Pending: {len(self.pending_videos[chat_id])} videos\n"
                     f"Watermark: {status}\n"
                     f"Text: `{self.watermark_text}`\n\n"
                     f"Type `/done` to start processing"
                 )
-            elif self.is_processing:
+            elif batch:
                 await message.reply(
                     f"🎬 Processing batch...\n"
+                    f"✅ Done: {batch['done']}/{len(batch['videos'])} ({batch['ok']} sent)\n"
                     f"Watermark: {status}\n"
+                    f"⚙️ {ffmpeg_scheduler.describe()}\n"
                     f"Use `/cancel` to stop"
                 )
             else:
@@ -435,35 +571,46 @@ Watermark: {'ON' if self.watermark_enabled else 'OFF'}"""
         
         @self.app.on_message(filters.command("done"))
         async def done_cmd(client, message: Message):
-            if not self.collecting or len(self.pending_videos) == 0:
+            chat_id = message.chat.id
+            if not self.pending_videos.get(chat_id):
                 await message.reply("No pending videos. Send some videos first!")
                 return
             
-            if self.collect_msg:
-                await self.collect_msg.delete()
+            videos = self.pending_videos.pop(chat_id)
+            collect_msg = self.collect_msgs.pop(chat_id, None)
+            batch = self.start_batch(chat_id, videos)
+            if collect_msg:
+                await collect_msg.delete()
             
-            await message.reply(f"✅ Starting batch with {len(self.pending_videos)} videos...")
-            await self.process_batch(message)
+            await message.reply(f"✅ Starting batch with {len(videos)} videos...")
+            await self.process_batch(message, batch)
         
         @self.app.on_message(filters.command("cancel"))
         async def cancel_cmd(client, message: Message):
-            if self.is_processing and message.chat.id == self.current_chat_id:
-                self.cancel_flag = True
+            chat_id = message.chat.id
+            batch = self.batches.get(chat_id)
+            if batch:
+                batch["cancel"] = True
+                for task in list(batch["tasks"]):
+                    task.cancel()
+                ffmpeg_scheduler.cancel_all(chat_id)  # stop this chat's running encode too
                 await message.reply("🛑 Cancelling current batch...")
-            elif self.collecting:
-                self.pending_videos = []
-                self.collecting = False
-                if self.collect_msg:
-                    await self.collect_msg.delete()
+            elif chat_id in self.pending_videos:
+                del self.pending_videos[chat_id]
+                collect_msg = self.collect_msgs.pop(chat_id, None)
+                if collect_msg:
+                    await collect_msg.delete()
                 await message.reply("✅ Cleared pending videos")
             else:
                 await message.reply("ℹ️ No active batch to cancel")
         
         @self.app.on_message(filters.command("clear"))
         async def clear_cmd(client, message: Message):
-            if self.collecting:
-                self.pending_videos = []
-                await message.reply(f"✅ Cleared {len(self.pending_videos)} pending videos")
+            pending = self.pending_videos.get(message.chat.id)
+            if pending is not None:
+                count = len(pending)
+                pending.clear()
+                await message.reply(f"✅ Cleared {count} pending videos")
             else:
                 await message.reply("ℹ️ No pending videos")
         
@@ -482,16 +629,24 @@ Watermark: {'ON' if self.watermark_enabled else 'OFF'}"""
                 await message.reply(f"Video too large ({file_size_mb:.1f}MB). Max: {MAX_VIDEO_SIZE_MB}MB")
                 return
             
-            # If already processing, reject
-            if self.is_processing:
-                await message.reply("⚠️ Bot is busy processing a batch. Please try again later.")
+            chat_id = message.chat.id
+            video_data = {
+                'message': message,
+                'message_id': message.id,
+                'file_size': file_size_mb
+            }
+            
+            # If a batch is running in this chat, queue the video into it
+            batch = self.batches.get(chat_id)
+            if batch:
+                batch["videos"].append(video_data)
+                await message.reply(f"➕ Added to the running batch as video {len(batch['videos'])}")
                 return
             
             # Start collecting if not already
-            if not self.collecting:
-                self.collecting = True
-                self.pending_videos = []
-                self.collect_msg = await message.reply(
+            if chat_id not in self.pending_videos:
+                self.pending_videos[chat_id] = []
+                self.collect_msgs[chat_id] = await message.reply(
                     f"📥 Collecting videos...\n"
                     f"Send more videos or type `/done` to start processing\n"
                     f"Type `/clear` to clear all\n\n"
@@ -499,16 +654,18 @@ Watermark: {'ON' if self.watermark_enabled else 'OFF'}"""
                 )
             
             # Add to pending list
-            self.pending_videos.append({
-                'message': message,
-                'message_id': message.id,
-                'file_size': file_size_mb
-            })
+            pending = self.pending_videos.get(chat_id)
+            if pending is None:  # /cancel or /done raced with this video
+                return
+            pending.append(video_data)
             
             # Update collection message
-            await self.collect_msg.edit_text(
+            collect_msg = self.collect_msgs.get(chat_id)
+            if not collect_msg:
+                return
+            await self.safe_edit(collect_msg,
                 f"📥 Collecting videos...\n"
-                f"Received: {len(self.pending_videos)} video(s)\n"
+                f"Received: {len(pending)} video(s)\n"
                 f"Type `/done` to start processing\n"
                 f"Type `/clear` to clear all"
             )
@@ -0,0 +1,123 @@
+"""
+Shared watermark output cache for the bots (wm5.py and the backup bot)
+- WatermarkCache: watermarked video + thumbnail on disk, keyed by source file_unique_id + settings hash,
+  indexed in SQLite and LRU-evicted by size
+- link_or_copy: hard link with a copy fallback
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+WM_CACHE_DIR = os.environ.get("WM_CACHE_DIR", os.path.join("downloads", ".wmcache"))
+WM_CACHE_MB = int(os.environ.get("WM_CACHE_MB", "2048"))
+
+def link_or_copy(src: str, dst: str):
+    """Hard link (no extra bytes on the same filesystem), falling back to a copy."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class WatermarkCache:
+    """
+    Watermarked outputs kept on disk, keyed by source file_unique_id + a watermark settings hash, so a
+    re-run over the same videos skips both the download and ffmpeg. Files live under cache_dir as hard
+    links (or copies) of the job outputs, the index is the wm_cache table in the SQLite file at `path`,
+    and the least recently used entries are evicted once the cache grows past budget_mb.
+    """
+
+    def __init__(self, path: str, cache_dir: str = WM_CACHE_DIR, budget_mb: int = WM_CACHE_MB):
+        self.dir = cache_dir
+        self.budget = budget_mb * 1024 * 1024
+        os.makedirs(self.dir, exist_ok=True)
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS wm_cache ("
+            " unique_id TEXT NOT NULL, settings TEXT NOT NULL,"
+            " video TEXT NOT NULL, thumb TEXT, duration INTEGER, width INTEGER, height INTEGER,"
+            " size INTEGER NOT NULL, last_used REAL,"
+            " PRIMARY KEY (unique_id, settings))"
+        )
+
+    def get(self, unique_id: Optional[str], settings: str, dest_dir: str, prefix: str) -> Optional[Dict[str, Any]]:
+        """Link a cached output into dest_dir as <prefix>_wm.* (+ thumbnail); None on a miss."""
+        if not unique_id or self.budget <= 0:
+            return None
+        row = self.conn.execute(
+            "SELECT video, thumb, duration, width, height FROM wm_cache WHERE unique_id = ? AND settings = ?",
+            (unique_id, settings),
+        ).fetchone()
+        if not row:
+            return None
+        video, thumb = row[0], row[1]
+        if not os.path.exists(video):
+            self._drop(unique_id, settings)
+            return None
+        self.conn.execute(
+            "UPDATE wm_cache SET last_used = ? WHERE unique_id = ? AND settings = ?",
+            (time.time(), unique_id, settings),
+        )
+        os.makedirs(dest_dir, exist_ok=True)
+        out_video = os.path.join(dest_dir, f"{prefix}_wm{os.path.splitext(video)[1]}")
+        link_or_copy(video, out_video)
+        out_thumb = None
+        if thumb and os.path.exists(thumb):
+            out_thumb = os.path.join(dest_dir, f"{prefix}_wm_thumb.jpg")
+            link_or_copy(thumb, out_thumb)
+        return {"video": out_video, "thumb": out_thumb, "duration": row[2] or 0, "width": row[3] or 0, "height": row[4] or 0}
+
+    def put(self, unique_id: Optional[str], settings: str, job: Dict[str, Any]):
+        if not unique_id or self.budget <= 0 or not job.get("video"):
+            return
+        thumb_src = job.get("thumb") if job.get("thumb") and os.path.exists(job["thumb"]) else None
+        size = os.path.getsize(job["video"]) + (os.path.getsize(thumb_src) if thumb_src else 0)
+        if size > self.budget:
+            return
+        name = hashlib.sha1(f"{unique_id}:{settings}".encode("utf-8")).hexdigest()[:20]
+        video = os.path.join(self.dir, name + (os.path.splitext(job["video"])[1] or ".mp4"))
+        link_or_copy(job["video"], video)
+        thumb = None
+        if thumb_src:
+            thumb = os.path.join(self.dir, name + "_thumb.jpg")
+            link_or_copy(thumb_src, thumb)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO wm_cache (unique_id, settings, video, thumb, duration, width, height, size, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (unique_id, settings, video, thumb, job.get("duration") or 0, job.get("width") or 0, job.get("height") or 0, size, time.time()),
+        )
+        self._evict()
+
+    def _drop(self, unique_id: str, settings: str):
+        row = self.conn.execute(
+            "SELECT video, thumb FROM wm_cache WHERE unique_id = ? AND settings = ?", (unique_id, settings)
+        ).fetchone()
+        for p in row or ():
+            if p:
+                try:
+                    os.remove(p)
+                except Exception:
+                    pass
+        self.conn.execute("DELETE FROM wm_cache WHERE unique_id = ? AND settings = ?", (unique_id, settings))
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM wm_cache").fetchone()[0]
+        if total <= self.budget:
+            return
+        for unique_id, settings, size in self.conn.execute(
+            "SELECT unique_id, settings, size FROM wm_cache ORDER BY last_used ASC"
+        ).fetchall():
+            if total <= self.budget:
+                break
+            self._drop(unique_id, settings)
+            total -= size
+            logger.info("🧹 [WM-CACHE] evicted %s - cache now %d MB", unique_id, total // (1024 * 1024))